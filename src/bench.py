@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from argparse import ArgumentParser
+
+from benchmarks import middlewareBench, fileBench, jsonBench
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number",
+                        dest="number",
+                        type=int,
+                        default=10000,
+                        help="number of iterations")
+    
+    # Benchmarks
+    parser.add_argument("-m", "--middlewareBench",
+                        dest="middlewareBench",
+                        action="store_true",
+                        help="Middleware-Benchmark")
+    parser.add_argument("-f", "--fileBench",
+                        dest="fileBench",
+                        action="store_true",
+                        help="File-Benchmark")
+    parser.add_argument("-j", "--jsonBench",
+                        dest="jsonBench",
+                        action="store_true",
+                        help="JSON-RPC-Benchmark")
+    
+    args = parser.parse_args()
+    
+    benchmarks = []
+    
+    if args.middlewareBench:
+        benchmarks.append(middlewareBench)
+    
+    if args.fileBench:
+        benchmarks.append(fileBench)
+    
+    if args.jsonBench:
+        benchmarks.append(jsonBench)
+        
+    if not benchmarks:
+        benchmarks.append(middlewareBench)
+        benchmarks.append(fileBench)
+        benchmarks.append(jsonBench)
+        
+    for bench in benchmarks:
+        bench.run(args.number)
+        sys.stdout.write("\n")
+    
+if __name__ == "__main__":
+    main()
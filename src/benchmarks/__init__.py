@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import time
+import gc
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+try:
+    import tracemalloc  # python 3
+except ImportError:
+    tracemalloc = None
+
+from levitas.server import init_settings
+
+
+def environ(path="/", method="GET", body=b"", **headers):
+    """ Returns a WSGI environment for a request. """
+    env = {"PATH_INFO": path,
+           "REQUEST_METHOD": method,
+           "wsgi.input": BytesIO(body)}
+    if body:
+        env["CONTENT_LENGTH"] = str(len(body))
+    for k, v in headers.items():
+        env[k] = v
+    setup_testing_defaults(env)
+    return env
+
+
+def start_response(status, headers, exc_info=None):
+    return None
+
+
+def consume(result):
+    """ Iterate over a WSGI result like a server does. """
+    if result is not None:
+        for data in result:  # @UnusedVariable
+            pass
+        if hasattr(result, "close"):
+            result.close()
+            
+
+def measure(func, number=10000):
+    """
+    @return: Tuple of seconds per call and, under python 3,
+             the peak of traced memory in bytes per call.
+    """
+    gc.collect()
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        start = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        tracemalloc.stop()
+    t = time.time()
+    for i in range(number):  # @UnusedVariable
+        func()
+    return (time.time() - t) / number, peak
+
+
+def report(name, seconds, peak=None):
+    line = "%-40s %10.2f us" % (name, seconds * 1000000)
+    if peak is not None:
+        line += " %10d bytes" % peak
+    sys.stdout.write(line + "\n")
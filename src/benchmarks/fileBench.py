@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import socket
+import tempfile
+from threading import Thread
+
+from levitas.lib.filewrapper import FileWrapper
+
+
+FILE_SIZE = 32 * 1024 * 1024
+
+
+def drain(sock):
+    while sock.recv(1024 * 1024):
+        pass
+    
+
+def bench_send(name, send, path, repeat):
+    """ Sends the file repeat times through a socket pair """
+    total = 0
+    seconds = 0.0
+    for i in range(repeat):  # @UnusedVariable
+        server, client = socket.socketpair()
+        reader = Thread(target=drain, args=(client,))
+        reader.start()
+        f = open(path, "rb")
+        t = time.time()
+        send(f, server)
+        server.shutdown(socket.SHUT_WR)
+        reader.join()
+        seconds += time.time() - t
+        total += FILE_SIZE
+        f.close()
+        server.close()
+        client.close()
+    sys.stdout.write("%-40s %10.1f MB/s\n" % (name,
+                                              total / seconds / 1024 / 1024))
+    
+    
+def send_read4096(f, sock):
+    """ The former fallback of Middleware._getFilewrapper """
+    for data in iter(lambda: f.read(4096), b""):
+        sock.sendall(data)
+        
+        
+def send_iter(f, sock):
+    for data in FileWrapper(f):
+        sock.sendall(data)
+        
+        
+def send_buffered(f, sock):
+    FileWrapper(f)._sendbuffered(sock, 0)
+    
+    
+def send_transmit(f, sock):
+    FileWrapper(f).transmit(sock)
+    
+    
+def run(number=10000):
+    repeat = max(1, number // 1000)
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(FILE_SIZE))
+        sys.stdout.write("File transmission (%d x %d MB)\n"
+                         % (repeat, FILE_SIZE // 1024 // 1024))
+        bench_send("read 4096 blocks", send_read4096, path, repeat)
+        bench_send("FileWrapper iteration", send_iter, path, repeat)
+        bench_send("FileWrapper buffer", send_buffered, path, repeat)
+        bench_send("FileWrapper.transmit", send_transmit, path, repeat)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import json
+
+from levitas.lib.jsoncodec import CODECS, get_codec
+from levitas.lib.serviceregistry import get_registry
+from levitas.middleware.jsonMiddleware import ServiceHandler
+from benchmarks import measure, report
+
+
+SIZES = (("small", 1), ("medium", 100), ("large", 10000))
+""" Payloads with the given number of records """
+
+
+class EchoService(object):
+    
+    def echo(self, data):
+        return data
+    
+    def add(self, a, b, c=0):
+        return a + b + c
+    
+
+def payload(records):
+    return [{"id": i,
+             "name": u"Grüße %d" % i,
+             "tags": ["a", "b", "c"],
+             "value": i * 0.5,
+             "active": i % 2 == 0} for i in range(records)]
+
+
+def request(records):
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "method": "echo",
+                       "params": [payload(records)]}).encode("utf-8")
+
+
+def former_handle(data):
+    """ ServiceHandler before the codecs: new coder objects per request,
+    ASCII escaped output encoded again """
+    decoder = json.JSONDecoder(strict=False)
+    encoder = json.JSONEncoder(ensure_ascii=True, sort_keys=False)
+    req = decoder.decode(data.decode("utf-8"))
+    result = {"jsonrpc": "2.0", "id": req["id"],
+              "result": EchoService().echo(*req["params"])}
+    return encoder.encode(result).encode("utf-8")
+
+
+def former_dispatch(service, name, params):
+    """ Dispatch before the registry: attribute lookup, invalid params
+    detected by the TypeError of the call """
+    if not hasattr(service, name):
+        return None
+    try:
+        return getattr(service, name)(*params)
+    except TypeError:
+        return None
+
+
+def registry_dispatch(registry, service, name, params):
+    method = registry.get(name)
+    if method is None or method.check(params) is not None:
+        return None
+    return method.call(service, params)
+
+
+def run_dispatch(number):
+    service = EchoService()
+    registry = get_registry(EchoService)
+    sys.stdout.write("Method dispatch\n")
+    for label, params in (("valid params", [1, 2]),
+                          ("invalid params", [1])):
+        seconds, peak = measure(
+            lambda: former_dispatch(service, "add", params), number)
+        report("  former dispatch, %s" % label, seconds, peak)
+        seconds, peak = measure(
+            lambda: registry_dispatch(registry, service, "add", params),
+            number)
+        report("  registry, %s" % label, seconds, peak)
+
+
+def run(number=10000):
+    codecs = [name for name in sorted(CODECS) if CODECS[name][1]]
+    sys.stdout.write("JSON-RPC request (available codecs: %s)\n"
+                     % ", ".join(codecs))
+    for size, records in SIZES:
+        data = request(records)
+        n = max(1, number // records)
+        sys.stdout.write("%s payload, %d bytes\n" % (size, len(data)))
+        seconds, peak = measure(lambda: former_handle(data), n)
+        report("  former handler", seconds, peak)
+        for name in codecs:
+            handler = ServiceHandler(EchoService(), codec=get_codec(name))
+            seconds, peak = measure(lambda: handler.handleData(data), n)
+            report("  %s" % name, seconds, peak)
+    run_dispatch(number * 10)
+    
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+try:
+    import Cookie  # python 2
+except ImportError:
+    import http.cookies as Cookie  # python 3
+
+from levitas.middleware import Middleware
+from levitas.factory import MiddlewareFactory, FunctionFactory
+from levitas.signals import middleware_instanciated
+from levitas.lib import utils
+from benchmarks import (init_settings, environ, start_response,
+                        consume, measure, report)
+
+
+SETTINGS = \
+"""
+urls = []
+"""
+
+
+class HelloMiddleware(Middleware):
+    
+    def get(self):
+        return b"Hello World"
+
+
+class PooledHelloMiddleware(HelloMiddleware):
+    
+    POOL_SIZE = 8
+    
+    
+def hello(request):
+    return 200, [("Content-Type", "text/plain")], b"Hello World"
+    
+
+def bench_factory(middleware_class, number):
+    factory = MiddlewareFactory(r"^/hello$", middleware_class)
+    m = factory.match("/hello")
+    env = environ("/hello")
+    instances = [0]
+    
+    def count(**kwargs):
+        instances[0] += 1
+    middleware_instanciated.connect(count)
+    
+    def request():
+        env["wsgi.input"].seek(0)
+        consume(factory(env, start_response, m))
+    seconds, peak = measure(request, number)
+    middleware_instanciated.disconnect(count)
+    report(middleware_class.__name__, seconds, peak)
+    sys.stdout.write("%-40s %10d\n" % ("  instances created",
+                                       instances[0]))
+    
+
+def bench_function(number):
+    factory = FunctionFactory(r"^/hello$", hello)
+    m = factory.match("/hello")
+    env = environ("/hello")
+    
+    def request():
+        consume(factory(env, start_response, m))
+    seconds, peak = measure(request, number)
+    report("function handler", seconds, peak)
+    
+
+def bench_setup(number):
+    """ Per request setup of the base Middleware """
+    headers = {"HTTP_ACCEPT": "text/html,application/xhtml+xml",
+               "HTTP_ACCEPT_ENCODING": "gzip, deflate, br",
+               "HTTP_ACCEPT_LANGUAGE": "de-de,de;q=0.8,en-us;q=0.5",
+               "HTTP_USER_AGENT": "Mozilla/5.0 (X11; Linux x86_64)",
+               "HTTP_CONNECTION": "keep-alive",
+               "HTTP_CACHE_CONTROL": "max-age=0",
+               "HTTP_REFERER": "http://localhost/index.html"}
+    for i in range(20):
+        headers["HTTP_X_CUSTOM_%d" % i] = "value %d" % i
+    env = environ("/hello", **headers)
+    middleware = Middleware()
+    
+    def setup():
+        middleware.initEnviron(env, start_response)
+        middleware.reset()
+    seconds, peak = measure(setup, number)
+    report("Middleware.initEnviron", seconds, peak)
+    
+
+def bench_cookies(number):
+    """ Parsing of a cookie header with 50 cookies """
+    header = "; ".join(["cookie%d=%s" % (i, "v" * 40) for i in range(50)])
+    
+    def load():
+        Cookie.BaseCookie().load(header)
+    seconds, peak = measure(load, number // 10)
+    report("Cookie.BaseCookie.load", seconds, peak)
+    
+    def parse():
+        utils.parse_cookie(header)
+    seconds, peak = measure(parse, number // 10)
+    report("utils.parse_cookie", seconds, peak)
+    
+
+def run(number=10000):
+    init_settings(SETTINGS)
+    sys.stdout.write("Middleware per request (%d requests)\n" % number)
+    bench_setup(number)
+    bench_cookies(number)
+    bench_factory(HelloMiddleware, number)
+    bench_factory(PooledHelloMiddleware, number)
+    bench_function(number)
+
+
+if __name__ == "__main__":
+    run()
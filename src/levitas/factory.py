@@ -13,16 +13,97 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
 import logging
+from threading import Lock
+
+from levitas.lib.lrucache import LRUCache
+from levitas.lib.settings import Settings
+from levitas import response_codes
+from .request import Request
 
 
 log = logging.getLogger("levitas.factory")
 
+
+# Patterns which cannot be embedded into a combined regular expression:
+# numbered or named backreferences, conditional groups and global inline
+# flags, which are only allowed at the start of a pattern.
+UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)")
+
+SPECIAL_CHARS = ".^$*+?{}[]\\|()"
+
+
+def has_alternation(pattern):
+    """ Returns True if the pattern has a top-level alternation. """
+    depth = 0
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 1
+        elif in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            # A "]" directly after "[" or "[^" is a literal
+            if pattern[i + 1:i + 2] == "^":
+                i += 1
+            if pattern[i + 1:i + 2] == "]":
+                i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def literal_prefix(pattern):
+    """
+    Returns the literal text every path matched by the pattern
+    must start with, or an empty string.
+    """
+    if has_alternation(pattern):
+        return ""
+    i = 0
+    if pattern.startswith("^"):
+        i = 1
+    prefix = []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            literal = pattern[i + 1:i + 2]
+            if not literal or literal.isalnum():
+                break
+            step = 2
+        elif c in SPECIAL_CHARS:
+            break
+        else:
+            literal = c
+            step = 1
+        quantifier = pattern[i + step:i + step + 1]
+        if quantifier in ("*", "?", "{"):
+            break
+        prefix.append(literal)
+        if quantifier == "+":
+            break
+        i += step
+    return "".join(prefix)
+
    
 class MiddlewareFactory(object):
     """
     Factory class for middleware classes.
+    
+    If the POOL_SIZE of the middleware class is set,
+    the factory keeps up to POOL_SIZE instances and reuses them
+    for the following requests instead of creating new ones.
     """
     
     def __init__(self, pattern, middleware_class,
@@ -40,14 +121,312 @@ class MiddlewareFactory(object):
         self.middleware_class = middleware_class
         self.args = args
         self.kwargs = kwargs
+        self.pool_size = getattr(middleware_class, "POOL_SIZE", 0)
+        if hasattr(middleware_class, "compileRoute"):
+            middleware_class.compileRoute(*args, **kwargs)
+        self._pool = []
+        self._pool_lock = Lock()
         
     def match(self, path):
         log.debug("Test match %s" % self.pattern)
         return self.regex.match(path)
+    
+    def acquire(self):
+        """ Returns a pooled or a new middleware instance. """
+        if self.pool_size:
+            with self._pool_lock:
+                if self._pool:
+                    return self._pool.pop()
+        return self.middleware_class(*self.args, **self.kwargs)
+    
+    def release(self, middleware):
+        """ Resets the middleware and returns it to the pool. """
+        middleware.reset()
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(middleware)
         
     def __call__(self, environ, start_response, re_match=None):
-        middleware = self.middleware_class(*self.args, **self.kwargs)
+        middleware = self.acquire()
         middleware.re_match = re_match
         log.debug("Url groups: %s" % str(re_match.groups()))
         log.debug("Load middleware %s" % str(self.middleware_class))
-        return middleware(environ, start_response)
+        if not self.pool_size:
+            return middleware(environ, start_response)
+        
+        release = True
+        try:
+            result = middleware(environ, start_response)
+            if result is None or isinstance(result, (list, tuple)):
+                return result
+            # The result may still use the middleware while it is sent.
+            release = False
+            return PooledResult(result, lambda: self.release(middleware))
+        finally:
+            if release:
+                self.release(middleware)
+    
+    
+class PooledResult(object):
+    """
+    Wraps the result of a pooled middleware and returns the
+    middleware to the pool, when the server closes the result.
+    """
+    
+    def __init__(self, result, release):
+        self.result = result
+        self._release = release
+        
+    def __iter__(self):
+        return iter(self.result)
+    
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            if hasattr(self.result, "close"):
+                self.result.close()
+        finally:
+            if release is not None:
+                release()
+        
+        
+class FunctionFactory(MiddlewareFactory):
+    """
+    Factory for plain callables in settings.urls.
+    
+    The callable is called with a Request object, followed by
+    the arguments of the url definition. It returns either the body or
+    a tuple (status, headers, body). The status is a code or a status
+    line, the headers are a list of tuples or a dictionary.
+    The body is bytes, a string, None or an iterable of bytes.
+    
+    Example settings entry:
+    def health(request):
+        return 200, [("Content-Type", "text/plain")], "OK"
+    
+    urls = [(r"^/health$", health)]
+    """
+    
+    def __init__(self, pattern, func, *args, **kwargs):
+        MiddlewareFactory.__init__(self, pattern, func, *args, **kwargs)
+        self.func = func
+        settings = Settings()
+        if hasattr(settings, "encoding"):
+            self._encoding = settings.encoding
+        else:
+            self._encoding = "utf-8"
+            
+    def __call__(self, environ, start_response, re_match=None):
+        result = self.func(Request(environ, re_match),
+                           *self.args, **self.kwargs)
+        if isinstance(result, tuple):
+            status, headers, body = result
+        else:
+            status, headers, body = 200, [], result
+            
+        if isinstance(status, int):
+            try:
+                status = "%d %s" % (status, response_codes[status][0])
+            except KeyError:
+                status = "%d ???" % status
+        if isinstance(headers, dict):
+            headers = list(headers.items())
+        else:
+            headers = list(headers)
+            
+        if body is None:
+            body = [b""]
+        elif isinstance(body, bytes):
+            body = [body]
+        elif hasattr(body, "encode"):
+            body = [body.encode(self._encoding)]
+            
+        if isinstance(body, list):
+            for name, value in headers:  # @UnusedVariable
+                if name.lower() == "content-length":
+                    break
+            else:
+                size = sum(len(data) for data in body)
+                headers.append(("Content-Length", str(size)))
+            
+        start_response(status, headers)
+        if environ["REQUEST_METHOD"] == "HEAD":
+            return []
+        return body
+    
+    
+class PatternSet(object):
+    """
+    Matches a path against an ordered list of factories.
+    
+    Consecutive patterns are compiled into one alternation of the form
+    (pattern1)|(pattern2)|..., so a single regex run finds the first
+    matching factory. The index of the outermost matched group tells
+    which alternative matched. Patterns which cannot be combined
+    are matched on their own at their position in the list.
+    """
+    
+    def __init__(self, factories):
+        self.segments = []
+        chunk = []
+        for factory in factories:
+            if UNCOMBINABLE.search(factory.pattern):
+                self._addChunk(chunk)
+                chunk = []
+                self.segments.append((factory.regex, factory))
+            else:
+                chunk.append(factory)
+        self._addChunk(chunk)
+        
+    def _addChunk(self, factories):
+        if len(factories) == 1:
+            self.segments.append((factories[0].regex, factories[0]))
+        elif factories:
+            patterns = []
+            groups = {}
+            index = 1
+            for factory in factories:
+                patterns.append("(%s)" % factory.pattern)
+                groups[index] = factory
+                index += factory.regex.groups + 1
+            try:
+                regex = re.compile("|".join(patterns))
+            except re.error as err:
+                log.debug("Unable to combine url patterns: %s" % str(err))
+                for factory in factories:
+                    self.segments.append((factory.regex, factory))
+            else:
+                self.segments.append((regex, groups))
+        
+    def match(self, path):
+        """
+        @return: Tuple of the first matching factory and its match object
+                 or (None, None).
+        """
+        for regex, target in self.segments:
+            m = regex.match(path)
+            if m is not None:
+                if isinstance(target, dict):
+                    target = target[m.lastindex]
+                    m = target.regex.match(path)
+                return target, m
+        return None, None
+        
+        
+class PrefixNode(object):
+    """ Node of the literal prefix trie of MiddlewareRouter. """
+    
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.children = {}
+        self.factories = []
+        self.patterns = None
+        
+    def getPatterns(self, fallback, order):
+        """
+        Returns the PatternSet of all factories whose prefix ends at
+        this node or one of its ancestors, along with the fallback
+        factories without prefix, in the order of settings.urls.
+        """
+        if self.patterns is None:
+            factories = list(fallback)
+            node = self
+            while node is not None:
+                factories.extend(node.factories)
+                node = node.parent
+            factories.sort(key=order.get)
+            self.patterns = PatternSet(factories)
+        return self.patterns
+        
+        
+class MiddlewareRouter(object):
+    """
+    Looks up the MiddlewareFactory for a request path.
+    
+    The literal prefixes of the patterns, e.g. "/json/orders" of
+    r"^/json/orders", are stored in a trie. Walking the trie along
+    the path selects the few factories that can match at all.
+    Patterns without a usable prefix, like r"(?!/json/.*)^/.*$",
+    are candidates for every path. The candidates of a trie node
+    are compiled once into a single dispatch structure. The first
+    matching factory wins, exactly like testing every factory in
+    the order of settings.urls.
+    """
+    
+    def __init__(self, factories=None, cache_size=0):
+        """
+        @param factories: List of MiddlewareFactory objects.
+                          Factories appended to the list later
+                          are compiled with the next lookup.
+        @param cache_size: Number of request paths whose match result
+                           is cached. 0 disables the cache.
+        """
+        if factories is None:
+            factories = []
+        self.factories = factories
+        self.cache_size = cache_size
+        self._cache = None
+        self._compiled = None
+        self._size = -1
+        
+    def compile(self):
+        """ Compile the patterns of all factories. """
+        factories = list(self.factories)
+        log.debug("Compile %d url patterns" % len(factories))
+        root = PrefixNode()
+        fallback = []
+        order = {}
+        for i, factory in enumerate(factories):
+            order[factory] = i
+            prefix = literal_prefix(factory.pattern)
+            if not prefix:
+                fallback.append(factory)
+                continue
+            node = root
+            for c in prefix:
+                if c not in node.children:
+                    node.children[c] = PrefixNode(node)
+                node = node.children[c]
+            node.factories.append(factory)
+        self._compiled = (root, fallback, order)
+        self._size = len(factories)
+        # A new cache object, so lookups running concurrently
+        # cannot store results of the old url table.
+        if self.cache_size:
+            self._cache = LRUCache(self.cache_size)
+        
+    def resolve(self, path_info):
+        """
+        Normalizes the PATH_INFO of a request and looks up its factory.
+        
+        @param path_info: PATH_INFO of the request.
+        @return: Tuple of the matching factory and its match object
+                 or (None, None) if no factory matches.
+        """
+        if self._size != len(self.factories):
+            self.compile()
+        cache = self._cache
+        if cache is not None:
+            result = cache.get(path_info)
+            if result is not None:
+                return result
+        result = self.match(os.path.normpath(path_info))
+        if cache is not None and result[0] is not None:
+            cache.set(path_info, result)
+        return result
+        
+    def match(self, path):
+        """
+        @param path: The request path.
+        @return: Tuple of the matching factory and its match object
+                 or (None, None) if no factory matches.
+        """
+        if self._size != len(self.factories):
+            self.compile()
+        node, fallback, order = self._compiled
+        for c in path:
+            child = node.children.get(c)
+            if child is None:
+                break
+            node = child
+        return node.getPatterns(fallback, order).match(path)
@@ -14,10 +14,12 @@
 # limitations under the License.
 
 import os
+import inspect
 import logging
 
 from levitas.lib.settings import Settings
-from .factory import MiddlewareFactory
+from levitas.lib.compression import Compressor
+from .factory import MiddlewareFactory, FunctionFactory, MiddlewareRouter
 from .middleware import Middleware
 from .signals import (application_instanciated,
                       application_called)
@@ -36,9 +38,13 @@ class WSGIHandler(object):
         A url definition is a tuple with three parts:
         (r"/.*$", MiddlewareClass, {"arg": "value"})
             1. regular expression of the request path.
-            2. middleware class.
+            2. middleware class or a function handler.
             3. Arguments to instantiate the class.
         
+        A function handler is called with a levitas.request.Request
+        and returns the body or a tuple (status, headers, body),
+        see FunctionFactory.
+        
         Example:
         urls = [
             # (regular expression of the request path, middleware class,
@@ -52,6 +58,19 @@ class WSGIHandler(object):
        # Custom path to the favicon
        favicon = "/path/to/favicon.ico"
        
+       # Number of request paths whose matching url is cached
+       route_cache_size = 1000
+       
+       # Compress responses with gzip or deflate, see
+       # levitas.lib.compression.Compressor
+       compression = True
+       compression_min_size = 512
+       compression_types = ("text/*", "application/json-rpc")
+       compression_level = 6
+       compression_buffer_size = 1024 * 1024
+       # Maximum bytes of cached compressed bodies
+       compression_cache_size = 16 * 1024 * 1024
+       
        # Log to syslog
        syslog = True
        syslog_verbose = True
@@ -105,6 +124,22 @@ class WSGIHandler(object):
         self.factories = []
         for url in self.settings.urls:
             self.createFactory(url)
+        if hasattr(self.settings, "route_cache_size"):
+            cache_size = self.settings.route_cache_size
+        else:
+            cache_size = 0
+        self.router = MiddlewareRouter(self.factories, cache_size)
+        self.router.compile()
+        
+        if hasattr(self.settings, "compression") and self.settings.compression:
+            kwargs = {}
+            for name in ("min_size", "types", "level",
+                         "buffer_size", "cache_size"):
+                if hasattr(self.settings, "compression_" + name):
+                    kwargs[name] = getattr(self.settings, "compression_" + name)
+            self.compressor = Compressor(self._dispatch, **kwargs)
+        else:
+            self.compressor = None
         
         if hasattr(self.settings, "working_dir"):
             log.info("Set workingdir to %s" % self.settings.working_dir)
@@ -115,6 +150,7 @@ class WSGIHandler(object):
             urls = [urls]
         for url in urls:
             self.createFactory(url)
+        self.router.compile()
     
     def createFactory(self, url):
         regex = url[0]
@@ -129,10 +165,15 @@ class WSGIHandler(object):
             else:
                 args.append(p)
         log.debug("MiddlewareFactory: %s, %s, %s, %s" % (regex,
-                                                         middleware_class.__name__,
+                                                         getattr(middleware_class,
+                                                                 "__name__",
+                                                                 middleware_class),
                                                          str(args),
                                                          str(kwargs)))
-        factory = MiddlewareFactory(regex, middleware_class, *args, **kwargs)
+        if inspect.isclass(middleware_class):
+            factory = MiddlewareFactory(regex, middleware_class, *args, **kwargs)
+        else:
+            factory = FunctionFactory(regex, middleware_class, *args, **kwargs)
         self.factories.append(factory)
         
     def _error(self, environ, _startResponse, code):
@@ -169,6 +210,11 @@ class WSGIHandler(object):
                                 application=self,
                                 environ=environ)
         
+        if self.compressor is not None:
+            return self.compressor(environ, _startResponse)
+        return self._dispatch(environ, _startResponse)
+        
+    def _dispatch(self, environ, _startResponse):
         # Send favicon
         if self.favicon:
             self.send_response(200)
@@ -181,21 +227,15 @@ class WSGIHandler(object):
                 return self._error(environ, _startResponse, 404)
             
         # Look up factory for current path and call it.
-        path = os.path.normpath(environ["PATH_INFO"])
+        path = environ["PATH_INFO"]
         log.debug("Handling path %s" % path)
-        for factory in self.factories:
-            m = factory.match(path)
-            if m is not None:
-                try:
-                    log.debug("Url match pattern: %s" % factory.pattern)
-                    return factory(environ, _startResponse, m)
-                except Exception as err:
-                    log.error(str(err), exc_info=True)
-                    return self._error(environ, _startResponse, 500)
-                break
-        else:
+        factory, m = self.router.resolve(path)
+        if factory is None:
             log.error("No factory found for %s" % path, exc_info=True)
             return self._error(environ, _startResponse, 404)
-
-
-
+        try:
+            log.debug("Url match pattern: %s" % factory.pattern)
+            return factory(environ, _startResponse, m)
+        except Exception as err:
+            log.error(str(err), exc_info=True)
+            return self._error(environ, _startResponse, 500)
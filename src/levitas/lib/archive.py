@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mmap
+import stat
+import time
+import struct
+import zipfile
+import logging
+from threading import Lock
+
+from . import utils
+
+
+log = logging.getLogger("levitas.lib.archive")
+
+
+LOCAL_HEADER = struct.Struct("<4s5HLLLHH")
+""" The local file header of a zip member """
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveMember(object):
+    """
+    A file of an Archive.
+    The attributes st_mtime and st_size can be used like an os.stat result.
+    """
+
+    __slots__ = ("name", "offset", "st_size", "st_mtime",
+                 "ctype", "last_modified", "etag")
+
+    def __init__(self, name, offset, size, mtime, crc, mimetypes=None):
+        self.name = name
+        self.offset = offset
+        """ Position of the content in the archive file """
+        self.st_size = size
+        self.st_mtime = mtime
+        self.ctype = utils.guess_type(name, mimetypes)
+        self.last_modified = utils.time2netscape(mtime)
+        self.etag = '"%08x-%x"' % (crc, size)
+
+
+class Archive(object):
+    """
+    A zip file of stored (uncompressed) static files.
+    The file is mapped into memory and members are read
+    from slices of the map without copying.
+    """
+
+    def __init__(self, path, mimetypes=None):
+        """
+        @param path: Path of the zip file.
+        @param mimetypes: Custom mimetypes for utils.guess_type.
+        """
+        self.path = path
+        self.members = {}
+        """ Dictionary of the member names and the ArchiveMembers """
+        self.dirs = set()
+        """ Names of the directories in the archive """
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            self.stat = os.fstat(self._fd)
+            if not self.stat.st_size:
+                raise ArchiveError("%s: Empty file" % path)
+            self.map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            self._readIndex(mimetypes)
+        except Exception:
+            os.close(self._fd)
+            self._fd = None
+            raise
+
+    def _readIndex(self, mimetypes):
+        # The path may refer to another file meanwhile
+        f = os.fdopen(os.dup(self._fd), "rb")
+        try:
+            zf = zipfile.ZipFile(f, "r")
+        except (zipfile.BadZipfile, IOError) as err:
+            f.close()
+            raise ArchiveError("%s: %s" % (self.path, str(err)))
+        try:
+            for info in zf.infolist():
+                name = info.filename
+                if name.endswith("/"):
+                    self.dirs.add(name.rstrip("/"))
+                    continue
+                if info.compress_type != zipfile.ZIP_STORED:
+                    log.warning("Compressed member %s of %s is skipped"
+                                % (name, self.path))
+                    continue
+                header = LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+                if header[0] != b"PK\x03\x04":
+                    raise ArchiveError("%s: Bad header of %s"
+                                       % (self.path, name))
+                offset = info.header_offset + LOCAL_HEADER.size + \
+                    header[9] + header[10]
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                self.members[name] = ArchiveMember(name, offset,
+                                                   info.file_size, mtime,
+                                                   info.CRC, mimetypes)
+                parts = name.split("/")[:-1]
+                for i in range(len(parts)):
+                    self.dirs.add("/".join(parts[:i + 1]))
+        finally:
+            zf.close()
+            f.close()
+        self.dirs.add("")
+
+    def fileno(self):
+        return self._fd
+
+    def open(self, member):
+        """ Returns a file like object of the archive for a member """
+        return ArchiveReader(self, member)
+
+    def __del__(self):
+        # Readers of running responses keep the archive alive
+        if getattr(self, "_fd", None) is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ArchiveReader(object):
+    """
+    File like object of one member of an Archive.
+    Positions are relative to the archive file, so the fileno can be used
+    with os.sendfile. Each response uses its own reader.
+    """
+
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.pos = member.offset
+        self.end = member.offset + member.st_size
+
+    def fileno(self):
+        return self.archive.fileno()
+
+    def seek(self, pos, whence=0):
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.end if size is None or size < 0 \
+            else min(self.end, self.pos + size)
+        data = self.archive.view[self.pos:end].tobytes()
+        self.pos += len(data)
+        return data
+
+    def readinto(self, b):
+        end = min(self.end, self.pos + len(b))
+        n = max(0, end - self.pos)
+        b[:n] = self.archive.view[self.pos:end]
+        self.pos += n
+        return n
+
+
+class ArchiveLoader(object):
+    """
+    Opens an archive and reopens it, when the file was replaced.
+    The file is checked with os.stat, when it is older than
+    interval seconds.
+    """
+
+    def __init__(self, path, interval=2.0, mimetypes=None):
+        self.path = path
+        self.interval = interval
+        self.mimetypes = mimetypes
+        self._archive = None
+        self._checked = 0
+        self._lock = Lock()
+
+    def get(self):
+        """ Returns the current Archive or None, if it cannot be read """
+        if time.time() - self._checked < self.interval:
+            return self._archive
+        with self._lock:
+            if time.time() - self._checked < self.interval:
+                return self._archive
+            try:
+                st = os.stat(self.path)
+            except OSError as err:
+                log.error("Unable to stat archive %s: %s"
+                          % (self.path, str(err)))
+                st = None
+            archive = self._archive
+            if st is None or not stat.S_ISREG(st.st_mode):
+                archive = None
+            elif archive is None or \
+                (archive.stat.st_ino, archive.stat.st_mtime,
+                 archive.stat.st_size) != \
+                    (st.st_ino, st.st_mtime, st.st_size):
+                try:
+                    archive = Archive(self.path, self.mimetypes)
+                    log.info("Loaded %d files of archive %s"
+                             % (len(archive.members), self.path))
+                except (ArchiveError, IOError, OSError) as err:
+                    log.error("Unable to load archive %s: %s"
+                              % (self.path, str(err)))
+            self._archive = archive
+            self._checked = time.time()
+            return archive
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import gzip
+import json
+import time
+import shutil
+import zipfile
+import logging
+import multiprocessing
+from threading import Lock
+
+from . import utils
+
+
+log = logging.getLogger("levitas.lib.assets")
+
+
+COMPRESS_EXT = (".html", ".htm", ".css", ".js", ".json", ".map",
+                ".svg", ".xml", ".txt", ".appcache")
+""" Extensions of the files, which are precompressed """
+
+FINGERPRINT_EXT = (".css", ".js", ".map", ".json", ".svg", ".png", ".jpg",
+                   ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2",
+                   ".ttf", ".eot", ".otf")
+""" Extensions of the files, which get a fingerprinted name """
+
+ASSET_MANIFEST = "levitas-assets.json"
+""" Name of the manifest of the fingerprinted files """
+
+HASH_LENGTH = 8
+""" Number of hex digits of the content hash in a fingerprinted name """
+
+
+def compress_file(path, level=9):
+    """
+    Writes the gzip sidecar path.gz of a file.
+    No sidecar is written and an old one is removed,
+    if it would not be smaller than the file.
+
+    @return: Path of the sidecar or None.
+    """
+    gzpath = path + ".gz"
+    tmppath = gzpath + ".tmp"
+    with open(path, "rb") as src:
+        with open(tmppath, "wb") as dst:
+            mtime = os.path.getmtime(path)
+            gz = gzip.GzipFile(filename="", mode="wb", compresslevel=level,
+                               fileobj=dst, mtime=mtime)
+            try:
+                shutil.copyfileobj(src, gz, 64 * 1024)
+            finally:
+                gz.close()
+    if os.path.getsize(tmppath) >= os.path.getsize(path):
+        os.remove(tmppath)
+        if os.path.exists(gzpath):
+            os.remove(gzpath)
+        return None
+    os.rename(tmppath, gzpath)
+    return gzpath
+
+
+def _compress_file(args):
+    return compress_file(*args)
+
+
+def stale_files(root, extensions=COMPRESS_EXT):
+    """
+    Returns the files below root, whose gzip sidecar
+    is missing or older than the file.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for filename in filenames:
+            if filename.startswith(".") or \
+               os.path.splitext(filename)[1].lower() not in extensions:
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getmtime(path + ".gz") >= os.path.getmtime(path):
+                    continue
+            except OSError:
+                pass
+            files.append(path)
+    return files
+
+
+def precompress(root, extensions=COMPRESS_EXT, level=9, processes=None):
+    """
+    Writes gzip sidecars of the files below root in parallel processes.
+    Files with an up to date sidecar are skipped.
+
+    @param root: Directory of the files.
+    @param extensions: Extensions of the files to compress.
+    @param level: Compression level.
+    @param processes: Number of processes, default is the number of CPUs.
+    @return: List of the written sidecars.
+    """
+    files = stale_files(root, extensions)
+    log.info("Precompress %d files in %s" % (len(files), root))
+    if not files:
+        return []
+    args = [(path, level) for path in files]
+    if processes == 1 or len(files) == 1:
+        results = [_compress_file(a) for a in args]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_compress_file, args)
+        finally:
+            pool.close()
+            pool.join()
+    return [path for path in results if path]
+
+
+def pack(root, path):
+    """
+    Writes the files below root into a zip archive for ArchiveMiddleware.
+    The manifest of fingerprint is left out.
+    The files are stored uncompressed, so they can be sent from
+    a memory map. An existing archive is replaced atomically.
+
+    @param root: Directory of the files.
+    @param path: Path of the archive.
+    @return: Number of the packed files.
+    """
+    tmppath = path + ".tmp"
+    skip = (os.path.realpath(path), os.path.realpath(tmppath))
+    count = 0
+    try:
+        zf = zipfile.ZipFile(tmppath, "w", zipfile.ZIP_STORED,
+                             allowZip64=True)
+        try:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = sorted(d for d in dirnames
+                                     if not d.startswith("."))
+                for filename in sorted(filenames):
+                    filepath = os.path.join(dirpath, filename)
+                    if filename.startswith(".") or \
+                       os.path.realpath(filepath) in skip:
+                        continue
+                    arcname = os.path.relpath(filepath, root)
+                    if arcname == ASSET_MANIFEST:
+                        continue
+                    zf.write(filepath, arcname.replace(os.sep, "/"))
+                    count += 1
+        finally:
+            zf.close()
+        os.rename(tmppath, path)
+    except Exception:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+    log.info("Packed %d files of %s into %s" % (count, root, path))
+    return count
+
+
+def fingerprinted_name(name, digest):
+    """ Returns the name with the content hash: js/app.js -> js/app.<hash>.js """
+    base, ext = os.path.splitext(name)
+    return "%s.%s%s" % (base, digest[:HASH_LENGTH], ext)
+
+
+def _file_hash(path):
+    return utils.file_hash(path)
+
+
+def fingerprint(root, extensions=FINGERPRINT_EXT, processes=None,
+                manifest=ASSET_MANIFEST):
+    """
+    Writes the manifest of the content hashes of the files below root.
+    Files, whose size and modification time are unchanged since the
+    last manifest, keep their hash; the others are hashed in parallel
+    processes.
+
+    The manifest maps the names of the files relative to root to
+    their hash, size, modification time and fingerprinted name:
+    {"files": {"js/app.js": {"hash": ..., "size": ..., "mtime": ...,
+                             "path": "js/app.<hash>.js"}}}
+
+    @param root: Directory of the files.
+    @param extensions: Extensions of the files to fingerprint.
+    @param processes: Number of processes, default is the number of CPUs.
+    @param manifest: Path of the manifest relative to root.
+    @return: Dictionary of the files of the manifest.
+    """
+    manifest_path = os.path.join(root, manifest)
+    old = read_manifest(manifest_path)
+    files = {}
+    stale = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for filename in filenames:
+            if filename.startswith(".") or \
+               os.path.splitext(filename)[1].lower() not in extensions:
+                continue
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            st = os.stat(path)
+            entry = old.get(name)
+            if entry is not None and entry.get("size") == st.st_size and \
+               entry.get("mtime") == st.st_mtime:
+                files[name] = entry
+            else:
+                files[name] = {"size": st.st_size, "mtime": st.st_mtime}
+                stale.append(name)
+    log.info("Fingerprint %d of %d files in %s"
+             % (len(stale), len(files), root))
+    paths = [os.path.join(root, name) for name in stale]
+    if processes == 1 or len(paths) < 2:
+        digests = [_file_hash(path) for path in paths]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            digests = pool.map(_file_hash, paths)
+        finally:
+            pool.close()
+            pool.join()
+    for name, digest in zip(stale, digests):
+        files[name]["hash"] = digest
+        files[name]["path"] = fingerprinted_name(name, digest)
+    tmppath = manifest_path + ".tmp"
+    with open(tmppath, "w") as f:
+        json.dump({"files": files}, f, indent=1, sort_keys=True)
+    os.rename(tmppath, manifest_path)
+    return files
+
+
+def read_manifest(path):
+    """
+    Returns the files of a manifest written by fingerprint
+    or an empty dictionary, if it cannot be read.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f).get("files", {})
+    except (IOError, OSError, ValueError) as err:
+        log.debug("Unable to read manifest %s: %s" % (path, str(err)))
+        return {}
+
+
+class AssetManifest(object):
+    """
+    Fingerprinted names of a manifest written by fingerprint.
+    The manifest is read again, when it was modified.
+    It is checked with os.stat, when it is older than interval seconds.
+    """
+
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self._names = {}
+        self._stat = None
+        self._checked = 0
+        self._lock = Lock()
+
+    def resolve(self, path):
+        """
+        Returns the manifest entry of a fingerprinted name
+        and the name of the file or (None, None).
+        """
+        if time.time() - self._checked >= self.interval:
+            self._reload()
+        return self._names.get(path, (None, None))
+
+    def _reload(self):
+        with self._lock:
+            if time.time() - self._checked < self.interval:
+                return
+            try:
+                st = os.stat(self.path)
+                st = (st.st_ino, st.st_mtime, st.st_size)
+            except OSError:
+                st = None
+            if st != self._stat:
+                names = {}
+                for name, entry in read_manifest(self.path).items():
+                    if "path" in entry:
+                        names[entry["path"]] = (entry, name)
+                log.info("Loaded %d fingerprinted files of %s"
+                         % (len(names), self.path))
+                self._names = names
+                self._stat = st
+            self._checked = time.time()
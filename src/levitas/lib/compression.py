@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import zlib
+import hashlib
+import logging
+import multiprocessing
+
+from .lrucache import LRUCache
+
+
+log = logging.getLogger("levitas.lib.compression")
+
+
+DEFAULT_TYPES = ("text/*",
+                 "application/json",
+                 "application/json-rpc",
+                 "application/javascript",
+                 "application/x-javascript",
+                 "application/xml",
+                 "image/svg+xml")
+""" Content types, which are compressed by default """
+
+WBITS = {"gzip": 16 + zlib.MAX_WBITS,
+         "deflate": zlib.MAX_WBITS}
+""" zlib window bits of the supported content codings """
+
+
+_negotiated = LRUCache(256)
+
+
+def coded_etag(etag, coding):
+    """
+    Returns the ETag of the representation of a content coding.
+    Weak ETags stay the same.
+    """
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return '%s-%s"' % (etag[:-1], coding)
+
+
+def split_etag_coding(etag):
+    """
+    Splits the content coding from an ETag returned by coded_etag.
+
+    @return: Tuple of the ETag without coding and the coding or None.
+    """
+    if etag.endswith('"'):
+        for coding in WBITS:
+            suffix = '-%s"' % coding
+            if etag.endswith(suffix):
+                return etag[:-len(suffix)] + '"', coding
+    return etag, None
+
+
+def parse_accept_encoding(header):
+    """
+    Parses an Accept-Encoding header.
+
+    @return: Dictionary of the lower case content codings and their qvalues.
+    """
+    codings = {}
+    for item in header.split(","):
+        params = item.split(";")
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def accepts_coding(header, coding):
+    """ Returns True, if an Accept-Encoding header accepts the coding. """
+    codings = parse_accept_encoding(header)
+    return codings.get(coding, codings.get("*", 0.0)) > 0
+
+
+def negotiate(header):
+    """
+    Returns the preferred content coding of an Accept-Encoding header
+    or None, if the client does not accept a supported coding.
+    """
+    coding = _negotiated.get(header, False)
+    if coding is not False:
+        return coding
+    codings = parse_accept_encoding(header)
+    star = codings.get("*", 0.0)
+    coding = None
+    best = 0.0
+    for c in ("gzip", "deflate"):
+        q = codings.get(c, star)
+        if q > best:
+            coding, best = c, q
+    _negotiated.set(header, coding)
+    return coding
+
+
+class CompressedResult(object):
+    """ Compresses the chunks of a wsgi result while it is sent """
+
+    def __init__(self, chunks, iterator, result, compressor):
+        self.chunks = chunks
+        self.iterator = iterator
+        self.result = result
+        self.compressor = compressor
+
+    def __iter__(self):
+        compress = self.compressor.compress
+        for chunk in self.chunks:
+            data = compress(chunk)
+            if data:
+                yield data
+        for chunk in self.iterator:
+            data = compress(chunk)
+            if data:
+                yield data
+        yield self.compressor.flush()
+
+    def close(self):
+        if hasattr(self.result, "close"):
+            self.result.close()
+
+
+class Compressor(object):
+    """
+    Wraps a wsgi application and compresses its responses with gzip or
+    deflate, if the client accepts it.
+
+    Only successful responses of an allowed content type are compressed.
+    Responses with a Content-Length smaller than min_size, with a
+    Content-Encoding or with Cache-Control no-transform are sent as they are.
+    Responses up to buffer_size bytes are compressed at once and sent
+    with a Content-Length; larger responses and responses without
+    Content-Length are compressed while they are streamed.
+
+    The compression level is reduced, when the load average per CPU
+    rises above 0.7 and falls to 1 above 1.0.
+
+    With a cache_size the compressed bodies of cacheable responses
+    are kept in a least recently used cache of at most cache_size bytes.
+    The key is the digest of the uncompressed body, so changed content
+    is never answered from the cache.
+    """
+
+    LOAD_INTERVAL = 1.0
+    """ Seconds between two checks of the load average """
+
+    def __init__(self, app,
+                 min_size=512,
+                 types=DEFAULT_TYPES,
+                 level=6,
+                 buffer_size=1024 * 1024,
+                 cache_size=0):
+        """
+        @param app: The wsgi application.
+        @param min_size: Minimum size of a compressed response.
+        @param types: Allowed content types. A type like text/* matches
+                      all subtypes.
+        @param level: Compression level without load.
+        @param buffer_size: Maximum size of a response compressed at once.
+        @param cache_size: Maximum size of all cached compressed bodies.
+        """
+        self.app = app
+        self.min_size = min_size
+        self.types = set(t for t in types if not t.endswith("/*"))
+        self.type_prefixes = tuple(t[:-1] for t in types if t.endswith("/*"))
+        self.max_level = level
+        self.buffer_size = buffer_size
+        if cache_size:
+            self.cache = LRUCache(cache_size, weight=len)
+        else:
+            self.cache = None
+        try:
+            self._cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            self._cpus = 1
+        self._level = level
+        self._level_checked = 0
+
+    @property
+    def level(self):
+        """ The compression level for the current load """
+        now = time.time()
+        if now - self._level_checked > self.LOAD_INTERVAL:
+            self._level_checked = now
+            try:
+                load = os.getloadavg()[0] / self._cpus
+            except (AttributeError, OSError):
+                load = 0.0
+            if load < 0.7:
+                self._level = self.max_level
+            elif load < 1.0:
+                self._level = max(1, self.max_level // 2)
+            else:
+                self._level = 1
+        return self._level
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+        coding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        if coding is None:
+            return self.app(environ, start_response)
+
+        response = []
+        chunks = []
+
+        def _start_response(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return chunks.append
+
+        result = self.app(environ, _start_response)
+        iterator = None
+        if not response:
+            # start_response is called with the first chunk
+            iterator = iter(result)
+            for chunk in iterator:
+                chunks.append(chunk)
+                break
+        status, headers, exc_info = response
+
+        if status.startswith("304"):
+            headers = self._notModified(environ, headers, coding)
+        length = self._compressible(status, headers)
+        if length is False:
+            start_response(status, headers, exc_info)
+            if not chunks and iterator is None:
+                return result
+            return CompressedResult(chunks, iterator or result, result,
+                                    _Identity())
+
+        headers = self._headers(headers, coding)
+        if length is not None and length <= self.buffer_size:
+            try:
+                body = b"".join(chunks) + b"".join(iterator or result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            data = self._compress(environ, headers, coding, body)
+            headers.append(("Content-Length", str(len(data))))
+            start_response(status, headers, exc_info)
+            return [data]
+
+        start_response(status, headers, exc_info)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[coding])
+        return CompressedResult(chunks, iterator or result, result, compressor)
+
+    def _compressible(self, status, headers):
+        """
+        Returns False, if the response is not compressed,
+        otherwise its Content-Length or None.
+        """
+        if not status.startswith("200"):
+            return False
+        length = None
+        ctype = None
+        for name, value in headers:
+            name = name.lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "content-type":
+                ctype = value.split(";")[0].strip().lower()
+            elif name == "content-encoding":
+                return False
+            elif name == "cache-control" and "no-transform" in value:
+                return False
+        if ctype is None:
+            return False
+        if ctype not in self.types and \
+           not ctype.startswith(self.type_prefixes):
+            return False
+        if length is not None and length < self.min_size:
+            return False
+        return length
+
+    def _headers(self, headers, coding):
+        result = []
+        vary = None
+        for name, value in headers:
+            lname = name.lower()
+            if lname in ("content-length", "accept-ranges"):
+                # Ranges are only sent of the uncompressed body
+                continue
+            if lname == "vary":
+                vary = value
+                continue
+            if lname == "etag":
+                # The compressed body is another representation
+                value = coded_etag(value, coding)
+            result.append((name, value))
+        if vary is None:
+            vary = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower() and vary != "*":
+            vary = "%s, Accept-Encoding" % vary
+        result.append(("Vary", vary))
+        result.append(("Content-Encoding", coding))
+        return result
+
+    def _notModified(self, environ, headers, coding):
+        """
+        Sends the ETag of the compressed representation with a 304,
+        if the client validated it.
+        """
+        tags = [tag.strip()
+                for tag in environ.get("HTTP_IF_NONE_MATCH", "").split(",")]
+        result = []
+        coded = False
+        for name, value in headers:
+            if name.lower() == "etag":
+                etag = coded_etag(value, coding)
+                if etag != value and etag in tags:
+                    value = etag
+                    coded = True
+            result.append((name, value))
+        if coded and not any(name.lower() == "vary" for name, _ in result):
+            result.append(("Vary", "Accept-Encoding"))
+        return result
+
+    def _compress(self, environ, headers, coding, body):
+        key = None
+        if self.cache is not None and self._cacheable(environ, headers):
+            key = (coding, hashlib.sha1(body).digest())
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[coding])
+        data = compressor.compress(body) + compressor.flush()
+        if key is not None:
+            self.cache.set(key, data)
+        return data
+
+    def _cacheable(self, environ, headers):
+        if environ.get("REQUEST_METHOD") != "GET":
+            return False
+        for name, value in headers:
+            name = name.lower()
+            if name == "set-cookie":
+                return False
+            if name == "cache-control" and ("no-store" in value or
+                                            "private" in value):
+                return False
+        return True
+
+
+class _Identity(object):
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
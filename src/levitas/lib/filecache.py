@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import time
+import logging
+from threading import Lock, Event
+
+from .lrucache import LRUCache
+
+
+log = logging.getLogger("levitas.lib.filecache")
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _unchanged(a, b):
+    if a is None or b is None:
+        return a is b
+    return (a.st_mtime, a.st_size, a.st_ino) == (b.st_mtime, b.st_size, b.st_ino)
+
+
+class CachedFile(object):
+    """
+    A file in the FileCache.
+    A missing file is cached with stat None.
+    The stat result and the content are read from the same open file.
+    """
+
+    OVERHEAD = 512
+    """ Bytes added to the weight of an entry """
+
+    def __init__(self, path, checked, max_file_size):
+        self.path = path
+        self.checked = checked
+        """ Time of the last stat """
+        self.stat = None
+        """ os.stat result or None """
+        self.data = None
+        """ Content of the file, if it is small enough """
+        self.memo = {}
+        """ Values computed from the file, e.g. headers """
+        try:
+            f = open(path, "rb")
+        except (IOError, OSError):
+            # Missing files and directories
+            self.stat = _stat(path)
+            return
+        with f:
+            st = self.stat = os.fstat(f.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size <= max_file_size:
+                data = f.read()
+                if len(data) == st.st_size:
+                    self.data = data
+
+    @property
+    def weight(self):
+        if self.data is None:
+            return self.OVERHEAD
+        return self.OVERHEAD + len(self.data)
+
+
+class _Loading(object):
+    """ A file loaded by one thread, which other threads wait for """
+
+    def __init__(self):
+        self.entry = None
+        self.event = Event()
+
+
+class FileCache(object):
+    """
+    Thread safe cache of the stat results and the content of small files.
+
+    The size of all cached files is bounded by size bytes,
+    the least recently used files are removed first.
+    Missing files are kept in a separate cache of at most missing_size
+    paths, so requests of random paths do not remove cached files.
+    A cached file is checked with os.stat again, when it is older than
+    interval seconds, and reloaded, if it was changed.
+    Concurrent requests of an uncached file load it only once.
+    """
+
+    def __init__(self, size, max_file_size=256 * 1024, interval=2.0,
+                 missing_size=4096):
+        """
+        @param size: Maximum bytes of all cached files.
+        @param max_file_size: Larger files are cached without content.
+        @param interval: Seconds between two checks of a file.
+        @param missing_size: Maximum number of cached missing paths.
+        """
+        self.max_file_size = max_file_size
+        self.interval = interval
+        self.cache = LRUCache(size, weight=lambda entry: entry.weight)
+        self.missing = LRUCache(missing_size)
+        """ Entries of missing files """
+        self._loading = {}
+        self._lock = Lock()
+
+    def get(self, path):
+        """ Returns the CachedFile of a path """
+        entry = self.cache.get(path)
+        if entry is None:
+            entry = self.missing.get(path)
+        if entry is not None:
+            now = time.time()
+            if now - entry.checked < self.interval:
+                return entry
+            if _unchanged(_stat(path), entry.stat):
+                entry.checked = now
+                return entry
+        return self._load(path)
+
+    def _load(self, path):
+        with self._lock:
+            loading = self._loading.get(path)
+            if loading is None:
+                loading = self._loading[path] = _Loading()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            # Another thread loads the file
+            loading.event.wait()
+            if loading.entry is not None:
+                return loading.entry
+            return CachedFile(path, time.time(), self.max_file_size)
+        try:
+            log.debug("Load %s" % path)
+            entry = CachedFile(path, time.time(), self.max_file_size)
+            if entry.stat is None:
+                self.cache.remove(path)
+                self.missing.set(path, entry)
+            else:
+                self.missing.remove(path)
+                self.cache.set(path, entry)
+            loading.entry = entry
+            return entry
+        finally:
+            with self._lock:
+                self._loading.pop(path, None)
+            loading.event.set()
+
+    def remove(self, path):
+        """ Removes a path, so it is loaded again by the next get """
+        self.cache.remove(path)
+        self.missing.remove(path)
+
+    def clear(self):
+        self.cache.clear()
+        self.missing.clear()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import errno
+import select
+import logging
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+log = logging.getLogger("levitas.lib.filewrapper")
+
+
+SENDFILE_ERRORS = (errno.EINVAL, errno.ENOTSOCK,
+                   getattr(errno, "ENOSYS", errno.EINVAL),
+                   getattr(errno, "EOPNOTSUPP", errno.EINVAL))
+""" Errors of os.sendfile, if it cannot be used for a file or socket """
+
+
+class FileWrapper(object):
+    """
+    wsgi.file_wrapper, which sends a file or a part of it.
+
+    Servers, which know the wrapper, call transmit with the client
+    socket. It sends the file with os.sendfile, or if this is not
+    possible, reads it into a reusable buffer of blksize bytes.
+    Other servers iterate over the wrapper.
+    """
+
+    BLOCKSIZE = 64 * 1024
+    """ Default size of the blocks read from the file """
+
+    def __init__(self, filelike, blksize=BLOCKSIZE, offset=None, length=None):
+        """
+        @param filelike: File like object with a read method.
+        @param blksize: Size of the blocks read from the file.
+        @param offset: Position of the first byte to send.
+                       Default is the current position.
+        @param length: Number of bytes to send. Default is until EOF.
+        """
+        self.filelike = filelike
+        self.blksize = blksize
+        self.offset = offset
+        self.length = length
+        if hasattr(filelike, "close"):
+            self.close = filelike.close
+
+    def fileno(self):
+        """ Returns the file descriptor or None """
+        try:
+            return self.filelike.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+
+    def __iter__(self):
+        read = self.filelike.read
+        if self.offset is not None:
+            self.filelike.seek(self.offset)
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            size = self.blksize
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            data = read(size)
+            if not data:
+                break
+            yield data
+
+    def transmit(self, sock):
+        """
+        Sends the file to a socket.
+
+        @return: The number of bytes sent.
+        """
+        if self.offset is None:
+            try:
+                offset = self.filelike.tell()
+            except (AttributeError, IOError, OSError):
+                offset = None
+        else:
+            offset = self.offset
+        fileno = self.fileno()
+        if hasattr(os, "sendfile") and fileno is not None and \
+           offset is not None and \
+           not (ssl is not None and isinstance(sock, ssl.SSLSocket)):
+            length = self.length
+            if length is None:
+                length = max(0, os.fstat(fileno).st_size - offset)
+            sent = self._sendfile(sock, fileno, offset, length)
+            if sent is not None:
+                return sent
+        return self._sendbuffered(sock, offset)
+
+    def _sendfile(self, sock, fileno, offset, length):
+        sent = 0
+        timeout = sock.gettimeout()
+        while sent < length:
+            try:
+                n = os.sendfile(sock.fileno(), fileno, offset + sent,
+                                length - sent)
+            except (IOError, OSError) as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # Socket with a timeout is non-blocking
+                    if not select.select([], [sock], [], timeout)[1]:
+                        raise
+                    continue
+                if sent == 0 and err.errno in SENDFILE_ERRORS:
+                    log.debug("sendfile not possible: %s" % str(err))
+                    return None
+                raise
+            if n == 0:
+                break
+            sent += n
+        return sent
+
+    def _sendbuffered(self, sock, offset):
+        if offset is not None:
+            self.filelike.seek(offset)
+        buf = bytearray(self.blksize)
+        view = memoryview(buf)
+        readinto = getattr(self.filelike, "readinto", None)
+        remaining = self.length
+        sent = 0
+        while remaining is None or remaining > 0:
+            size = self.blksize
+            if remaining is not None:
+                size = min(size, remaining)
+            if readinto is not None:
+                n = readinto(view[:size])
+                data = view[:n] if n else None
+            else:
+                data = self.filelike.read(size)
+                n = len(data)
+            if not n:
+                break
+            sock.sendall(data)
+            sent += n
+            if remaining is not None:
+                remaining -= n
+        return sent
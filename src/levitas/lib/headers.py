@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections import OrderedDict
+
+
+log = logging.getLogger("levitas.lib.headers")
+
+
+CONTENT_HEADERS = ("CONTENT_TYPE", "CONTENT_LENGTH")
+""" Headers stored without HTTP_ prefix in a wsgi environment """
+
+
+def environ_key(name):
+    """
+    Returns the key of a request header in a wsgi environment,
+    e.g. HTTP_ACCEPT_LANGUAGE for Accept-Language.
+    Keys of the environment are returned unchanged.
+    """
+    key = name.upper().replace("-", "_")
+    if key in CONTENT_HEADERS or key.startswith("HTTP_"):
+        return key
+    return "HTTP_" + key
+
+
+class EnvironHeaders(object):
+    """
+    Read-only mapping of the request headers (HTTP_* and CONTENT_* keys)
+    of a wsgi environment. Nothing is copied, lookups go to the
+    environment directly.
+    """
+    
+    __slots__ = ("environ",)
+    
+    def __init__(self, environ):
+        self.environ = environ
+        
+    @staticmethod
+    def isHeader(name):
+        return "HTTP_" in name or "CONTENT_" in name
+    
+    def __getitem__(self, name):
+        if not self.isHeader(name):
+            raise KeyError(name)
+        return self.environ[name]
+    
+    def __contains__(self, name):
+        return self.isHeader(name) and name in self.environ
+    
+    def get(self, name, default=None):
+        if self.isHeader(name):
+            return self.environ.get(name, default)
+        return default
+    
+    def keys(self):
+        return [k for k in self.environ if self.isHeader(k)]
+    
+    def items(self):
+        return [(k, v) for k, v in self.environ.items() if self.isHeader(k)]
+    
+    def values(self):
+        return [v for k, v in self.environ.items() if self.isHeader(k)]
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class Headers(object):
+    """
+    Response headers with case-insensitive lookup.
+    A header can have multiple values, e.g. Set-Cookie.
+    The list for the wsgi start_response is built by items().
+    """
+    
+    def __init__(self, headers=None):
+        self._fields = OrderedDict()
+        """ lower case name -> [name, [values]] """
+        if headers:
+            for name, value in headers:
+                self.add(name, value)
+                
+    def add(self, name, value):
+        """ Adds a value, existing values of the header are kept. """
+        key = name.lower()
+        if key in self._fields:
+            self._fields[key][1].append(value)
+        else:
+            self._fields[key] = [name, [value]]
+            
+    def set(self, name, value):
+        """ Sets the value, existing values of the header are replaced. """
+        self._fields[name.lower()] = [name, [value]]
+        
+    def get(self, name, default=None):
+        """ Returns the first value of the header. """
+        field = self._fields.get(name.lower())
+        if field is None:
+            return default
+        return field[1][0]
+    
+    def getAll(self, name):
+        """ Returns a list of all values of the header. """
+        field = self._fields.get(name.lower())
+        if field is None:
+            return []
+        return list(field[1])
+    
+    def remove(self, name):
+        self._fields.pop(name.lower(), None)
+        
+    def append(self, header):
+        """ Adds a (name, value) tuple like list.append. """
+        self.add(*header)
+        
+    def items(self):
+        """ Returns the list of (name, value) tuples for start_response. """
+        headers = []
+        for name, values in self._fields.values():
+            for value in values:
+                headers.append((name, value))
+        return headers
+    
+    def __contains__(self, name):
+        return name.lower() in self._fields
+    
+    def __getitem__(self, name):
+        field = self._fields.get(name.lower())
+        if field is None:
+            raise KeyError(name)
+        return field[1][0]
+    
+    def __setitem__(self, name, value):
+        self.set(name, value)
+        
+    def __delitem__(self, name):
+        if name.lower() not in self._fields:
+            raise KeyError(name)
+        self.remove(name)
+        
+    def __iter__(self):
+        return iter(self.items())
+    
+    def __len__(self):
+        return sum(len(values) for name, values in self._fields.values())
+    
+    def __repr__(self):
+        return repr(self.items())
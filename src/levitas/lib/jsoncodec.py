@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from json import JSONDecoder, JSONEncoder
+from threading import Lock
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+log = logging.getLogger("levitas.lib.jsoncodec")
+
+
+class StdlibCodec(object):
+    """
+    JSON codec of the json module.
+    Strings may contain control characters and are encoded as UTF-8.
+    """
+
+    name = "stdlib"
+
+    text = True
+    """ True, if documents are parsed from strings """
+
+    def __init__(self):
+        self.decoder = JSONDecoder(strict=False)
+        self.encoder = JSONEncoder(ensure_ascii=False, sort_keys=False)
+
+    def decode(self, data):
+        """ Decodes a JSON document of bytes, a bytearray or a string """
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return self.decoder.decode(data)
+
+    def encode(self, obj):
+        """ Returns the UTF-8 encoded JSON document of an object """
+        return self.encoder.encode(obj).encode("utf-8")
+
+
+class OrjsonCodec(StdlibCodec):
+    """
+    JSON codec of orjson.
+    Documents and objects orjson rejects, e.g. strings with control
+    characters or integers beyond 64 bit, are handled by the json module.
+    """
+
+    name = "orjson"
+
+    text = False
+
+    def __init__(self):
+        StdlibCodec.__init__(self)
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            return StdlibCodec.decode(self, data)
+
+    def encode(self, obj):
+        try:
+            return orjson.dumps(obj, option=self.option)
+        except TypeError:
+            return StdlibCodec.encode(self, obj)
+
+
+class UjsonCodec(StdlibCodec):
+    """
+    JSON codec of ujson.
+    Documents and objects ujson rejects are handled by the json module.
+    """
+
+    name = "ujson"
+
+    def decode(self, data):
+        if isinstance(data, bytearray):
+            data = data.decode("utf-8")
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return StdlibCodec.decode(self, data)
+
+    def encode(self, obj):
+        try:
+            data = ujson.dumps(obj, ensure_ascii=False)
+        except (TypeError, OverflowError):
+            return StdlibCodec.encode(self, obj)
+        return data.encode("utf-8")
+
+
+CODECS = {"stdlib": (StdlibCodec, True),
+          "orjson": (OrjsonCodec, orjson is not None),
+          "ujson": (UjsonCodec, ujson is not None)}
+""" Codec classes and whether their module is importable """
+
+PREFERENCE = ("orjson", "ujson", "stdlib")
+""" Codecs chosen by "auto" in this order """
+
+
+_codecs = {}
+_codecs_lock = Lock()
+
+
+def get_codec(name="auto"):
+    """
+    Returns the shared codec object of a name.
+
+    @param name: "stdlib", "orjson", "ujson" or "auto" for the
+                 fastest codec, whose module is importable.
+    @raise ValueError: If the name is unknown.
+    @raise ImportError: If the module of the codec is not installed.
+    """
+    codec = _codecs.get(name)
+    if codec is not None:
+        return codec
+    if name == "auto":
+        for n in PREFERENCE:
+            if CODECS[n][1]:
+                codec = get_codec(n)
+                break
+    elif name not in CODECS:
+        raise ValueError("Unknown JSON codec %s" % name)
+    else:
+        cls, available = CODECS[name]
+        if not available:
+            raise ImportError("JSON codec %s is not installed" % name)
+        codec = cls()
+    with _codecs_lock:
+        codec = _codecs.setdefault(name, codec)
+    log.debug("JSON codec %s: %s" % (name, codec.name))
+    return codec
@@ -13,43 +13,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
-import cgi
 import logging
 
 from .settings import Settings
+from .multipart import MultipartFormData
 
 
 log = logging.getLogger("levitas.lib.levitasFieldStorage")
 
 
-class LevitasFieldStorage(cgi.FieldStorage):
+class LevitasFieldStorage(MultipartFormData):
     """
+    Parses multipart/form-data and writes uploaded files
+    to the upload_path given in the settings.
+    
+    Since the streaming parser replaced cgi.FieldStorage, sub-classes
+    overriding make_file receive the MultipartPart of the uploaded file
+    instead of the binary flag: make_file(self, part).
+    
     Example settings
     ================
         # Path for uploaded files
         upload_path = "/path/to/upload/files"
     """
      
-    def make_file(self, binary=None):
+    def __init__(self, fp=None, environ=None,
+                 keep_blank_values=False,
+                 strict_parsing=False):
         settings = Settings()
         if hasattr(settings, "upload_path"):
             log.debug("Upload-Path: %s" % settings.upload_path)
             upload_path = settings.upload_path
         else:
             upload_path = None
-        log.debug("Handling Fileupload")
-        if upload_path:
-            if not os.path.exists(upload_path):
-                log.debug("Create upload_path %s" % upload_path)
-                os.mkdir(upload_path)
-            # strip leading path from f name to avoid directory traversal attacks
-            filename = os.path.basename(self.filename)
-            filepath = os.path.join(upload_path, filename)
-            log.debug("Create filepath %s" % filepath)
-            f = open(filepath, "w+b")
-            return f
-        else:
-            import tempfile
-            log.debug("Create Tempfile")
-            return tempfile.TemporaryFile(mode="w+b")
+        MultipartFormData.__init__(self, fp=fp, environ=environ,
+                                   keep_blank_values=keep_blank_values,
+                                   strict_parsing=strict_parsing,
+                                   upload_path=upload_path)
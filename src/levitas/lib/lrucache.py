@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+
+log = logging.getLogger("levitas.lib.lrucache")
+
+
+class LRUCache(object):
+    """
+    Thread safe dictionary with a size bound.
+    If the cache is full, the least recently used entry is removed.
+    
+    With a weight function the bound is the total weight of the values,
+    e.g. LRUCache(4 * 1024 * 1024, weight=len) holds up to 4 MB of bytes.
+    """
+    
+    def __init__(self, maxsize=128, weight=None):
+        """
+        @param maxsize: Maximum number of entries or maximum total weight.
+        @param weight: Optional function returning the weight of a value.
+        """
+        self.maxsize = maxsize
+        self.weight = 0
+        """ Total weight of all entries """
+        self._weight = weight or (lambda value: 1)
+        self._data = OrderedDict()
+        self._lock = Lock()
+        
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                item = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = item
+            return item[0]
+        
+    def set(self, key, value):
+        weight = self._weight(value)
+        with self._lock:
+            self._pop(key)
+            if weight > self.maxsize:
+                return
+            self._data[key] = (value, weight)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                value, weight = self._data.popitem(last=False)[1]
+                self.weight -= weight
+                
+    def remove(self, key):
+        with self._lock:
+            self._pop(key)
+            
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            
+    def _pop(self, key):
+        try:
+            value, weight = self._data.pop(key)
+        except KeyError:
+            return
+        self.weight -= weight
+            
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __len__(self):
+        return len(self._data)
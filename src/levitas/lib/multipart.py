@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import logging
+from io import BytesIO
+
+
+log = logging.getLogger("levitas.lib.multipart")
+
+
+class MultipartError(ValueError):
+    pass
+
+
+def parse_header(line):
+    """
+    Parses a header like Content-Type or Content-Disposition.
+
+    @return: Tuple of the main value and a dictionary of the parameters.
+    """
+    parts = []
+    part = []
+    quoted = False
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == "\\" and quoted and i + 1 < len(line):
+            part.append(line[i + 1])
+            i += 1
+        elif c == '"':
+            quoted = not quoted
+        elif c == ";" and not quoted:
+            parts.append("".join(part))
+            part = []
+        else:
+            part.append(c)
+        i += 1
+    parts.append("".join(part))
+
+    key = parts[0].strip().lower()
+    params = {}
+    for p in parts[1:]:
+        if "=" in p:
+            name, value = p.split("=", 1)
+            params[name.strip().lower()] = value.strip()
+    return key, params
+
+
+class MultipartPart(object):
+    """
+    A field or a file of multipart/form-data.
+    Has the same attributes as the items of a cgi.FieldStorage.
+    """
+
+    def __init__(self, headers, encoding="utf-8"):
+        self.headers = headers
+        """ Dictionary of the part headers with lower case names """
+        disposition, params = parse_header(headers.get("content-disposition",
+                                                       ""))
+        self.disposition = disposition
+        self.disposition_options = params
+        self.name = params.get("name")
+        self.filename = params.get("filename")
+        self.type, self.type_options = parse_header(
+                        headers.get("content-type", "text/plain"))
+        self.file = None
+        self.size = 0
+        self._encoding = encoding
+
+    @property
+    def value(self):
+        """ The value of a field or the content of a file """
+        self.file.seek(0)
+        value = self.file.read()
+        self.file.seek(0)
+        if self.filename is None:
+            value = value.decode(self._encoding, "replace")
+        return value
+
+    def __repr__(self):
+        return "MultipartPart(%r, %r)" % (self.name, self.filename)
+
+
+class MultipartFormData(object):
+    """
+    Streaming parser for multipart/form-data requests.
+
+    The request body is read in chunks of BLOCKSIZE bytes.
+    Uploaded files are written to disk while they are read,
+    either to upload_path or to a temporary file.
+    Fields are kept in memory up to MEMORY_LIMIT bytes.
+    The constructor accepts the arguments of cgi.FieldStorage,
+    so it can be used as fieldstorage_class.
+    """
+
+    BLOCKSIZE = 64 * 1024
+    """ Size of the chunks read from the request body """
+
+    MEMORY_LIMIT = 64 * 1024
+    """ Larger fields are moved to a temporary file """
+
+    MAX_HEADER_SIZE = 16 * 1024
+    """ Maximum size of the headers of a part """
+
+    def __init__(self, fp=None, environ=None,
+                 keep_blank_values=False,
+                 strict_parsing=False,
+                 upload_path=None,
+                 encoding="utf-8"):
+        """
+        @param fp: The wsgi.input stream.
+        @param environ: The wsgi environment.
+        @param keep_blank_values: Keep fields with empty values.
+        @param strict_parsing: Raise MultipartError on a truncated body.
+        @param upload_path: Directory for uploaded files.
+                            Default are temporary files.
+        @param encoding: Encoding of the field values.
+        """
+        environ = environ or {}
+        self.fp = fp or environ.get("wsgi.input")
+        self.keep_blank_values = keep_blank_values
+        self.strict_parsing = strict_parsing
+        self.upload_path = upload_path
+        self.encoding = encoding
+        self.list = []
+        """ List of all MultipartPart objects """
+
+        ctype, params = parse_header(environ.get("CONTENT_TYPE", ""))
+        if ctype != "multipart/form-data" or "boundary" not in params:
+            raise MultipartError("No multipart/form-data boundary given")
+        boundary = params["boundary"].encode("latin-1")
+        try:
+            length = int(environ.get("CONTENT_LENGTH", ""))
+        except ValueError:
+            raise MultipartError("Content-Length required")
+        self._parse(boundary, length)
+
+    def make_file(self, part):
+        """
+        Returns the file to write an uploaded file to.
+        Can be overridden by sub-classes.
+        Unlike cgi.FieldStorage.make_file(binary) the part of the file
+        is passed, its filename is part.filename.
+        Files without a usable name, e.g. the empty filename of an empty
+        file input, are written to a temporary file.
+        """
+        # strip leading path from f name to avoid directory traversal attacks
+        filename = os.path.basename(part.filename.replace("\\", "/"))
+        if self.upload_path and filename not in ("", ".", ".."):
+            if not os.path.exists(self.upload_path):
+                log.debug("Create upload_path %s" % self.upload_path)
+                os.mkdir(self.upload_path)
+            filepath = os.path.join(self.upload_path, filename)
+            log.debug("Create filepath %s" % filepath)
+            return open(filepath, "w+b")
+        else:
+            log.debug("Create Tempfile")
+            return tempfile.TemporaryFile(mode="w+b")
+
+    def _read(self, remaining):
+        if remaining[0] <= 0:
+            return b""
+        data = self.fp.read(min(self.BLOCKSIZE, remaining[0]))
+        remaining[0] -= len(data)
+        if not data:
+            remaining[0] = 0
+        return data
+
+    def _parse(self, boundary, length):
+        delimiter = b"--" + boundary
+        separator = b"\r\n" + delimiter
+        remaining = [length]
+        buf = b""
+
+        # Skip the preamble
+        while True:
+            i = buf.find(delimiter)
+            if i >= 0:
+                buf = buf[i + len(delimiter):]
+                break
+            buf = buf[-len(delimiter):]
+            data = self._read(remaining)
+            if not data:
+                return self._truncated()
+            buf += data
+
+        while True:
+            # Closing delimiter or the line break before the part headers
+            while len(buf) < 2:
+                data = self._read(remaining)
+                if not data:
+                    return self._truncated()
+                buf += data
+            if buf.startswith(b"--"):
+                return
+            while b"\r\n" not in buf:
+                if len(buf) > self.MAX_HEADER_SIZE:
+                    raise MultipartError("Invalid multipart delimiter")
+                data = self._read(remaining)
+                if not data:
+                    return self._truncated()
+                buf += data
+            buf = buf[buf.find(b"\r\n") + 2:]
+
+            # Part headers
+            while True:
+                if buf.startswith(b"\r\n"):
+                    raw_headers = b""
+                    buf = buf[2:]
+                    break
+                i = buf.find(b"\r\n\r\n")
+                if i >= 0:
+                    raw_headers = buf[:i]
+                    buf = buf[i + 4:]
+                    break
+                if len(buf) > self.MAX_HEADER_SIZE:
+                    raise MultipartError("Part headers too large")
+                data = self._read(remaining)
+                if not data:
+                    return self._truncated()
+                buf += data
+            part = self._createPart(raw_headers)
+
+            # Part body
+            keep = len(separator) - 1
+            while True:
+                i = buf.find(separator)
+                if i >= 0:
+                    self._write(part, buf[:i])
+                    buf = buf[i + len(separator):]
+                    break
+                if len(buf) > keep:
+                    self._write(part, buf[:-keep])
+                    buf = buf[-keep:]
+                data = self._read(remaining)
+                if not data:
+                    self._write(part, buf)
+                    self._finishPart(part)
+                    return self._truncated()
+                buf += data
+            self._finishPart(part)
+
+    def _truncated(self):
+        if self.strict_parsing:
+            raise MultipartError("Unexpected end of multipart/form-data")
+        log.error("Unexpected end of multipart/form-data")
+
+    def _createPart(self, raw_headers):
+        headers = {}
+        for line in raw_headers.decode("utf-8", "replace").split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        part = MultipartPart(headers, self.encoding)
+        if part.filename is not None:
+            part.file = self.make_file(part)
+        else:
+            part.file = BytesIO()
+        return part
+
+    def _write(self, part, data):
+        if not data:
+            return
+        part.size += len(data)
+        if part.filename is None and part.size > self.MEMORY_LIMIT \
+           and isinstance(part.file, BytesIO):
+            f = tempfile.TemporaryFile(mode="w+b")
+            f.write(part.file.getvalue())
+            part.file = f
+        part.file.write(data)
+
+    def _finishPart(self, part):
+        part.file.seek(0)
+        if part.filename is None and not part.size \
+           and not self.keep_blank_values:
+            return
+        self.list.append(part)
+
+    def keys(self):
+        keys = []
+        for part in self.list:
+            if part.name not in keys:
+                keys.append(part.name)
+        return keys
+
+    def getlist(self, key):
+        """ Returns the values of all fields with the given name. """
+        return [part.value for part in self.list if part.name == key]
+
+    def getfirst(self, key, default=None):
+        for part in self.list:
+            if part.name == key:
+                return part.value
+        return default
+
+    def getvalue(self, key, default=None):
+        values = self.getlist(key)
+        if not values:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def __getitem__(self, key):
+        parts = [part for part in self.list if part.name == key]
+        if not parts:
+            raise KeyError(key)
+        if len(parts) == 1:
+            return parts[0]
+        return parts
+
+    def __contains__(self, key):
+        for part in self.list:
+            if part.name == key:
+                return True
+        return False
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
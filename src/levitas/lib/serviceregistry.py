@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import types
+import inspect
+import logging
+from threading import Lock
+try:
+    from inspect import signature, Parameter  # python 3
+except ImportError:
+    signature = None  # python 2
+
+
+log = logging.getLogger("levitas.lib.serviceregistry")
+
+
+class ServiceMethod(object):
+    """
+    An exposed method of a service class.
+    The arity and the keyword names of its signature are computed once,
+    so the arguments of a call are checked without binding them.
+    """
+
+    __slots__ = ("name", "function", "instance", "checked",
+                 "min_args", "max_args", "keywords", "required",
+                 "keyword_only", "var_keywords")
+
+    def __init__(self, name, function, instance):
+        """
+        @param name: Name of the method.
+        @param function: The attribute of the service class.
+        @param instance: True, if the first parameter of the function
+                         is the service object.
+        """
+        self.name = name
+        self.function = function
+        self.instance = instance
+        self.checked = True
+        """ False, if the signature is unknown and calls are not checked """
+        self.min_args = 0
+        """ Number of required positional arguments """
+        self.max_args = 0
+        """ Maximum number of positional arguments, None for *args """
+        self.keywords = set()
+        """ Names of the arguments, which can be passed by keyword """
+        self.required = set()
+        """ Names of the arguments without default """
+        self.keyword_only = False
+        """ True, if keyword-only arguments are required """
+        self.var_keywords = False
+        """ True, if the function accepts **kwargs """
+        try:
+            if signature is not None:
+                self._readSignature(function)
+            else:
+                self._readArgspec(function)
+        except (TypeError, ValueError):
+            log.warning("Unable to inspect the signature of %s" % name)
+            self.checked = False
+
+    def _readSignature(self, function):
+        params = list(signature(function).parameters.values())
+        if self.instance and params and \
+           params[0].kind in (Parameter.POSITIONAL_ONLY,
+                              Parameter.POSITIONAL_OR_KEYWORD):
+            # The instance, unless it is passed in *args
+            params = params[1:]
+        for p in params:
+            required = p.default is Parameter.empty
+            if p.kind == Parameter.VAR_POSITIONAL:
+                self.max_args = None
+                continue
+            if p.kind == Parameter.VAR_KEYWORD:
+                self.var_keywords = True
+                continue
+            if p.kind != Parameter.KEYWORD_ONLY:
+                if self.max_args is not None:
+                    self.max_args += 1
+                if required:
+                    self.min_args += 1
+            elif required:
+                self.keyword_only = True
+            if p.kind != Parameter.POSITIONAL_ONLY:
+                self.keywords.add(p.name)
+            if required:
+                self.required.add(p.name)
+
+    def _readArgspec(self, function):
+        spec = inspect.getargspec(function)
+        args = spec.args
+        if self.instance or getattr(function, "__self__", None) is not None:
+            # The instance or the class of a class method
+            args = args[1:]
+        defaults = len(spec.defaults or ())
+        self.min_args = len(args) - defaults
+        self.max_args = None if spec.varargs else len(args)
+        self.keywords = set(args)
+        self.required = set(args[:self.min_args])
+        self.var_keywords = spec.keywords is not None
+
+    def check(self, params):
+        """
+        Checks the arguments of a call.
+
+        @param params: List or dictionary of arguments.
+        @return: The error message or None, if the arguments are valid.
+        """
+        if not self.checked:
+            return None
+        if isinstance(params, dict):
+            if not self.var_keywords:
+                unknown = [k for k in params if k not in self.keywords]
+                if unknown:
+                    return "%s() got unexpected arguments: %s" \
+                        % (self.name, ", ".join(sorted(map(str, unknown))))
+            missing = [k for k in self.required if k not in params]
+            if missing:
+                return "%s() missing arguments: %s" \
+                    % (self.name, ", ".join(sorted(missing)))
+            return None
+        n = len(params)
+        if n < self.min_args:
+            return "%s() takes at least %d arguments (%d given)" \
+                % (self.name, self.min_args, n)
+        if self.max_args is not None and n > self.max_args:
+            return "%s() takes at most %d arguments (%d given)" \
+                % (self.name, self.max_args, n)
+        if self.keyword_only:
+            return "%s() requires named arguments" % self.name
+        return None
+
+    def call(self, service, params):
+        """ Calls the method of a service object """
+        if isinstance(params, dict):
+            return getattr(service, self.name)(**params)
+        return getattr(service, self.name)(*params)
+
+
+class ServiceRegistry(object):
+    """
+    The exposed methods of a service class.
+    Public methods of the class and its bases are exposed, attributes
+    starting with an underscore, like the _prepare and _complete hooks,
+    are not.
+    """
+
+    def __init__(self, service_class):
+        """
+        @param service_class: Class with remote methods.
+        """
+        self.service_class = service_class
+        self.methods = {}
+        """ Dictionary of the method names and the ServiceMethods """
+        for name in dir(service_class):
+            if name.startswith("_"):
+                continue
+            function = getattr(service_class, name)
+            if inspect.isclass(function) or not callable(function):
+                continue
+            self.methods[name] = ServiceMethod(name, function,
+                                               self._isInstanceMethod(name))
+
+    def _isInstanceMethod(self, name):
+        for cls in inspect.getmro(self.service_class):
+            if name in cls.__dict__:
+                # Static and class methods and other callables
+                # are called without the service object
+                return isinstance(cls.__dict__[name], types.FunctionType)
+        return False
+
+    def get(self, name):
+        """ Returns the ServiceMethod of a name or None """
+        return self.methods.get(name)
+
+    def __contains__(self, name):
+        return name in self.methods
+
+    def __len__(self):
+        return len(self.methods)
+
+
+_registries = {}
+_registries_lock = Lock()
+
+
+def get_registry(service_class):
+    """
+    Returns the shared ServiceRegistry of a service class.
+    The registry is built on the first call.
+    """
+    registry = _registries.get(service_class)
+    if registry is not None:
+        return registry
+    registry = ServiceRegistry(service_class)
+    with _registries_lock:
+        registry = _registries.setdefault(service_class, registry)
+    log.debug("Service %s exposes %d methods"
+              % (getattr(service_class, "__name__", service_class),
+                 len(registry)))
+    return registry
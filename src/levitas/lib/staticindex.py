@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import time
+import logging
+from threading import Lock
+
+from . import utils
+
+
+log = logging.getLogger("levitas.lib.staticindex")
+
+
+class IndexEntry(object):
+    """ A file or directory of the StaticIndex """
+
+    __slots__ = ("stat", "memo", "index")
+
+    def __init__(self, st):
+        self.stat = st
+        """ os.stat result """
+        self.memo = {}
+        """ Precomputed values like content type and Last-Modified """
+        self.index = None
+        """ Path of the index file of a directory """
+
+
+class StaticIndex(object):
+    """
+    Index of all files and directories below a root directory.
+
+    The index is built once by walking the directory tree. Afterwards
+    the modification times of the indexed directories are checked every
+    interval seconds and changed directories are scanned again.
+    Files are expected to be replaced, e.g. by a deployment, and not
+    modified in place, because this does not change the directory.
+    """
+
+    INDEX_FILES = ("index.html", "index.htm")
+    """ Index files of a directory """
+
+    def __init__(self, root, interval=2.0, mimetypes=None):
+        """
+        @param root: The root directory.
+        @param interval: Seconds between two checks of the directories.
+        @param mimetypes: Custom mimetypes for utils.guess_type.
+        """
+        self.root = root.rstrip("/") or "/"
+        self.interval = interval
+        self.mimetypes = mimetypes
+        self._entries = {}
+        self._dirs = {}
+        self._lock = Lock()
+        t = time.time()
+        self._scan(self.root, set())
+        self._checked = time.time()
+        log.info("Indexed %d files and directories of %s in %.3f s"
+                 % (len(self._entries), self.root, self._checked - t))
+
+    def lookup(self, path):
+        """ Returns the IndexEntry of a path or None """
+        if time.time() - self._checked > self.interval:
+            self.refresh()
+        if path.endswith("/") and len(path) > 1:
+            path = path[:-1]
+        return self._entries.get(path)
+
+    def update(self, path):
+        """ Reads the stat result of a file again """
+        with self._lock:
+            self._add(path, os.path.basename(path))
+
+    def refresh(self):
+        """ Scans the directories again, whose modification time changed """
+        with self._lock:
+            if time.time() - self._checked <= self.interval:
+                return
+            for dirpath, mtime in list(self._dirs.items()):
+                if dirpath not in self._dirs:
+                    # Removed with its parent
+                    continue
+                try:
+                    st = os.stat(dirpath)
+                except OSError:
+                    self._remove(dirpath)
+                    continue
+                if st.st_mtime != mtime:
+                    log.debug("Directory %s changed" % dirpath)
+                    for name in self._scanDir(dirpath, st):
+                        self._scan(os.path.join(dirpath, name), set())
+            self._checked = time.time()
+
+    def _entry(self, path, st):
+        entry = IndexEntry(st)
+        if not stat.S_ISDIR(st.st_mode):
+            entry.memo["ctype"] = utils.guess_type(path, self.mimetypes)
+            entry.memo["last_modified"] = utils.time2netscape(st.st_mtime)
+        return entry
+
+    def _scan(self, dirpath, visited):
+        """ Adds a directory and all its subdirectories """
+        try:
+            st = os.stat(dirpath)
+        except OSError:
+            return
+        realpath = os.path.realpath(dirpath)
+        if realpath in visited:
+            log.warning("Directory loop at %s" % dirpath)
+            return
+        visited.add(realpath)
+        for name in self._scanDir(dirpath, st):
+            self._scan(os.path.join(dirpath, name), visited)
+
+    def _scanDir(self, dirpath, st):
+        """
+        Adds or updates a directory and its files
+        and removes deleted entries.
+
+        @return: Names of the new subdirectories.
+        """
+        try:
+            names = os.listdir(dirpath)
+        except OSError:
+            self._remove(dirpath)
+            return []
+        prefix = dirpath.rstrip("/") + "/"
+        if dirpath in self._dirs:
+            present = set(names)
+            for path in list(self._entries):
+                if path.startswith(prefix) and \
+                   "/" not in path[len(prefix):] and \
+                   path[len(prefix):] not in present:
+                    self._remove(path)
+        self._dirs[dirpath] = st.st_mtime
+        entry = self._entry(dirpath, st)
+        self._entries[dirpath] = entry
+
+        subdirs = []
+        for name in names:
+            path = prefix + name
+            known = path in self._dirs
+            isdir = self._add(path, name)
+            if isdir and not known:
+                subdirs.append(name)
+            if name in self.INDEX_FILES and not isdir and \
+               (entry.index is None or
+                self.INDEX_FILES.index(name) <
+                self.INDEX_FILES.index(os.path.basename(entry.index))):
+                entry.index = path
+        return subdirs
+
+    def _add(self, path, name):
+        """
+        Adds or updates a file. Directories are only added by _scanDir.
+
+        @return: True, if the path is a directory.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._remove(path)
+            return False
+        if stat.S_ISDIR(st.st_mode):
+            return True
+        if path in self._dirs:
+            # A directory was replaced by a file
+            self._remove(path)
+        old = self._entries.get(path)
+        if old is None or old.stat.st_mtime != st.st_mtime or \
+           old.stat.st_size != st.st_size or old.stat.st_ino != st.st_ino:
+            self._entries[path] = self._entry(path, st)
+        return False
+
+    def _remove(self, path):
+        """ Removes a path and everything below it """
+        self._entries.pop(path, None)
+        if self._dirs.pop(path, None) is not None:
+            prefix = path.rstrip("/") + "/"
+            for p in list(self._entries):
+                if p.startswith(prefix):
+                    self._entries.pop(p, None)
+            for p in list(self._dirs):
+                if p.startswith(prefix):
+                    self._dirs.pop(p, None)
@@ -15,17 +15,41 @@
 
 import os
 import stat
+import hashlib
 import traceback
 import time
 import datetime
 import email.utils
 import posixpath
 import mimetypes
+try:
+    import Cookie  # python 2
+except ImportError:
+    import http.cookies as Cookie  # python 3
 
 
 def getTraceback():
     return traceback.format_exc()
 
+
+class lazy_property(object):
+    """
+    Decorator for a method, whose result is computed on first access
+    and then stored as instance attribute. Deleting the attribute
+    computes it again on the next access.
+    """
+    
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
     
 DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
@@ -57,32 +81,61 @@ def time2netscape(t=None):
         DAYS[wday], mday, MONTHS[mon - 1], year, hour, min, sec)
  
  
+def parse_cookie(header):
+    """
+    Parses a Cookie header into a dictionary of names and values.
+    Malformed parts are skipped instead of failing the whole header.
+    """
+    cookies = {}
+    for part in header.split(";"):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        name = name.strip()
+        if not name:
+            continue
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = Cookie._unquote(value)
+        cookies[name] = value
+    return cookies
+    
+    
 def file_size(path):
     return os.stat(path)[stat.ST_SIZE]
+
+
+def file_hash(path, blocksize=64 * 1024):
+    """ Returns the sha1 hexdigest of the content of a file. """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
     
  
+EXTENSIONS_MAP = {
+    "": "application/octet-stream",  # Default
+    ".py": "text/plain",
+    ".c": "text/plain",
+    ".h": "text/plain",
+    ".appcache": "text/cache-manifest",
+    ".webapp": "application/x-web-app-manifest+json"
+    }
+""" Mimetypes, which override the mimetypes module """
+
+
 def guess_type(path, custom_mimetypes=None):
-    custom_mimetypes = custom_mimetypes or {}
     if not mimetypes.inited:
         mimetypes.init()  # try to read system mime.types
-    extensions_map = mimetypes.types_map.copy()  # @UndefinedVariable
-    extensions_map.update({
-        "": "application/octet-stream",  # Default
-        ".py": "text/plain",
-        ".c": "text/plain",
-        ".h": "text/plain",
-        ".appcache": "text/cache-manifest",
-        ".webapp": "application/x-web-app-manifest+json"
-        })
-    extensions_map.update(custom_mimetypes)
     base, ext = posixpath.splitext(path)  # @UnusedVariable
-    if ext in extensions_map:
-        return extensions_map[ext]
-    ext = ext.lower()
-    if ext in extensions_map:
-        return extensions_map[ext]
-    else:
-        return extensions_map[""]
+    for ext in (ext, ext.lower()):
+        for extensions_map in (custom_mimetypes or EXTENSIONS_MAP,
+                               EXTENSIONS_MAP,
+                               mimetypes.types_map):  # @UndefinedVariable
+            if ext in extensions_map:
+                return extensions_map[ext]
+    return (custom_mimetypes or EXTENSIONS_MAP).get("", EXTENSIONS_MAP[""])
     
         
         
\ No newline at end of file
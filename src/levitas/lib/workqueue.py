@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import logging
+from threading import Lock, Thread
+try:
+    from Queue import Queue, Full  # python 2
+except ImportError:
+    from queue import Queue, Full  # python 3
+
+
+log = logging.getLogger("levitas.lib.workqueue")
+
+
+OVERFLOW_POLICIES = ("drop", "caller", "block")
+""" Policies for functions submitted to a full queue """
+
+
+class WorkQueue(object):
+    """
+    Executes functions in background threads.
+
+    At most maxsize functions wait for their execution. The overflow
+    policy decides about functions submitted to a full queue:
+        "drop" - the function is discarded
+        "caller" - the function is executed in the calling thread
+        "block" - the caller waits until the queue has space
+    The threads are started with the first function, and again in
+    a forked process.
+    """
+
+    def __init__(self, threads=2, maxsize=1000, overflow="drop",
+                 name="levitas-worker"):
+        """
+        @param threads: Number of threads.
+        @param maxsize: Maximum number of waiting functions.
+        @param overflow: Policy for functions submitted to a full queue.
+        @param name: Name of the threads.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %s" % overflow)
+        self.threads = threads
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.name = name
+        self.queue = None
+        self._pid = None
+        self._lock = Lock()
+        self._stats = {"submitted": 0,
+                       "completed": 0,
+                       "failed": 0,
+                       "dropped": 0,
+                       "caller": 0,
+                       "max_queued": 0}
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Submits a function for execution.
+
+        @return: False, if the function was dropped.
+        """
+        queue = self._start()
+        item = (func, args, kwargs)
+        try:
+            if self.overflow == "block":
+                queue.put(item)
+            else:
+                queue.put_nowait(item)
+        except Full:
+            if self.overflow == "caller":
+                self._count("caller")
+                self._run(item)
+                return True
+            dropped = self._count("dropped")
+            if dropped == 1 or dropped % 100 == 0:
+                log.warning("Queue %s is full, %d functions dropped"
+                            % (self.name, dropped))
+            return False
+        queued = queue.qsize()
+        with self._lock:
+            self._stats["submitted"] += 1
+            if queued > self._stats["max_queued"]:
+                self._stats["max_queued"] = queued
+        return True
+
+    def stats(self):
+        """
+        Returns a dictionary of the numbers of submitted, completed,
+        failed, dropped, in the caller executed and queued functions
+        and the maximum number of queued functions.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self.queue.qsize() if self.queue is not None else 0
+        return stats
+
+    def join(self):
+        """ Waits until all queued functions are executed """
+        if self.queue is not None:
+            self.queue.join()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+            return self._stats[key]
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return self.queue
+        with self._lock:
+            if self._pid != pid:
+                self.queue = Queue(self.maxsize)
+                for i in range(self.threads):
+                    t = Thread(target=self._work, args=(self.queue,),
+                               name="%s-%d" % (self.name, i))
+                    t.daemon = True
+                    t.start()
+                self._pid = pid
+            return self.queue
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            try:
+                self._run(item)
+            finally:
+                queue.task_done()
+
+    def _run(self, item):
+        func, args, kwargs = item
+        try:
+            func(*args, **kwargs)
+        except Exception as err:
+            self._count("failed")
+            log.error("%s failed: %s" % (self.name, str(err)), exc_info=True)
+        else:
+            self._count("completed")
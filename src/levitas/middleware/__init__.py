@@ -16,7 +16,6 @@
 import os
 import sys
 import re
-import cgi
 import time
 try:
     from urllib import quote  # python 2
@@ -41,6 +40,10 @@ else:
 from levitas.lib.settings import Settings
 from levitas.lib import utils
 from levitas.lib.secure_cookie import SecureCookie
+from levitas.lib.headers import EnvironHeaders, Headers
+from levitas.lib.filewrapper import FileWrapper
+from levitas.lib.multipart import MultipartError
+from levitas.lib.levitasFieldStorage import LevitasFieldStorage
 from ..signals import (middleware_instanciated,
                        middleware_request_started,
                        middleware_request_finished)
@@ -52,6 +55,27 @@ from levitas import (DEFAULT_ERROR_MESSAGE_FORMAT,
 log = logging.getLogger("levitas.middleware")
 
 
+class EncodedResult(object):
+    """
+    Streams the chunks of an iterable result
+    and encodes the text chunks on the fly.
+    """
+    
+    def __init__(self, result, encoding):
+        self.result = result
+        self.encoding = encoding
+        
+    def __iter__(self):
+        for chunk in self.result:
+            if isinstance(chunk, STR):
+                chunk = chunk.encode(self.encoding)
+            yield chunk
+            
+    def close(self):
+        if hasattr(self.result, "close"):
+            self.result.close()
+            
+            
 class Middleware(object):
     """
     Example settings
@@ -62,14 +86,16 @@ class Middleware(object):
         # A secret to sign cookies
         cookie_secret = "my_cookie_secret"
         
-        # Custom cgi.FieldStorage class
+        # Class to parse multipart/form-data.
+        # Default is levitas.lib.levitasFieldStorage.LevitasFieldStorage,
+        # a streaming parser, which writes uploaded files to upload_path.
         fieldstorage_class = LevitasFieldStorage
     """
     
     SUPPORTED_METHODS = ("get", "head", "post", "delete", "put")
     """ Supported HTTP-Methods """
     
-    BLOCKSIZE = 4096
+    BLOCKSIZE = 64 * 1024
     """ Blocksize for sending files """
     
     LOG = True
@@ -78,11 +104,54 @@ class Middleware(object):
     ERROR_MESSAGE_FORMAT = DEFAULT_ERROR_MESSAGE_FORMAT
     ERROR_CONTENT_TYPE = DEFAULT_ERROR_CONTENT_TYPE
     
+    LAZY_ATTRIBUTES = ("remote_host", "http_host", "remote_address",
+                       "user_agent", "url_scheme", "server_name",
+                       "server_port", "query_string",
+                       "request_cookies", "cookies")
+    """ Attributes read from the wsgi environment on first access """
+    
+    POOL_SIZE = 0
+    """
+    Number of instances kept by the MiddlewareFactory for reuse.
+    Instances are reset() after a request. 0 disables pooling.
+    """
+    
+    @classmethod
+    def compileRoute(cls, *args, **kwargs):
+        """
+        Called once by the MiddlewareFactory of a route with
+        the arguments of the middleware's constructor.
+        Data shared by all requests of the route is prepared here.
+        """
+        pass
+    
     def __init__(self, *args, **kwargs):
         
         self.settings = Settings()
         """ Settings-Object """
         
+        self.reset()
+        
+        if hasattr(self.settings, "encoding"):
+            self._encoding = self.settings.encoding
+        else:
+            self._encoding = "utf-8"
+        
+        if hasattr(self.settings, "fieldstorage_class"):
+            self._fieldstorage_class = self.settings.fieldstorage_class
+        else:
+            self._fieldstorage_class = LevitasFieldStorage
+        
+        # Send instanciated signal
+        middleware_instanciated.send(self.__class__,
+                                     middleware=self)
+        
+    def reset(self):
+        """
+        Reset the state of the request, so the instance
+        can handle another request.
+        Sub-classes with own request state must extend it.
+        """
         self.re_match = None
         """ match object for regular expression of the request path """
         
@@ -90,9 +159,9 @@ class Middleware(object):
         """ HTTP-Request method """
         
         self.request_headers = {}
-        """Headers from the request """
+        """Headers from the request, a view of the wsgi environment """
         
-        self.response_headers = []
+        self.response_headers = Headers()
         """ Headers for the response """
         
         self.response_code = 200
@@ -104,55 +173,28 @@ class Middleware(object):
         self.request_data = None
         """ Request data """
         
-        self.remote_host = None
-        """ Remote host of the request """
-        
-        self.remote_address = None
-        """ Remote address of the request """
-        
-        self.user_agent = None
-        """ User agent of the request """
-        
-        self.url_scheme = None
-        """ Url scheme (http or https) """
-        
-        self.server_name = None
-        """ Server name """
-        
-        self.server_port = None
-        """ Server port """
-        
-        self.query_string = None
-        """ Query string """
-        
-        self.cookies = Cookie.BaseCookie()
-        """ Cookies for the request """
+        # Forget the values of the lazy properties
+        for name in self.LAZY_ATTRIBUTES:
+            self.__dict__.pop(name, None)
         
         self._new_cookies = []
         """ New cookies for the response """
         
-        self.__responseStarted = False
+        self._environ = None
+        self._start_response = None
         
-        if hasattr(self.settings, "encoding"):
-            self._encoding = self.settings.encoding
-        else:
-            self._encoding = "utf-8"
-        
-        if hasattr(self.settings, "fieldstorage_class"):
-            self._fieldstorage_class = self.settings.fieldstorage_class
-        else:
-            self._fieldstorage_class = cgi.FieldStorage
-        
-        # Send instanciated signal
-        middleware_instanciated.send(self.__class__,
-                                     middleware=self)
+        self.__responseStarted = False
     
     def getPath(self):
         return self.path
     
     def addHeader(self, name, value):
         """ Add a header to the response """
-        self.response_headers.append((str(name), str(value)))
+        self.response_headers.add(str(name), str(value))
+        
+    def setHeader(self, name, value):
+        """ Set a header of the response, replacing existing values """
+        self.response_headers.set(str(name), str(value))
         
     def getHeader(self, name):
         name = name.upper()
@@ -169,7 +211,6 @@ class Middleware(object):
         self._start_response = start_response
         self._environ = environ
         self._readEnviron(environ)
-        self._loadCookies()
         
     def log_request(self, code="-", size="-"):
         if self.LOG:
@@ -246,6 +287,9 @@ class Middleware(object):
                 return 0
             else:
                 return 415
+        except MultipartError as err:
+            log.error("Invalid multipart/form-data: %s" % str(err))
+            return 400
         except Exception as err:
             log.error("Failed to parse the form data: %s" % str(err), exc_info=True)
             return 500
@@ -288,7 +332,7 @@ class Middleware(object):
         # Remove whitespace
         url = re.sub(r"[\x00-\x20]+", "", url)
         url = url.encode(self._encoding)
-        self.addHeader("Location", urljoin(self.path,
+        self.setHeader("Location", urljoin(self.path,
                                            url.decode(self._encoding)))
         return
         
@@ -308,9 +352,7 @@ class Middleware(object):
     def get_cookie(self, name, default=None):
         """ Returns the value of a cookie """
         """Gets the value of the cookie with the given name, else default."""
-        if name in self.cookies:
-            return self.cookies[name].value
-        return default
+        return self.request_cookies.get(name, default)
 
     def set_cookie(self, name, value,
                    domain=None, path="/", httponly=False,
@@ -375,7 +417,7 @@ class Middleware(object):
     def clear_cookie(self, name, path="/", domain=None):
         """Deletes the cookie with the given name."""
         # expires = datetime.datetime.utcnow() - datetime.timedelta(days=365)
-        if name in self.cookies:
+        if name in self.request_cookies:
             t = time.time() - (365 * 24 * 60 * 60)
             expires = utils.time2netscape(t)
             self.set_cookie(name, "", path=path, expires=expires,
@@ -385,7 +427,7 @@ class Middleware(object):
 
     def clear_all_cookies(self):
         """Deletes all the cookies the user sent with this request."""
-        for name in self.cookies.keys():
+        for name in list(self.request_cookies.keys()):
             self.clear_cookie(name)
 
     def set_signed_cookie(self, name, value,
@@ -423,58 +465,84 @@ class Middleware(object):
             return None
         
     def set_content_type(self, content_type="text/html"):
-        self.addHeader("Content-Type", content_type)
+        self.setHeader("Content-Type", content_type)
             
     def _readEnviron(self, environ):
-                
-        for k, v in environ.items():
-            if "HTTP_" in k or \
-               "CONTENT_" in k:
-                self.request_headers[k] = v
-        
+        self.request_headers = EnvironHeaders(environ)
         self.path = environ["PATH_INFO"]
         self.input = environ["wsgi.input"]
-        if "wsgi.file_wrapper" in environ:
-            self.filewrapper = environ["wsgi.file_wrapper"]
-        else:
-            self.filewrapper = None
+        self.filewrapper = environ.get("wsgi.file_wrapper")
         self.output = None
-                
-        self.url_scheme = environ["wsgi.url_scheme"]
-        self.server_name = environ["SERVER_NAME"]
-        self.server_port = environ["SERVER_PORT"]
-        
-        self.remote_host = ""
-        if "REMOTE_HOST" in environ:
-            self.remote_host = environ["REMOTE_HOST"]
-        
-        self.http_host = ""
-        if "HTTP_HOST" in environ:
-            http_host = environ["HTTP_HOST"]
-            if ":" in http_host:
-                http_host = http_host.split(":")[0]
-            self.http_host = http_host
-        
-        if not self.remote_host:
-            self.remote_host = self.http_host
-            
+        self.request_method = environ["REQUEST_METHOD"].lower()
+        
+    @utils.lazy_property
+    def url_scheme(self):
+        """ Url scheme (http or https) """
+        return self._environ["wsgi.url_scheme"]
+    
+    @utils.lazy_property
+    def server_name(self):
+        """ Server name """
+        return self._environ["SERVER_NAME"]
+    
+    @utils.lazy_property
+    def server_port(self):
+        """ Server port """
+        return self._environ["SERVER_PORT"]
+    
+    @utils.lazy_property
+    def query_string(self):
+        """ Query string """
+        return self._environ.get("QUERY_STRING")
+    
+    @utils.lazy_property
+    def http_host(self):
+        """ Host header of the request without port """
+        http_host = self._environ.get("HTTP_HOST", "")
+        if ":" in http_host:
+            http_host = http_host.split(":")[0]
+        return http_host
+    
+    @utils.lazy_property
+    def remote_host(self):
+        """ Remote host of the request """
+        return self._environ.get("REMOTE_HOST") or self.http_host
+    
+    @utils.lazy_property
+    def remote_address(self):
+        """ Remote address of the request """
+        environ = self._environ
         if "HTTP_ADDR" in environ:
-            self.remote_address = environ["HTTP_ADDR"]
-        elif "REMOTE_ADDR" in environ:
-            self.remote_address = environ["REMOTE_ADDR"]
+            remote_address = environ["HTTP_ADDR"]
         else:
-            self.remote_address = ""
-            
+            remote_address = environ.get("REMOTE_ADDR", "")
         if self.remote_host == "localhost" \
-           and "::" in self.remote_address:
-            self.remote_address = "127.0.0.1"
-        
-        if "HTTP_USER_AGENT" in environ:
-            self.user_agent = self.request_headers["HTTP_USER_AGENT"]
-        else:
-            self.user_agent = "UNKNOWN USER-AGENT"
-        self.request_method = environ["REQUEST_METHOD"].lower()
-        self.query_string = environ.get("QUERY_STRING")
+           and "::" in remote_address:
+            remote_address = "127.0.0.1"
+        return remote_address
+    
+    @utils.lazy_property
+    def request_cookies(self):
+        """ Dictionary of the cookie names and values of the request """
+        if "HTTP_COOKIE" in self._environ:
+            return utils.parse_cookie(self._environ["HTTP_COOKIE"])
+        return {}
+    
+    @utils.lazy_property
+    def cookies(self):
+        """ Cookies for the request """
+        cookies = Cookie.BaseCookie()
+        for name, value in self.request_cookies.items():
+            try:
+                cookies[name] = value
+            except Cookie.CookieError as err:
+                log.debug("Skip cookie %s: %s" % (name, str(err)))
+        return cookies
+    
+    @utils.lazy_property
+    def user_agent(self):
+        """ User agent of the request """
+        return self._environ.get("HTTP_USER_AGENT", "UNKNOWN USER-AGENT")
         
     def _startResponse(self, cookies=True):
         """ Start the response """
@@ -498,7 +566,7 @@ class Middleware(object):
         
         self.log_request(self.response_code)
         
-        self.output = self._start_response(status, self.response_headers)
+        self.output = self._start_response(status, self.response_headers.items())
         
         # Send request finished signal
         middleware_request_finished.send(self.__class__,
@@ -509,17 +577,48 @@ class Middleware(object):
         if self.filewrapper:
             return self.filewrapper(f, self.BLOCKSIZE)
         else:
-            return iter(lambda: f.read(self.BLOCKSIZE), "")
+            return FileWrapper(f, self.BLOCKSIZE)
         
-    def _loadCookies(self):
-        """ Load the cookies from the response. """
-        if "HTTP_COOKIE" in self.request_headers:
+    def _encode(self, chunk):
+        if isinstance(chunk, STR):
+            return chunk.encode(self._encoding)
+        return chunk
+    
+    def _contentLength(self, result):
+        """
+        Returns the length of a list or file result.
+        Returns None for iterators, which are sent without Content-Length,
+        so the server streams them chunked or until the connection closes.
+        """
+        if isinstance(result, list):
+            return sum(len(chunk) for chunk in result)
+        if hasattr(result, "read"):
             try:
-                self.cookies.load(self.request_headers["HTTP_COOKIE"])
-            except Exception as err:
-                raise
-                log.error("Error loading cookies: %s" % str(err))
-                
+                return os.fstat(result.fileno()).st_size - result.tell()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+            if hasattr(result, "getbuffer"):
+                return len(result.getbuffer()) - result.tell()
+        return None
+    
+    def _responseBody(self, result):
+        """ Returns the result as wsgi iterable """
+        if self.request_method == "head":
+            if hasattr(result, "close"):
+                result.close()
+            return []
+        if result is None or isinstance(result, list):
+            return result or []
+        if isinstance(result, bytes):
+            return [result]
+        if isinstance(result, FileWrapper):
+            return result
+        if hasattr(result, "read"):
+            log.debug("Send file")
+            return self._getFilewrapper(result)
+        log.debug("Send iterable")
+        return EncodedResult(result, self._encoding)
+        
     def _parse_qs(self, qs):
         try:
             arguments = parse_qs(qs)
@@ -585,30 +684,29 @@ class Middleware(object):
                                              self.request_method,
                                              type(result)))
             
-            if "Content-Length" not in str(self.response_headers) and \
-               self.request_method != "head" and \
-               self.response_code >= 200 and \
-               self.response_code not in (204, 304):
-                self.addHeader("Content-Length", str(len(result)))
-                
-            if not self.__responseStarted:
-                self._startResponse()
-                
+            if self.__responseStarted:
+                # The response was already started, e.g. by responseError
+                return self._responseBody(result)
+            
             log.debug("Response type: %s" % type(result))
             # Encode unicode(python2.7)/str(python3) type to bytes type
             if isinstance(result, STR):
                 result = result.encode(self._encoding)
-            
-            # Return the result
             if isinstance(result, bytes):
                 result = [result]
+            elif isinstance(result, (list, tuple)):
+                result = [self._encode(chunk) for chunk in result]
+            
+            if "Content-Length" not in self.response_headers and \
+               self.request_method != "head" and \
+               self.response_code >= 200 and \
+               self.response_code not in (204, 304):
+                length = self._contentLength(result)
+                if length is not None:
+                    self.setHeader("Content-Length", str(length))
                 
-            if isinstance(result, FILE):
-                log.debug("Send file")
-                return self._getFilewrapper(result)
-            else:
-                log.debug("Send bytes")
-                return result
+            self._startResponse()
+            return self._responseBody(result)
         
         except Exception as err:
             log.error(str(err), exc_info=True)
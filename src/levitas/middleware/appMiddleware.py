@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import stat
 import logging
 
 from .fileMiddleware import FileMiddleware
@@ -31,27 +32,39 @@ class AppMiddleware(FileMiddleware):
     LOG = True
     #CACHE = {}
     
-    def __init__(self, path, disable_http_caching=False):
+    def __init__(self, path, disable_http_caching=False, precompressed=False,
+                 fingerprints=False):
         """
         @param path: Path of files to serve
         @param disable_http_caching:
+        @param precompressed: Serve gzip sidecars of the files
+        @param fingerprints: Serve the fingerprinted names of the files
         """
-        FileMiddleware.__init__(self, path)
+        FileMiddleware.__init__(self, path, precompressed, fingerprints)
         if disable_http_caching:
             self.cache = {}
         
     def get(self):
-        if os.path.isdir(self.fpath):
+        if self.fstat is not None and stat.S_ISDIR(self.fstat.st_mode):
             if not self.path.endswith("/"):
                 return self.redirect(self.path + "/")
-            for index in "index.html", "index.htm":
-                index = os.path.join(self.fpath, index)
-                if os.path.exists(index):
-                    self.fpath = index
-                    self.prepareFile()
-                    break
+            entry = self.indexEntry(self.fpath)
+            if entry is not False:
+                index = entry and entry.index
             else:
+                index = self.findIndex(self.fpath)
+            if index is None:
                 return self.responseError(404)
+            self.fpath = index
+            self.prepareFile()
         return self.response_file()
     
+    def findIndex(self, path):
+        """ Returns the path of the index file of a directory or None """
+        for index in "index.html", "index.htm":
+            index = os.path.join(path, index)
+            if os.path.exists(index):
+                return index
+        return None
+    
     
\ No newline at end of file
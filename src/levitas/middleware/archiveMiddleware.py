@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import posixpath
+import logging
+from threading import Lock
+
+from levitas.lib.archive import ArchiveLoader
+from levitas.lib.filewrapper import FileWrapper
+from levitas.lib.compression import accepts_coding
+
+from . import Middleware
+from .fileMiddleware import FileMiddleware
+
+
+log = logging.getLogger("levitas.middleware.archiveMiddleware")
+
+
+class ArchiveMiddleware(FileMiddleware):
+    """
+    Handles static files from a zip archive written by
+    levitas-manifest --pack.
+
+    The archive is mapped into memory once per process and the headers
+    of its files are computed when it is loaded, so a request does not
+    access the filesystem. Servers supporting wsgi.file_wrapper send
+    the files with sendfile.
+    A deployment replaces the archive with a single rename. The new
+    archive is loaded, when the file is checked the next time.
+
+    Requests of a directory are answered with its index.html or index.htm.
+    With precompressed=True a gzip sidecar in the archive is sent to
+    clients accepting gzip.
+
+    Example settings entry:
+    urls = [(r"^/(.*)", ArchiveMiddleware, {"path": "/path/to/app.zip"})]
+
+    Example settings:
+        # Seconds until the archive is checked for replacement
+        static_archive_interval = 2.0
+    """
+
+    LOG = True
+
+    INDEX_FILES = ("index.html", "index.htm")
+
+    _loaders = {}
+
+    _loaders_lock = Lock()
+
+    @classmethod
+    def compileRoute(cls, path, *args, **kwargs):
+        """ The archive has no static index """
+        pass
+        
+    def __init__(self, path, precompressed=False, disable_http_caching=False):
+        """
+        @param path: Path of the zip archive
+        @param precompressed: Serve gzip sidecars of the files
+        @param disable_http_caching: Send files with no-cache
+        """
+        Middleware.__init__(self)
+        self.static_path = os.path.abspath(path)
+        """ Path of the archive """
+        self.precompressed = precompressed
+        if disable_http_caching:
+            self.cache = {}
+        elif hasattr(self.settings, "filecache"):
+            self.cache = self.settings.filecache
+        else:
+            self.cache = FileMiddleware.CACHE
+        if hasattr(self.settings, "file_etag"):
+            self.etag = self.settings.file_etag
+        else:
+            self.etag = self.ETAG
+        self.memcache = None
+        self.index = None
+        self.loader = self._getLoader(self.static_path)
+
+    def _getLoader(self, path):
+        with ArchiveMiddleware._loaders_lock:
+            loader = ArchiveMiddleware._loaders.get(path)
+            if loader is None:
+                kwargs = {}
+                if hasattr(self.settings, "static_archive_interval"):
+                    kwargs["interval"] = self.settings.static_archive_interval
+                loader = ArchiveLoader(path, mimetypes=FileMiddleware.MIMETYPES,
+                                       **kwargs)
+                ArchiveMiddleware._loaders[path] = loader
+            return loader
+
+    def reset(self):
+        FileMiddleware.reset(self)
+        self.archive = None
+        """ The Archive of the request """
+        self.member = None
+        """ The ArchiveMember of the requested file """
+        self.isdir = False
+        """ True, if a directory is requested """
+
+    def prepare(self):
+        self.archive = self.loader.get()
+        FileMiddleware.prepare(self)
+
+    def preparePath(self):
+        """ set the name of the file in the archive """
+        groups = self.url_groups()
+        if len(groups) != 1:
+            log.error("There must be only one regex group defined.")
+            raise
+        name = self.translate_path(groups[0], "")
+        self.fpath = name.replace(os.sep, "/").rstrip("/")
+
+    def prepareFile(self):
+        """ set the member, the content-type and the file-size """
+        if self.archive is None or self.fpath is None:
+            return
+        self.member = self.archive.members.get(self.fpath)
+        if self.member is not None:
+            self.ctype = self.member.ctype
+            self.size = self.member.st_size
+        else:
+            self.isdir = self.fpath in self.archive.dirs
+
+    def get(self):
+        if self.isdir:
+            if not self.path.endswith("/"):
+                return self.redirect(self.path + "/")
+            for index in self.INDEX_FILES:
+                if posixpath.join(self.fpath, index) in self.archive.members:
+                    self.fpath = posixpath.join(self.fpath, index)
+                    self.prepareFile()
+                    break
+        return self.response_file()
+
+    def response_file(self):
+        member = self.member
+        if member is None:
+            return self.responseError(404)
+
+        sent = None
+        if self.precompressed:
+            sent = self.getPrecompressed()
+        if sent is None:
+            sent = member
+
+        ext = posixpath.splitext(member.name)[1].lower()
+        self.setHeader("Last-Modified", sent.last_modified)
+        self.setHeader("Cache-Control",
+                       self.cacheControl(**self.cache.get(ext, {})))
+        etag = None
+        if self.etag:
+            etag = sent.etag
+            self.setHeader("ETag", etag)
+
+        if self.checkCacheInfo(sent, etag):
+            self.response_code = 304
+            return
+
+        ranges = self.getRanges(sent, etag)
+        if ranges == []:
+            self.response_code = 416
+            self.setHeader("Content-Range", "bytes */%d" % self.size)
+            return b""
+
+        f = self.archive.open(sent)
+        self.setHeader("Content-Type", self.ctype)
+        self.setHeader("Accept-Ranges", "bytes")
+
+        if ranges:
+            return self.response_ranges(f, ranges, sent.offset)
+
+        self.setHeader("Content-Length", str(self.size))
+        return FileWrapper(f, self.BLOCKSIZE, sent.offset, sent.st_size)
+
+    def getPrecompressed(self):
+        """
+        Returns the member of the gzip sidecar of the file, if it is in
+        the archive, is not older than the file and the client accepts
+        gzip. Otherwise None.
+        Sets the size and the Content-Encoding for the sidecar.
+        """
+        gz = self.archive.members.get(self.member.name + ".gz")
+        if gz is None:
+            return None
+        self.setHeader("Vary", "Accept-Encoding")
+        if gz.st_mtime < self.member.st_mtime:
+            log.warning("Stale precompressed file %s" % gz.name)
+            return None
+        if not accepts_coding(self.request_headers.get("HTTP_ACCEPT_ENCODING",
+                                                       ""), "gzip"):
+            return None
+        self.size = gz.st_size
+        self.setHeader("Content-Encoding", "gzip")
+        return gz
@@ -14,6 +14,10 @@
 # limitations under the License.
 
 import os
+import stat
+import errno
+import uuid
+from io import BytesIO
 try:
     from urllib import unquote  # python 2
 except ImportError:
@@ -21,12 +25,20 @@ except ImportError:
 import posixpath
 import logging
 import time
+from threading import Lock
 try:
     from cookielib import http2time  # python 2
 except ImportError:
     from http.cookiejar import http2time  # python 3
 
 from levitas.lib import utils
+from levitas.lib.settings import Settings
+from levitas.lib.lrucache import LRUCache
+from levitas.lib.filewrapper import FileWrapper
+from levitas.lib.filecache import FileCache
+from levitas.lib.staticindex import StaticIndex
+from levitas.lib.compression import accepts_coding, split_etag_coding
+from levitas.lib.assets import AssetManifest, ASSET_MANIFEST
 
 from . import Middleware
 
@@ -34,22 +46,211 @@ from . import Middleware
 log = logging.getLogger("levitas.middleware.fileMiddleware")
 
 
+def etag_matches(etag, if_none_match):
+    """
+    Returns True, if an If-None-Match header matches the ETag.
+    ETags are compared weak. The ETags of compressed responses,
+    which have the content coding appended, match as well.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or split_etag_coding(tag)[0] == etag:
+            return True
+    return False
+
+
+def parse_range(header, size):
+    """
+    Parses a Range header of a file with the given size.
+    
+    @return: List of (first, last) byte positions, an empty list if no
+             range is satisfiable or None if the header is invalid.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        if not sep:
+            return None
+        try:
+            if not first.strip():
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                first, last = max(0, size - suffix), size - 1
+            else:
+                first = int(first)
+                if last.strip():
+                    last = int(last)
+                    if last < first:
+                        return None
+                    last = min(last, size - 1)
+                else:
+                    last = size - 1
+        except ValueError:
+            return None
+        if first <= last:
+            ranges.append((first, last))
+    return ranges
+
+
+def coalesce_ranges(ranges):
+    """ Sorts the ranges and merges overlapping and adjacent ranges """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class FileRange(object):
+    """
+    Iterates byte ranges of a file.
+    Each range is a tuple (first, last, head), where head is sent
+    before the bytes of the range. The tail is sent after all ranges.
+    """
+    
+    def __init__(self, f, ranges, tail=b"", blocksize=4096):
+        self.f = f
+        self.ranges = ranges
+        self.tail = tail
+        self.blocksize = blocksize
+        
+    def __iter__(self):
+        for first, last, head in self.ranges:
+            if head:
+                yield head
+            self.f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                data = self.f.read(min(self.blocksize, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        if self.tail:
+            yield self.tail
+            
+    def close(self):
+        self.f.close()
+
+
+DIR_FD = hasattr(os, "supports_dir_fd") and os.open in os.supports_dir_fd \
+    and hasattr(os, "O_DIRECTORY") and hasattr(os, "O_NOFOLLOW")
+""" True, if files can be opened relative to a directory descriptor """
+
+
+class StaticRoot(object):
+    """
+    The directory of static files.
+    The descriptor is closed, when no request uses the root anymore.
+    """
+    
+    def __init__(self, path):
+        self.fd = None
+        """ Descriptor of the directory or None, if files cannot be
+        opened relative to it """
+        if DIR_FD:
+            try:
+                self.fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as err:
+                log.error("Unable to open %s: %s" % (path, str(err)))
+        try:
+            st = os.fstat(self.fd) if self.fd is not None else os.stat(path)
+            self.id = (st.st_dev, st.st_ino)
+        except OSError:
+            self.id = None
+        """ Device and inode of the directory """
+        self.real_path = os.path.realpath(path)
+        """ The path without symbolic links """
+        
+    def __del__(self):
+        if getattr(self, "fd", None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class FileMiddleware(Middleware):
     """
     Handles static files from a given path.
     
+    Files are opened relative to a descriptor of the path, symbolic links
+    are only followed, if their target is below the path. The path is
+    opened again, when it refers to another directory, e.g. after a
+    deployment replaced a symbolic link. The headers are taken from
+    the opened file.
+    
     Example settings entry:
     urls = [(r"^/(.*)", FileMiddleware, {"path": "/path/to/files"})]
+    
+    With precompressed=True a gzip sidecar (app.js.gz next to app.js)
+    is sent to clients accepting gzip, if it is not older than the file.
+    Sidecars are created with levitas-manifest --compress.
+    
+    With fingerprints=True the fingerprinted names of the manifest
+    written by levitas-manifest --fingerprint are served, e.g.
+    js/app.<hash>.js for js/app.js. They are sent with an immutable
+    Cache-Control of one year. A fingerprinted name is not found anymore,
+    when the file was modified after the manifest was written.
+    The manifest itself is never sent.
+    
+    ETAG selects the ETag of the files:
+        "strong" - from inode, modification time and size (default)
+        "weak" - the same as weak ETag
+        "hash" - sha1 of the content, computed once per file version
+        None - no ETag
+    
+    Example settings:
+        # ETag of static files
+        file_etag = "hash"
+        
+        # Keep the stat results and the content of small files in memory.
+        # Maximum bytes of all cached files, 0 disables the cache.
+        static_cache_size = 32 * 1024 * 1024
+        # Larger files are read from disk
+        static_cache_max_file_size = 256 * 1024
+        # Seconds until a cached file is checked for modifications
+        static_cache_interval = 2.0
+        # Maximum number of cached paths of missing files
+        static_cache_missing_size = 4096
+        
+        # Index all files below path, when the routes are compiled at
+        # startup. Requests of missing files are answered without
+        # accessing the disk.
+        static_index = True
+        # Seconds until the directories are checked for modifications
+        static_index_interval = 2.0
     """
     
     LOG = True
     
-    BLOCKSIZE = 4096
+    BLOCKSIZE = 64 * 1024
     
     MIMETYPES = {}
     
+    ETAG = "strong"
+    
+    MAX_RANGES = 32
+    """ Requests with more ranges are answered with the whole file """
+    
     DAY_SEC = 360 * 24 * 60 * 60
     
+    IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+    """ max-age of fingerprinted files """
+    
     CACHE = {".htm": {"max_age": DAY_SEC,
                       "must_revalidate": True
                      },
@@ -82,28 +283,145 @@ class FileMiddleware(Middleware):
                      },
              }
     
-    def __init__(self, path):
+    _etags = LRUCache(4096)
+    
+    _memcache = None
+    
+    _indexes = {}
+    
+    _roots = {}
+    
+    _manifests = {}
+    
+    _lock = Lock()
+    
+    @classmethod
+    def compileRoute(cls, path, *args, **kwargs):
+        """ Builds the index of the path at startup """
+        settings = Settings()
+        if hasattr(settings, "static_index") and settings.static_index:
+            cls._getIndex(os.path.abspath(path), settings)
+        
+    def __init__(self, path, precompressed=False, fingerprints=False):
         """
         @param path: Path of files to serve
+        @param precompressed: Serve gzip sidecars of the files
+        @param fingerprints: Serve the fingerprinted names of the files
         """
         Middleware.__init__(self)
-        os.chdir(path)
-        log.debug("Working directory: %s" % os.getcwd())
         
-        self.static_path = path
+        self.static_path = os.path.abspath(path)
         """
         Path to the static files
         """
+        self.precompressed = precompressed
+        if hasattr(self.settings, "filecache"):
+            self.cache = self.settings.filecache
+        else:
+            self.cache = FileMiddleware.CACHE
+        if hasattr(self.settings, "file_etag"):
+            self.etag = self.settings.file_etag
+        else:
+            self.etag = self.ETAG
+        if hasattr(self.settings, "static_cache_size") and \
+           self.settings.static_cache_size:
+            if FileMiddleware._memcache is None:
+                FileMiddleware._memcache = self._createMemcache()
+            self.memcache = FileMiddleware._memcache
+        else:
+            self.memcache = None
+        if hasattr(self.settings, "static_index") and \
+           self.settings.static_index:
+            self.index = self._getIndex(self.static_path, self.settings)
+        else:
+            self.index = None
+        if fingerprints:
+            self.fingerprints = self._getManifest(
+                os.path.join(self.static_path, ASSET_MANIFEST))
+        else:
+            self.fingerprints = None
+            
+    @classmethod
+    def _getIndex(cls, path, settings):
+        """ Returns the StaticIndex of a path, which is shared by all
+        middlewares of the path """
+        index = FileMiddleware._indexes.get(path)
+        if index is not None:
+            return index
+        kwargs = {}
+        if hasattr(settings, "static_index_interval"):
+            kwargs["interval"] = settings.static_index_interval
+        # The directory tree is walked without holding the lock
+        index = StaticIndex(path, mimetypes=FileMiddleware.MIMETYPES, **kwargs)
+        with FileMiddleware._lock:
+            return FileMiddleware._indexes.setdefault(path, index)
+        
+    def _getManifest(self, path):
+        """ Returns the AssetManifest of a path """
+        with FileMiddleware._lock:
+            manifest = FileMiddleware._manifests.get(path)
+            if manifest is None:
+                manifest = AssetManifest(path)
+                FileMiddleware._manifests[path] = manifest
+            return manifest
+        
+    def _getRoot(self, path):
+        """
+        Returns the StaticRoot of a path, which is shared by all
+        middlewares of the path. The directory is opened again, when
+        the path refers to another directory, e.g. a replaced symbolic link.
+        """
+        try:
+            st = os.stat(path)
+            current = (st.st_dev, st.st_ino)
+        except OSError:
+            current = None
+        root = FileMiddleware._roots.get(path)
+        if root is not None and root.id == current:
+            return root
+        new = StaticRoot(path)
+        with FileMiddleware._lock:
+            root = FileMiddleware._roots.get(path)
+            if root is not None and root.id == new.id:
+                return root
+            FileMiddleware._roots[path] = new
+        if root is not None:
+            log.info("Static path %s refers to another directory" % path)
+        return new
+        
+    @property
+    def root(self):
+        """ The StaticRoot of the request """
+        if self._root is None:
+            self._root = self._getRoot(self.static_path)
+        return self._root
+        
+    def _createMemcache(self):
+        kwargs = {}
+        if hasattr(self.settings, "static_cache_max_file_size"):
+            kwargs["max_file_size"] = self.settings.static_cache_max_file_size
+        if hasattr(self.settings, "static_cache_interval"):
+            kwargs["interval"] = self.settings.static_cache_interval
+        if hasattr(self.settings, "static_cache_missing_size"):
+            kwargs["missing_size"] = self.settings.static_cache_missing_size
+        log.info("Static file cache of %d bytes"
+                 % self.settings.static_cache_size)
+        return FileCache(self.settings.static_cache_size, **kwargs)
+        
+    def reset(self):
+        Middleware.reset(self)
         self.ctype = ""
         """ The content-type of the file"""
         self.size = 0
         """ file-size """
         self.fpath = None
         """ absolute path of the file"""
-        if hasattr(self.settings, "filecache"):
-            self.cache = self.settings.filecache
-        else:
-            self.cache = FileMiddleware.CACHE
+        self.fstat = None
+        """ os.stat result of the file or None, if it does not exist """
+        self.asset = None
+        """ Manifest entry of a requested fingerprinted name """
+        self._cached = {}
+        self._root = None
         
     def prepare(self):
         self.preparePath()
@@ -117,33 +435,296 @@ class FileMiddleware(Middleware):
             raise
         path = groups[0]
         self.fpath = self.translate_path(path, self.static_path)
+        name = os.path.relpath(self.fpath, self.static_path)
+        if name == ASSET_MANIFEST:
+            # The manifest is not sent
+            self.fpath = None
+            return
+        if self.fingerprints is not None:
+            asset, name = self.fingerprints.resolve(name.replace(os.sep, "/"))
+            if asset is not None:
+                self.asset = asset
+                self.fpath = os.path.join(self.static_path, name)
     
     def prepareFile(self):
-        """ set the content-type and the file-size """
+        """ set the content-type, the stat result and the file-size """
         if self.fpath:
-            self.ctype = utils.guess_type(self.fpath,
-                                          FileMiddleware.MIMETYPES)
-            if os.path.exists(self.fpath):
-                self.size = utils.file_size(self.fpath)
+            self.ctype = self._memo(self.fpath, "ctype",
+                                    lambda: utils.guess_type(self.fpath,
+                                                FileMiddleware.MIMETYPES))
+            self.fstat = self.statFile(self.fpath)
+            if self.fstat is not None:
+                self.size = self.fstat.st_size
             else:
                 self.size = 0
                 
-    def response_file(self):
-        f = self.getFile(self.fpath)
-        if f is None:
+    def statFile(self, path):
+        """ Returns the os.stat result of a file or None """
+        entry = self.indexEntry(path)
+        if entry is not False:
+            return entry and entry.stat
+        if self.memcache is not None:
+            return self.cachedFile(path).stat
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+        
+    def _memo(self, path, key, func):
+        """
+        Returns func() and keeps the result with the cached file,
+        until the file is modified.
+        """
+        entry = self.indexEntry(path)
+        if entry:
+            memo = entry.memo
+        elif entry is None or self.memcache is None:
+            return func()
+        else:
+            memo = self.cachedFile(path).memo
+        try:
+            return memo[key]
+        except KeyError:
+            value = memo[key] = func()
+            return value
+        
+    def cachedFile(self, path):
+        """
+        Returns the CachedFile of a path from the memory cache.
+        A request uses the same version of a file, even if the file
+        is reloaded meanwhile.
+        """
+        entry = self._cached.get(path)
+        if entry is None:
+            entry = self._cached[path] = self.memcache.get(path)
+        return entry
+                
+    def indexEntry(self, path):
+        """
+        Returns the IndexEntry of a path, None if the path does not exist
+        or False, if the path is not indexed.
+        """
+        if self.index is None:
+            return False
+        path = os.path.abspath(path)
+        if path != self.index.root and \
+           not path.startswith(self.index.root.rstrip("/") + "/"):
+            return False
+        return self.index.lookup(path)
+        
+    def response_file(self, retry=True):
+        """
+        @param retry: Prepare the file again, if its index entry is outdated.
+        """
+        if self.fstat is None or not stat.S_ISREG(self.fstat.st_mode):
             return self.responseError(404)
+        if self.asset is not None and \
+           (self.asset["size"], self.asset["mtime"]) != \
+           (self.fstat.st_size, self.fstat.st_mtime):
+            log.debug("Fingerprint of %s is outdated" % self.fpath)
+            return self.responseError(404)
+        
+        path, st = None, None
+        if self.precompressed:
+            path, st = self.getPrecompressed()
+        if path is None:
+            path, st = self.fpath, self.fstat
+        
+        opened = None
+        if self.index is not None:
+            # The file is opened first, so its index entry is checked
+            # before the conditional headers are evaluated
+            opened = self.openSent(path)
+            if opened is None:
+                return self.responseError(404)
+            if retry and not self.checkIndexed(opened[2], path, st):
+                opened[0].close()
+                return self.response_file(retry=False)
+        return self.sendFile(path, st, opened)
+    
+    def sendFile(self, path, st, opened=None):
+        """
+        Answers the conditional headers or sends the file.
+        
+        @param st: os.stat result of the file.
+        @param opened: The result of openSent or None,
+                       if the file is opened after the conditional headers.
+        """
+        if opened is not None:
+            # The headers are those of the sent file, even if the path
+            # refers to another file meanwhile
+            f, data, st = opened
+            self.size = st.st_size
+            if path == self.fpath:
+                self.fstat = st
         
-        self.prepareCacheHeaders()
+        etag = self.prepareCacheHeaders(path, st)
         
-        if self.checkCacheInfo(self.fpath):
+        if self.checkCacheInfo(st, etag):
+            if opened is not None:
+                f.close()
             self.response_code = 304
             return
         
-        self.addHeader("Content-type", self.ctype)
+        ranges = self.getRanges(st, etag)
+        if ranges == []:
+            if opened is not None:
+                f.close()
+            self.response_code = 416
+            self.setHeader("Content-Range", "bytes */%d" % self.size)
+            return b""
+        
+        if opened is None:
+            opened = self.openSent(path)
+            if opened is None:
+                return self.responseError(404)
+            f, data, fst = opened
+            if (fst.st_ino, fst.st_mtime, fst.st_size) != \
+               (st.st_ino, st.st_mtime, st.st_size):
+                # The file was replaced after the stat
+                return self.sendFile(path, fst, opened)
+        
+        self.setHeader("Content-Type", self.ctype)
+        self.setHeader("Accept-Ranges", "bytes")
+        
+        if ranges:
+            return self.response_ranges(f, ranges)
          
-        self.addHeader("Content-Length", str(self.size))
-
+        self.setHeader("Content-Length", str(self.size))
+        
+        if data is not None:
+            return [data]
         return f
+    
+    def openSent(self, path):
+        """
+        Opens the file sent for a path.
+        
+        @return: The file, its content, if it is in the memory cache,
+                 and its os.stat result or None, if it is not
+                 a regular file below the static path.
+        """
+        data = None
+        if self.memcache is not None:
+            cached = self.cachedFile(path)
+            data = cached.data
+            if data is not None and \
+               not self._memo(path, "contained",
+                              lambda: self.isContained(path)):
+                data = None
+        if data is not None:
+            f = BytesIO(data)
+            fst = cached.stat
+        else:
+            f = self.getFile(path)
+            if f is None:
+                return None
+            fst = os.fstat(f.fileno())
+        if not stat.S_ISREG(fst.st_mode):
+            f.close()
+            return None
+        return f, data, fst
+    
+    def checkIndexed(self, fst, path, st):
+        """
+        Returns True, if the sent file is the indexed one.
+        Otherwise its index entry is updated, the file is removed from
+        the memory cache and prepared again.
+        
+        @param fst: os.stat result of the sent file.
+        @param st: os.stat result of the index.
+        """
+        if (fst.st_ino, fst.st_mtime, fst.st_size) == \
+           (st.st_ino, st.st_mtime, st.st_size):
+            return True
+        log.debug("Index entry of %s is outdated" % path)
+        self.index.update(os.path.abspath(path))
+        self._cached.pop(path, None)
+        if self.memcache is not None:
+            self.memcache.remove(path)
+        self.response_headers.remove("Content-Encoding")
+        self.prepareFile()
+        return False
+        
+    def response_ranges(self, f, ranges, offset=0):
+        """
+        Sends the byte ranges of a file with code 206
+        
+        @param offset: Position of the file in f.
+        """
+        self.response_code = 206
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            self.setHeader("Content-Range",
+                           "bytes %d-%d/%d" % (first, last, self.size))
+            self.setHeader("Content-Length", str(last - first + 1))
+            return FileWrapper(f, self.BLOCKSIZE, offset + first,
+                               last - first + 1)
+        
+        boundary = uuid.uuid4().hex
+        parts = []
+        length = 0
+        for first, last in ranges:
+            head = ("\r\n--%s\r\n"
+                    "Content-Type: %s\r\n"
+                    "Content-Range: bytes %d-%d/%d\r\n\r\n"
+                    % (boundary, self.ctype, first, last, self.size))
+            head = head.encode("latin-1")
+            parts.append((offset + first, offset + last, head))
+            length += len(head) + last - first + 1
+        tail = ("\r\n--%s--\r\n" % boundary).encode("latin-1")
+        length += len(tail)
+        self.setHeader("Content-Type",
+                       "multipart/byteranges; boundary=%s" % boundary)
+        self.setHeader("Content-Length", str(length))
+        return FileRange(f, parts, tail, self.BLOCKSIZE)
+    
+    def getRanges(self, st, etag=None):
+        """
+        Returns the requested byte ranges, an empty list if they are not
+        satisfiable or None, if the whole file is sent.
+        
+        @param st: os.stat result of the file.
+        @param etag: The ETag of the file or None.
+        """
+        if self.request_method != "get":
+            return None
+        header = self.request_headers.get("HTTP_RANGE")
+        if not header:
+            return None
+        if_range = self.request_headers.get("HTTP_IF_RANGE")
+        if if_range and not self.checkIfRange(if_range, st, etag):
+            return None
+        ranges = parse_range(header, self.size)
+        if ranges is None:
+            log.debug("Invalid range %s" % header)
+            return None
+        ranges = coalesce_ranges(ranges)
+        if len(ranges) > self.MAX_RANGES:
+            return None
+        return ranges
+    
+    def checkIfRange(self, if_range, st, etag=None):
+        """
+        Returns True, if the If-Range header matches the file.
+        An ETag must match strong, a date must equal the modification time.
+        The ETag of a compressed response names a representation, whose
+        byte ranges are not sent, so the whole file is sent for it.
+        """
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            if etag is None or etag.startswith("W/"):
+                return False
+            tag, coding = split_etag_coding(if_range)
+            if coding is not None and tag == etag:
+                log.debug("If-Range of the %s coded file" % coding)
+                return False
+            return if_range == etag
+        try:
+            date = http2time(if_range)
+        except Exception:
+            return False
+        return date is not None and int(date) == int(st.st_mtime)
         
     def get(self):
         return self.response_file()
@@ -151,17 +732,97 @@ class FileMiddleware(Middleware):
     def head(self):
         return self.get()
         
+    def getPrecompressed(self):
+        """
+        Returns the path and the stat result of the gzip sidecar
+        of the file, if it exists, is not older than the file
+        and the client accepts gzip. Otherwise (None, None).
+        Sets the size and the Content-Encoding for the sidecar.
+        """
+        gzpath = self.fpath + ".gz"
+        gzstat = self.statFile(gzpath)
+        if gzstat is None:
+            return None, None
+        # The response depends on Accept-Encoding, even if the
+        # uncompressed file is sent.
+        self.setHeader("Vary", "Accept-Encoding")
+        if gzstat.st_mtime < self.fstat.st_mtime:
+            log.warning("Stale precompressed file %s" % gzpath)
+            return None, None
+        if not accepts_coding(self.request_headers.get("HTTP_ACCEPT_ENCODING",
+                                                       ""), "gzip"):
+            return None, None
+        self.size = gzstat.st_size
+        self.setHeader("Content-Encoding", "gzip")
+        return gzpath, gzstat
+        
     def getFile(self, path):
         try:
-            f = open(path, "r+b")
-            return f
-        except IOError as e:
+            return self.openFile(path)
+        except (IOError, OSError) as e:
             log.debug(str(e))
             return None
         
-    def checkCacheInfo(self, path):
+    def openFile(self, path):
+        """
+        Opens a file below the static path for reading.
+        Each component of the path is opened relative to the descriptor
+        of its directory without following symbolic links. A path with
+        symbolic links to files or directories is opened, if its real path
+        is below the static path.
+        """
+        root = self.static_path.rstrip(os.sep) + os.sep
+        root_fd = self.root.fd
+        if root_fd is None or not path.startswith(root):
+            if not self.isContained(path):
+                raise IOError(errno.EACCES, "Not below the static path", path)
+            return open(path, "rb")
+        names = [name for name in path[len(root):].split(os.sep) if name]
+        if not names:
+            raise IOError(errno.EISDIR, "Is a directory", path)
+        flags = os.O_RDONLY | os.O_NOFOLLOW
+        dir_fd = root_fd
+        fds = []
         try:
-            mtime = self.get_mtime(path)
+            for name in names[:-1]:
+                dir_fd = os.open(name, flags | os.O_DIRECTORY, dir_fd=dir_fd)
+                fds.append(dir_fd)
+            fd = os.open(names[-1], flags, dir_fd=dir_fd)
+        except OSError as err:
+            # A link to a directory fails with ENOTDIR, because the
+            # directories are opened with O_DIRECTORY
+            if err.errno not in (errno.ELOOP, errno.EMLINK, errno.ENOTDIR):
+                raise
+            if not self.isContained(path):
+                raise IOError(errno.EACCES, "Link target not below the "
+                              "static path", path)
+            return open(path, "rb")
+        finally:
+            for d in fds:
+                os.close(d)
+        return os.fdopen(fd, "rb")
+    
+    def isContained(self, path):
+        """ Returns True, if the real path of a file is below
+        the static path """
+        realpath = os.path.realpath(path)
+        real_path = self.root.real_path
+        return realpath == real_path or \
+            realpath.startswith(real_path.rstrip(os.sep) + os.sep)
+        
+    def checkCacheInfo(self, st, etag=None):
+        """
+        Returns True, if the cached file of the client is valid.
+        If-None-Match is checked instead of If-Modified-Since,
+        if the request has both.
+        
+        @param st: os.stat result of the file.
+        @param etag: The ETag of the file or None.
+        """
+        try:
+            if_none_match = self.request_headers.get("HTTP_IF_NONE_MATCH")
+            if if_none_match is not None:
+                return etag is not None and etag_matches(etag, if_none_match)
             if "HTTP_IF_MODIFIED_SINCE" in self.request_headers:
                 if_modified_since = self.request_headers["HTTP_IF_MODIFIED_SINCE"]
                 try:
@@ -169,7 +830,9 @@ class FileMiddleware(Middleware):
                 except Exception as err:
                     log.error(err)
                     return False
-                if int(mtime) > int(if_modified_since):
+                if if_modified_since is None:
+                    return False
+                if int(st.st_mtime) > int(if_modified_since):
                     return False
                 else:
                     return True
@@ -179,21 +842,68 @@ class FileMiddleware(Middleware):
             log.error(str(err), exc_info=True)
             return False
         
-    def prepareCacheHeaders(self):
+    def prepareCacheHeaders(self, path=None, st=None):
+        """
+        Sets Last-Modified, Cache-Control and ETag.
+        
+        @param path: The file sent, default is the requested file.
+        @param st: os.stat result of the file sent.
+        @return: The ETag or None.
+        """
+        path = path or self.fpath
         ext = os.path.splitext(self.fpath)[1].lower()
-        if ext in list(self.cache.keys()):
-            self.setCacheHeaders(self.fpath, **self.cache[ext])
+        if st is not None:
+            mtime = st.st_mtime
+        else:
+            mtime = self.get_mtime(path)
+        if self.asset is not None:
+            self.setCacheHeaders(path, mtime=mtime,
+                                 max_age=self.IMMUTABLE_MAX_AGE,
+                                 immutable=True)
         else:
-            self.setCacheHeaders(self.fpath)
+            self.setCacheHeaders(path, mtime=mtime, **self.cache.get(ext, {}))
+        etag = None
+        if st is not None and self.etag:
+            etag = self._memo(path, "etag-%s" % self.etag,
+                              lambda: self.getETag(path, st))
+            self.setHeader("ETag", etag)
+        return etag
+        
+    def getETag(self, path, st):
+        """
+        Returns the ETag of a file.
+        Content hashes are cached as long as the stat result is unchanged.
+        """
+        mtime = getattr(st, "st_mtime_ns", None) or int(st.st_mtime * 1e9)
+        if self.etag == "hash":
+            key = (path, st.st_ino, mtime, st.st_size)
+            etag = FileMiddleware._etags.get(key)
+            if etag is None:
+                etag = '"%s"' % utils.file_hash(path)
+                FileMiddleware._etags.set(key, etag)
+            return etag
+        etag = '"%x-%x-%x"' % (st.st_ino, mtime, st.st_size)
+        if self.etag == "weak":
+            etag = "W/" + etag
+        return etag
         
     def setCacheHeaders(self, path, no_cache=False, no_store=False,
-                        max_age=0, must_revalidate=False):
-        t = self.get_mtime(path)
-        last_modified = utils.time2netscape(t)
-        self.addHeader("Last-Modified", last_modified)
+                        max_age=0, must_revalidate=False, mtime=None,
+                        immutable=False):
+        if mtime is None:
+            mtime = self.get_mtime(path)
+        last_modified = self._memo(path, "last_modified",
+                                   lambda: utils.time2netscape(mtime))
+        self.setHeader("Last-Modified", last_modified)
         #expires = asctime(gmtime(time() + expires_secs))
         #self.addHeader("Expires", expires)
+        self.setHeader("Cache-Control",
+                       self.cacheControl(no_cache, no_store,
+                                         max_age, must_revalidate, immutable))
         
+    def cacheControl(self, no_cache=False, no_store=False,
+                     max_age=0, must_revalidate=False, immutable=False):
+        """ Returns the value of the Cache-Control header """
         cache_control = []
         if no_cache:
             cache_control.append("no-cache")
@@ -204,13 +914,15 @@ class FileMiddleware(Middleware):
             #cache_control += ", s-max-age=%d" % max_age
         if must_revalidate:
             cache_control.append("must-revalidate")
+        if immutable:
+            cache_control.append("immutable")
             
         if not cache_control:
             cache_control.append("no-cache")
             cache_control.append("must-revalidate")
             #cache_control.append("no-store")
             
-        self.addHeader("Cache-Control", ", ".join(cache_control))
+        return ", ".join(cache_control)
         
     def get_mtime(self, path):
         try:
@@ -13,17 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import atexit
 import logging
-from json import JSONDecoder, JSONEncoder
-from io import BytesIO
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 try:
     from urllib import unquote  # python 2
 except ImportError:
     from urllib.parse import unquote  # python 3
 
 from levitas.lib import utils
+from levitas.lib.workqueue import WorkQueue
+from levitas.lib.jsoncodec import get_codec
+from levitas.lib.serviceregistry import get_registry
 
-from . import Middleware
+from . import Middleware, STR
 
 
 log = logging.getLogger("levitas.middleware.jsonMiddleware")
@@ -39,6 +44,45 @@ CODES = {-32700: "Parse error",
 
 class ServiceImplementationError(Exception):
     pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = Lock()
+
+
+def get_pool(threads):
+    """
+    Returns the thread pool, which executes the calls of batch requests.
+    The pool is shared by all requests of a process.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            # Threads do not survive a fork
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPool(threads)
+                _pool_pid = pid
+                atexit.register(_pool.close)
+    return _pool
+
+
+_notifications = None
+
+
+def get_notification_queue(threads, maxsize, overflow):
+    """
+    Returns the WorkQueue, which executes notifications.
+    The queue is shared by all requests of a process.
+    """
+    global _notifications
+    if _notifications is None:
+        with _pool_lock:
+            if _notifications is None:
+                _notifications = WorkQueue(threads, maxsize, overflow,
+                                           name="levitas-notification")
+    return _notifications
         
 
 class JSONMiddleware(Middleware):
@@ -58,8 +102,62 @@ class JSONMiddleware(Middleware):
                                             {"service_attributes": {"attr1": VALUE,
                                                                     "attr2": VAUE}
                                             })]
+    
+    The calls of a batch request are executed concurrently in a thread
+    pool, each with its own service object. The responses are sent in
+    the order of the calls.
+    
+    Notifications (requests without id) are answered at once with 204,
+    or left out of the response of a batch, and executed in a background
+    queue. The middleware attribute of their service objects is None,
+    because the middleware may already handle another request.
+    
+    Public methods of the service class are exposed, attributes starting
+    with an underscore are not. The methods and their signatures are
+    registered, when the route is compiled, and the params of a call
+    are checked against the signature before the method is called.
+    
+    Example settings:
+        # Maximum number of calls in a batch request
+        json_batch_size = 32
+        # Number of threads executing the calls of batch requests,
+        # 0 executes them one after another
+        json_batch_threads = 8
+        # Number of threads executing notifications,
+        # 0 executes them before the response is sent
+        json_notification_threads = 2
+        # Maximum number of notifications waiting for execution
+        json_notification_queue_size = 1000
+        # Policy for notifications exceeding the queue size:
+        # "drop", "caller" (execute in the request thread) or "block"
+        json_notification_overflow = "drop"
+        
+        # JSON codec: "stdlib", "orjson", "ujson" or "auto" for the
+        # fastest installed one
+        json_codec = "auto"
+        # Maximum size of a request body, larger ones are answered
+        # with 413. A service class overrides it with max_body_size.
+        json_max_body_size = 16 * 1024 * 1024
+        # Unquote percent-encoded request bodies
+        json_unquote = False
     """
     LOG = True
+    
+    BATCH_SIZE = 32
+    
+    BATCH_THREADS = 8
+    
+    NOTIFICATION_THREADS = 2
+    
+    NOTIFICATION_QUEUE_SIZE = 1000
+    
+    NOTIFICATION_OVERFLOW = "drop"
+    
+    CODEC = "auto"
+    
+    MAX_BODY_SIZE = 16 * 1024 * 1024
+    
+    READ_SIZE = 64 * 1024
         
     def __init__(self, service_class, *service_args, **service_kwargs):
         """
@@ -70,73 +168,232 @@ class JSONMiddleware(Middleware):
         self.service_args = service_args
         self.service_kwargs = service_kwargs
         
+    @classmethod
+    def compileRoute(cls, service_class, *service_args, **service_kwargs):
+        """ Registers the exposed methods of the service class """
+        get_registry(service_class)
+        
     def post(self):
         try:
-            service = self.service_class(*self.service_args, **self.service_kwargs)
-            setattr(service, "middleware", self)
-            result = ServiceHandler(service).handleData(self.request_data)
+            if hasattr(self.settings, "json_batch_size"):
+                batch_size = self.settings.json_batch_size
+            else:
+                batch_size = self.BATCH_SIZE
+            if hasattr(self.settings, "json_batch_threads"):
+                threads = self.settings.json_batch_threads
+            else:
+                threads = self.BATCH_THREADS
+            handler = ServiceHandler(self.createService(),
+                                     service_factory=self.createService,
+                                     pool=get_pool(threads) if threads else None,
+                                     batch_size=batch_size,
+                                     notifications=self.notificationQueue(),
+                                     codec=self.codec())
+            result = handler.handleData(self.request_data)
+            if result is None:
+                # Only notifications
+                self.response_code = 204
+                return None
             return self.response_result(result)
         except Exception as e:
             log.debug(str(e), exc_info=True)
             return self.responseError(500, str(e))
         
+    def codec(self):
+        """ Returns the JSON codec """
+        if hasattr(self.settings, "json_codec"):
+            return get_codec(self.settings.json_codec)
+        return get_codec(self.CODEC)
+        
+    def notificationQueue(self):
+        """ Returns the WorkQueue of the notifications or None """
+        if hasattr(self.settings, "json_notification_threads"):
+            threads = self.settings.json_notification_threads
+        else:
+            threads = self.NOTIFICATION_THREADS
+        if not threads:
+            return None
+        if hasattr(self.settings, "json_notification_queue_size"):
+            maxsize = self.settings.json_notification_queue_size
+        else:
+            maxsize = self.NOTIFICATION_QUEUE_SIZE
+        if hasattr(self.settings, "json_notification_overflow"):
+            overflow = self.settings.json_notification_overflow
+        else:
+            overflow = self.NOTIFICATION_OVERFLOW
+        return get_notification_queue(threads, maxsize, overflow)
+        
+    def createService(self):
+        """ Returns a new service object """
+        service = self.service_class(*self.service_args, **self.service_kwargs)
+        setattr(service, "middleware", self)
+        return service
+        
     def response_result(self, result):
-        f = BytesIO()
-        f.write(result.encode(self._encoding))
+        """ Sends the UTF-8 encoded JSON result """
+        if not isinstance(result, bytes):
+            result = result.encode("utf-8")
         self.response_code = 200
-        size = f.tell()
-        f.seek(0)
-        self.addHeader("Content-type", "application/json-rpc; charset=utf-8")
-        self.addHeader("Content-Length", str(size))
-        self.addHeader("Cache-Control", "no-cache")
-        self._startResponse()
-        return f
+        self.setHeader("Content-Type", "application/json-rpc; charset=utf-8")
+        self.setHeader("Content-Length", str(len(result)))
+        self.setHeader("Cache-Control", "no-cache")
+        return [result]
+        
+    def maxBodySize(self):
+        """ Returns the maximum size of a request body or None """
+        if hasattr(self.service_class, "max_body_size"):
+            return self.service_class.max_body_size
+        if hasattr(self.settings, "json_max_body_size"):
+            return self.settings.json_max_body_size
+        return self.MAX_BODY_SIZE
         
     def parsePOST(self):
-        """ Parse the form data posted """
-        content_length = self.request_headers["CONTENT_LENGTH"]
-        content_length = int(content_length)
-        content_type = self.request_headers["CONTENT_TYPE"]
+        """
+        Reads the posted JSON document into a bytearray.
+        Codecs parsing bytes decode it without further copies.
+        """
+        content_type = self.request_headers.get("CONTENT_TYPE", "")
+        if not content_type.startswith("text/json") and \
+           not content_type.startswith("application/json"):
+            log.error("Wrong content type")
+            return 415
+        try:
+            content_length = int(self.request_headers["CONTENT_LENGTH"])
+        except (KeyError, ValueError):
+            log.error("Missing Content-Length")
+            return 411
+        if content_length < 0:
+            log.error("Invalid Content-Length %d" % content_length)
+            return 400
         log.debug("POST: %s, Content-Length: %d" % (content_type, content_length))
+        max_body_size = self.maxBodySize()
+        if max_body_size and content_length > max_body_size:
+            log.error("Request body of %d bytes exceeds %d bytes"
+                      % (content_length, max_body_size))
+            return 413
         try:
-            if content_type.startswith("text/json") or \
-                content_type.startswith("application/json"):
-                self.request_data = self.input.read(content_length)
-                self.request_data = self.request_data.decode(self._encoding)
-                self.request_data = unquote(self.request_data)
-                log.debug("POST data parsed")
-                return 0
-            else:
-                log.error("Wrong content type")
-                return 415
+            data = self.readBody(content_length)
+            if data is None:
+                log.error("Incomplete request body")
+                return 400
+            if hasattr(self.settings, "json_unquote") and \
+               self.settings.json_unquote:
+                data = unquote(data.decode(self._encoding))
+            elif self.codec().text:
+                # The buffer is released before the document is parsed
+                data = data.decode(self._encoding)
+            self.request_data = data
+            log.debug("POST data parsed")
+            return 0
         except Exception as err:
             log.error("Failed to parse the form data: %s" % str(err), exc_info=True)
             return 500
         
+    def readBody(self, length):
+        """
+        Reads the request body into a preallocated bytearray.
+        
+        @return: The bytearray or None, if the body is incomplete.
+        """
+        buf = bytearray(length)
+        view = memoryview(buf)
+        readinto = getattr(self.input, "readinto", None)
+        pos = 0
+        while pos < length:
+            if readinto is not None:
+                n = readinto(view[pos:pos + self.READ_SIZE])
+            else:
+                data = self.input.read(min(self.READ_SIZE, length - pos))
+                n = len(data)
+                view[pos:pos + n] = data
+            if not n:
+                return None
+            pos += n
+        return buf
+        
     
 class ServiceHandler:
-    def __init__(self, service):
-        self.decoder = JSONDecoder(strict=False)
-        self.encoder = JSONEncoder(ensure_ascii=True, sort_keys=False)
+    def __init__(self, service, service_factory=None, pool=None,
+                 batch_size=None, notifications=None, codec=None):
+        """
+        @param service: Object with the remote methods.
+        @param service_factory: Returns a new service object for each
+                                call of a batch request.
+        @param pool: Thread pool executing the calls of a batch request.
+                     They are executed concurrently only with a
+                     service_factory.
+        @param batch_size: Maximum number of calls in a batch request.
+        @param notifications: WorkQueue executing notifications.
+                              Without a queue or a service_factory
+                              they are executed at once. The middleware
+                              of queued service objects is set to None.
+        @param codec: JSON codec, default is the fastest installed one.
+        """
+        self.codec = codec or get_codec()
         self.service = service
+        self.registry = get_registry(service.__class__)
+        self.service_factory = service_factory
+        self.pool = pool
+        self.batch_size = batch_size
+        self.notifications = notifications
         self.retry = False
         
     def handleData(self, data):
         try:
-            obj = self.decoder.decode(data)
+            obj = self.codec.decode(data)
+            if isinstance(obj, list):
+                return self.handleBatch(obj)
             result = self.handleRequest(obj)
             return result
         except Exception as err:
             log.error("Internal error: %s" % str(err))
-            log.error(data, exc_info=True)
+            log.error(data[:1000], exc_info=True)
             return self.__getError(None, -32603, err)
 
+    def handleBatch(self, reqs):
+        """
+        Handles the requests of a batch.
+        An error of one request does not affect the others.
+        """
+        if not reqs:
+            return self.__getError(None, -32600, "Batch must not be empty.")
+        if self.batch_size and len(reqs) > self.batch_size:
+            return self.__getError(None, -32600,
+                                   "Batch of %d requests exceeds the limit "
+                                   "of %d." % (len(reqs), self.batch_size))
+        if self.pool is not None and self.service_factory is not None \
+           and len(reqs) > 1:
+            results = self.pool.map(self._handleBatchRequest, reqs)
+        else:
+            results = [self._handleBatchRequest(req) for req in reqs]
+        results = [result for result in results if result is not None]
+        if not results:
+            # Only notifications
+            return None
+        return b"[" + b",".join(results) + b"]"
+    
+    def _handleBatchRequest(self, req):
+        try:
+            if isinstance(req, dict) and "id" not in req:
+                return self.handleNotification(req)
+            if self.service_factory is not None:
+                handler = ServiceHandler(self.service_factory(), codec=self.codec)
+            else:
+                handler = self
+            return handler.handleRequest(req)
+        except Exception as err:
+            log.error("Internal error: %s" % str(err), exc_info=True)
+            idnr = req.get("id") if isinstance(req, dict) else None
+            return self.__getError(idnr, -32603, err)
+
     def handleRequest(self, req):
         """handles a request by calling the appropriete method the service exposes"""
+        if not isinstance(req, dict):
+            return self.__getError(None, -32600,
+                                   "Request must be an object.")
         # id of the request object
         if not "id" in req:
-            return self.__getError(None, -32600,
-                                   "'id' memeber must be given.")
+            return self.handleNotification(req)
         idnr = req["id"]
         
         # version of the json-rpc protocol
@@ -153,9 +410,13 @@ class ServiceHandler:
             return self.__getError(None, -32600,
                                    "'method' memeber must be given.")
         method = req["method"]
-        if not hasattr(self.service, method):
+        if isinstance(method, STR):
+            method = self.registry.get(method)
+        else:
+            method = None
+        if method is None:
             return self.__getError(None, -32601,
-                                   "Method %s not found." % method)
+                                   "Method %s not found." % req["method"])
         
         # params of the method
         if "params" in req:
@@ -167,18 +428,17 @@ class ServiceHandler:
                 args = []
         else:
             args = []
+        error = method.check(args)
+        if error is not None:
+            log.error("Invalid params: %s" % error)
+            return self.__getError(idnr, -32602, error)
                         
-        obj = None
         try:
             if hasattr(self.service, "_prepare"):
                 prepare = getattr(self.service, "_prepare")
                 prepare()
-            obj = getattr(self.service, method)
             
-            if isinstance(args, list):
-                data = self.__getResult(idnr, obj(*args))
-            elif isinstance(args, dict):
-                data = self.__getResult(idnr, obj(**args))
+            data = self.__getResult(idnr, method.call(self.service, args))
                 
             if hasattr(self.service, "_complete"):
                 complete = getattr(self.service, "_complete")
@@ -186,8 +446,9 @@ class ServiceHandler:
                 
             return data
         except TypeError as err:
-            log.error("Invalid params: %s" % str(err), exc_info=True)
-            return self.__getError(idnr, -32602, err)
+            # Raised by the method, the params are checked before
+            log.error("Internal error: %s" % str(err), exc_info=True)
+            return self.__getError(idnr, -32603, err)
         except AttributeError as err:
             log.error("Parse error: %s" % str(err), exc_info=True)
             return self.__getError(idnr, -32700, err)
@@ -195,11 +456,39 @@ class ServiceHandler:
             log.error("Parse error: %s" % str(err), exc_info=True)
             return self.__getError(idnr, -32700, err)
     
+    def handleNotification(self, req):
+        """
+        Handles a request without id. Notifications are not answered,
+        invalid ones are logged and ignored.
+        
+        @return: None
+        """
+        method = req.get("method")
+        if req.get("jsonrpc") != "2.0" or not isinstance(method, STR) or \
+           method not in self.registry:
+            log.warning("Invalid notification: %s" % str(req)[:200])
+            return None
+        req = dict(req, id=None)
+        if self.service_factory is None:
+            self.handleRequest(req)
+            return None
+        # The calls of a batch may run concurrently,
+        # each notification has its own service object
+        handler = ServiceHandler(self.service_factory(), codec=self.codec)
+        if self.notifications is None:
+            handler.handleRequest(req)
+        else:
+            # The middleware may already handle another request,
+            # when the notification is executed
+            handler.service.middleware = None
+            self.notifications.submit(handler.handleRequest, req)
+        return None
+    
     def __getResult(self, idnr, result):
         obj = {"jsonrpc": "2.0", "id": idnr}
         obj["result"] = result
         try:
-            return self.encoder.encode(obj)
+            return self.codec.encode(obj)
         except Exception as err:
             log.error("JSON failed to encode: %s" % str(err), exc_info=True)
             return self.__getError(idnr, -32603, err)
@@ -217,7 +506,7 @@ class ServiceHandler:
             
         obj["error"] = error
         try:
-            return self.encoder.encode(obj)
+            return self.codec.encode(obj)
         except Exception as err:
             return self.responseError(500, str(err))
         
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2013 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+try:
+    from urlparse import parse_qs  # python 2
+except ImportError:
+    from urllib.parse import parse_qs  # python 3
+
+from levitas.lib.headers import environ_key
+
+
+class Request(object):
+    """
+    Slim view of a request for function handlers.
+    
+    Example:
+    def health(request):
+        return 200, [("Content-Type", "text/plain")], "OK"
+        
+    urls = [(r"^/health$", health)]
+    """
+    
+    __slots__ = ("environ", "re_match", "_args")
+    
+    def __init__(self, environ, re_match=None):
+        self.environ = environ
+        """ The wsgi environment """
+        
+        self.re_match = re_match
+        """ match object for regular expression of the request path """
+        
+        self._args = None
+        
+    @property
+    def method(self):
+        """ HTTP-Request method in lower case """
+        return self.environ["REQUEST_METHOD"].lower()
+    
+    @property
+    def path(self):
+        return self.environ["PATH_INFO"]
+    
+    @property
+    def query_string(self):
+        return self.environ.get("QUERY_STRING", "")
+    
+    @property
+    def input(self):
+        return self.environ["wsgi.input"]
+    
+    @property
+    def args(self):
+        """ Dictionary of the query string arguments """
+        if self._args is None:
+            self._args = parse_qs(self.query_string)
+        return self._args
+    
+    def url_groups(self):
+        return self.re_match.groups()
+    
+    def getHeader(self, name, default=None):
+        """
+        Returns a request header, e.g. getHeader("Accept-Language").
+        """
+        return self.environ.get(environ_key(name), default)
@@ -16,14 +16,58 @@
 import logging
 from wsgiref.simple_server import (make_server,
                                    WSGIServer,
-                                   WSGIRequestHandler)
-    
+                                   WSGIRequestHandler,
+                                   ServerHandler)
+
+from levitas.lib.filewrapper import FileWrapper
 from .baseServer import BaseServer
 
 
 log = logging.getLogger("levitas.server.testServer")
 
 
+class SendfileServerHandler(ServerHandler):
+    """
+    Provides the levitas FileWrapper as wsgi.file_wrapper
+    and sends wrapped files with FileWrapper.transmit.
+    """
+    
+    wsgi_file_wrapper = FileWrapper
+    
+    def sendfile(self):
+        request_handler = getattr(self, "request_handler", None)
+        sock = getattr(request_handler, "connection", None)
+        if sock is None or not isinstance(self.result, FileWrapper):
+            return False
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        self.bytes_sent += self.result.transmit(sock)
+        return True
+    
+    
+class SendfileRequestHandler(WSGIRequestHandler):
+    
+    def handle(self):
+        """Handle a single HTTP request"""
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            return
+
+        if not self.parse_request():  # An error code has been sent, just exit
+            return
+
+        handler = SendfileServerHandler(self.rfile, self.wfile,
+                                        self.get_stderr(), self.get_environ(),
+                                        multithread=False)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        
+        
 class TestServer(BaseServer):
     """
     Test WSGI Server.
@@ -40,7 +84,7 @@ class TestServer(BaseServer):
                                 self.server_address[1],
                                 self.app,
                                 server_class=WSGIServer,
-                                handler_class=WSGIRequestHandler)
+                                handler_class=SendfileRequestHandler)
             #httpd.socket.settimeout(0)
             httpd.serve_forever()
         except Exception as err:
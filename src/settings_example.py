@@ -31,6 +31,28 @@ Tuple examples:
 #]
 
 
+"""
+Optional number of request paths whose matching url is cached.
+Default is 0 (no cache).
+"""
+# route_cache_size = 1000
+
+
+"""
+Optional compression of responses with gzip or deflate.
+Compressed are responses of the allowed types with at least min_size bytes.
+Responses up to buffer_size bytes are compressed at once, larger ones
+are compressed while they are streamed. The compressed bodies of cacheable
+responses are kept in a cache of at most cache_size bytes (0 is no cache).
+"""
+# compression = True
+# compression_min_size = 512
+# compression_types = ("text/*", "application/json", "application/json-rpc")
+# compression_level = 6
+# compression_buffer_size = 1024 * 1024
+# compression_cache_size = 16 * 1024 * 1024
+
+
 """
 Integrated webserver.
 """
@@ -21,7 +21,11 @@ from tests import (jsonMiddlewareTest,
                    fileMiddlewareTest,
                    loggerMiddlewareTest,
                    appMiddlewareTest,
-                   dynSiteMiddlewareTest)
+                   archiveMiddlewareTest,
+                   dynSiteMiddlewareTest,
+                   routerTest,
+                   multipartTest,
+                   compressionTest)
 
 SEPERATOR1 = "=" * 70
 SEPERATOR2 = "-" * 70
@@ -71,6 +75,10 @@ def main():
                         dest="appMiddlewareTest",
                         action="store_true",
                         help="AppMiddleware-Test")
+    parser.add_argument("-z", "--archiveMiddlewareTest",
+                        dest="archiveMiddlewareTest",
+                        action="store_true",
+                        help="ArchiveMiddleware-Test")
     parser.add_argument("-l", "--loggerMiddlewareTest",
                         dest="loggerMiddlewareTest",
                         action="store_true",
@@ -79,6 +87,18 @@ def main():
                         dest="dynSiteMiddlewareTest",
                         action="store_true",
                         help="DynSiteMiddleware-Test")
+    parser.add_argument("-r", "--routerTest",
+                        dest="routerTest",
+                        action="store_true",
+                        help="Router-Test")
+    parser.add_argument("-p", "--multipartTest",
+                        dest="multipartTest",
+                        action="store_true",
+                        help="Multipart-Test")
+    parser.add_argument("-c", "--compressionTest",
+                        dest="compressionTest",
+                        action="store_true",
+                        help="Compression-Test")
     
     args = parser.parse_args()
     
@@ -96,19 +116,35 @@ def main():
     if args.appMiddlewareTest:
         tests["AppMiddleware-Test"] = appMiddlewareTest
     
+    if args.archiveMiddlewareTest:
+        tests["ArchiveMiddleware-Test"] = archiveMiddlewareTest
+    
     if args.loggerMiddlewareTest:
         tests["LoggerMiddleware-Test"] = loggerMiddlewareTest
     
     if args.dynSiteMiddlewareTest:
         tests["DynSiteMiddleware-Test"] = dynSiteMiddlewareTest
+    
+    if args.routerTest:
+        tests["Router-Test"] = routerTest
+    
+    if args.multipartTest:
+        tests["Multipart-Test"] = multipartTest
+    
+    if args.compressionTest:
+        tests["Compression-Test"] = compressionTest
         
     if not tests:
         tests["Middleware-Test"] = middlewareTest
         tests["JsonMiddleware-Test"] = jsonMiddlewareTest
         tests["FileMiddleware-Test"] = fileMiddlewareTest
         tests["AppMiddleware-Test"] = appMiddlewareTest
+        tests["ArchiveMiddleware-Test"] = archiveMiddlewareTest
         tests["LoggerMiddleware-Test"] = loggerMiddlewareTest
         tests["DynSiteMiddleware-Test"] = dynSiteMiddlewareTest
+        tests["Router-Test"] = routerTest
+        tests["Multipart-Test"] = multipartTest
+        tests["Compression-Test"] = compressionTest
         
     if args.verbose:
         log = logging.getLogger()
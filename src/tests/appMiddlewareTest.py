@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+import shutil
+import tempfile
 import logging
 
 from tests import test
@@ -29,6 +33,9 @@ from levitas.middleware.appMiddleware import AppMiddleware
 urls = [(r"^/(.*)$", AppMiddleware, {"path":
             "/home/tobi/Workspaces/Public/levitas/src/tests/files"})
 ]
+
+static_index = True
+static_index_interval = 0
 """
     
 
@@ -39,6 +46,84 @@ class AppMiddlewareTest(BaseTest):
         obj = self._request("/")
         self.assertEqual(obj.code, 200, "Get index.html failed")
         
+    def test_missing_file(self):
+        """Test a missing file is not found."""
+        obj = self._request("/missing/file.php")
+        self.assertEqual(obj.code, 404)
+        
+    def test_index_at_startup(self):
+        """Test the index is built, when the route is compiled"""
+        from levitas.factory import MiddlewareFactory
+        from levitas.middleware.appMiddleware import AppMiddleware
+        from levitas.middleware.fileMiddleware import FileMiddleware
+        
+        path = tempfile.mkdtemp()
+        try:
+            MiddlewareFactory(r"^/(.*)$", AppMiddleware, path=path)
+            self.assertTrue(path in FileMiddleware._indexes)
+        finally:
+            FileMiddleware._indexes.pop(path, None)
+            shutil.rmtree(path)
+        
+    def test_modified_in_place(self):
+        """Test a file modified in place is not answered with 304"""
+        fn = os.path.join(self.cwd, "files", "inplace.txt")
+        with open(fn, "wb") as f:
+            f.write(b"1234")
+        try:
+            obj = self._request("/inplace.txt")
+            self.assertEqual(obj.read(), b"1234")
+            etag = obj.info()["ETag"]
+            # The directory is not modified
+            with open(fn, "r+b") as f:
+                f.write(b"12345678")
+            mtime = time.time() + 10
+            os.utime(fn, (mtime, mtime))
+            self.headers["If-None-Match"] = etag
+            obj = self._request("/inplace.txt")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.read(), b"12345678")
+        finally:
+            os.remove(fn)
+        
+    def test_replaced_cached_file(self):
+        """Test a replaced file of the memory cache is sent"""
+        from levitas.lib.settings import Settings
+        from levitas.lib.filecache import FileCache
+        from levitas.middleware.fileMiddleware import FileMiddleware
+        
+        settings = Settings()
+        cache_size = getattr(settings, "static_cache_size", None)
+        memcache = FileMiddleware._memcache
+        settings.static_cache_size = 1024 * 1024
+        # The cached file is not checked again during the test
+        FileMiddleware._memcache = FileCache(settings.static_cache_size,
+                                             interval=60)
+        files = os.path.join(self.cwd, "files")
+        fn = os.path.join(files, "deploy.js")
+        dst = os.stat(files)
+        with open(fn, "wb") as f:
+            f.write(b"1234")
+        try:
+            obj = self._request("/deploy.js")
+            self.assertEqual(obj.read(), b"1234")
+            with open(fn + ".tmp", "wb") as f:
+                f.write(b"12345678")
+            os.rename(fn + ".tmp", fn)
+            # The mtime resolution of some filesystems is one second
+            os.utime(files, (time.time() + 5, time.time() + 5))
+            obj = self._request("/deploy.js")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.read(), b"12345678")
+        finally:
+            FileMiddleware._memcache = memcache
+            if cache_size is None:
+                del settings.static_cache_size
+            else:
+                settings.static_cache_size = cache_size
+            os.remove(fn)
+            os.utime(files, (dst.st_atime, dst.st_mtime))
+        
     
 def run():
     return test.run(SETTINGS, AppMiddlewareTest)
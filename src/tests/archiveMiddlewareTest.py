@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import logging
+
+from levitas.lib.assets import pack
+
+from tests import test
+from .test import BaseTest
+
+
+log = logging.getLogger("levitas.tests.archiveMiddlewareTest")
+
+
+SETTINGS = \
+"""
+from levitas.middleware.archiveMiddleware import ArchiveMiddleware
+
+urls = [(r"^/(.*)$", ArchiveMiddleware, {"path":
+            "/home/tobi/Workspaces/Public/levitas/src/tests/files.zip"})
+]
+
+static_archive_interval = 0
+"""
+
+
+class ArchiveMiddlewareTest(BaseTest):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.files = os.path.join(self.cwd, "files")
+        self.archive = os.path.join(self.cwd, "files.zip")
+        pack(self.files, self.archive)
+
+    def tearDown(self):
+        if os.path.exists(self.archive):
+            os.remove(self.archive)
+
+    def test_get_file(self):
+        """Test a file is sent from the archive"""
+        obj = self._request("testfile.png")
+        with open(os.path.join(self.files, "testfile.png"), "rb") as f:
+            content = f.read()
+        self.assertEqual(obj.code, 200)
+        self.assertEqual(obj.info()["Content-Type"], "image/png")
+        self.assertEqual(obj.info()["Content-Length"], str(len(content)))
+        self.assertEqual(obj.read(), content)
+
+        obj = self._request("missing.png")
+        self.assertEqual(obj.code, 404)
+
+    def test_index_html(self):
+        """Test index.html of a directory is sent"""
+        obj = self._request("/")
+        self.assertEqual(obj.code, 200)
+        self.assertEqual(obj.info()["Content-Type"], "text/html")
+
+    def test_cache_headers(self):
+        """Test ETag and range requests of archive files"""
+        obj = self._request("testfile.png")
+        etag = obj.info()["ETag"]
+        content = obj.read()
+        self.assertTrue(etag)
+
+        self.headers["If-None-Match"] = etag
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 304)
+
+        del self.headers["If-None-Match"]
+        self.headers["Range"] = "bytes=2-5"
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 206)
+        self.assertEqual(obj.read(), content[2:6])
+
+    def test_replace(self):
+        """Test a replaced archive is loaded"""
+        fn = os.path.join(self.files, "replaced.txt")
+        self.assertEqual(self._request("replaced.txt").code, 404)
+        with open(fn, "wb") as f:
+            f.write(b"replaced")
+        try:
+            pack(self.files, self.archive)
+            obj = self._request("replaced.txt")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.read(), b"replaced")
+        finally:
+            os.remove(fn)
+
+
+def run():
+    return test.run(SETTINGS, ArchiveMiddlewareTest)
+
+
+if __name__ == "__main__":
+    run()
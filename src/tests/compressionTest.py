@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zlib
+import unittest
+import logging
+
+from levitas.lib.compression import Compressor, negotiate
+from levitas.lib.lrucache import LRUCache
+from levitas.middleware.fileMiddleware import etag_matches
+
+
+log = logging.getLogger("levitas.tests.compressionTest")
+
+
+BODY = b"".join(b'{"id": %d, "result": "value"}\n' % i for i in range(100))
+
+
+def app(environ, start_response):
+    path = environ["PATH_INFO"]
+    if path == "/stream":
+        start_response("200 OK", [("Content-Type", "text/csv")])
+        return iter([BODY[:1000], BODY[1000:]])
+    headers = [("Content-Type", "application/json"),
+               ("Content-Length", str(len(BODY))),
+               ("ETag", '"abc"')]
+    if path == "/conditional" and \
+       etag_matches('"abc"', environ.get("HTTP_IF_NONE_MATCH", "")):
+        start_response("304 Not Modified", [("ETag", '"abc"')])
+        return []
+    if path == "/png":
+        headers[0] = ("Content-Type", "image/png")
+    elif path == "/private":
+        headers.append(("Cache-Control", "private"))
+    elif path == "/ranges":
+        headers.append(("Accept-Ranges", "bytes"))
+    start_response("200 OK", headers)
+    return [BODY]
+
+
+class CompressionTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.compressor = Compressor(app, cache_size=1024 * 1024)
+        
+    def _call(self, path, accept="gzip", **headers):
+        environ = {"REQUEST_METHOD": "GET",
+                   "PATH_INFO": path,
+                   "HTTP_ACCEPT_ENCODING": accept}
+        environ.update(headers)
+        response = []
+        
+        def start_response(status, headers, exc_info=None):
+            response.append(dict(headers))
+            
+        body = b"".join(self.compressor(environ, start_response))
+        return response[0], body
+    
+    def test_negotiate(self):
+        """Test the content coding with the highest qvalue is chosen"""
+        self.assertEqual(negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(negotiate("gzip;q=0.5, deflate"), "deflate")
+        self.assertEqual(negotiate("*;q=0.1, gzip;q=0"), "deflate")
+        self.assertEqual(negotiate("identity"), None)
+        self.assertEqual(negotiate(""), None)
+        
+    def test_gzip(self):
+        """Test a response is compressed with gzip"""
+        headers, body = self._call("/json")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(headers["ETag"], '"abc-gzip"')
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), BODY)
+        
+    def test_etag_round_trip(self):
+        """Test the ETag of a compressed response is validated with 304"""
+        headers, body = self._call("/conditional")
+        etag = headers["ETag"]
+        self.assertEqual(etag, '"abc-gzip"')
+        headers, body = self._call("/conditional", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(body, b"")
+        self.assertEqual(headers["ETag"], etag)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertFalse("Content-Encoding" in headers)
+        
+        headers, body = self._call("/conditional",
+                                   HTTP_IF_NONE_MATCH='"abc-deflate"')
+        self.assertEqual(headers["ETag"], '"abc"')
+        self.assertFalse(etag_matches('"abc"', '"abd-gzip"'))
+        
+    def test_no_ranges(self):
+        """Test ranges are not offered for a compressed response"""
+        headers, body = self._call("/ranges")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertFalse("Accept-Ranges" in headers)
+        headers, body = self._call("/ranges", accept="identity")
+        self.assertEqual(headers["Accept-Ranges"], "bytes")
+        
+    def test_deflate(self):
+        """Test a response is compressed with deflate"""
+        headers, body = self._call("/json", "deflate")
+        self.assertEqual(headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(body), BODY)
+        
+    def test_stream(self):
+        """Test a response without Content-Length is compressed streamed"""
+        headers, body = self._call("/stream")
+        self.assertFalse("Content-Length" in headers)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), BODY)
+        
+    def test_not_compressed(self):
+        """Test responses are not compressed, if it is not possible"""
+        headers, body = self._call("/png")
+        self.assertFalse("Content-Encoding" in headers)
+        self.assertEqual(body, BODY)
+        headers, body = self._call("/json", "identity")
+        self.assertFalse("Content-Encoding" in headers)
+        self.compressor.min_size = len(BODY) + 1
+        headers, body = self._call("/json")
+        self.assertFalse("Content-Encoding" in headers)
+        
+    def test_cache(self):
+        """Test compressed bodies of cacheable responses are cached"""
+        self._call("/json")
+        self._call("/json", "deflate")
+        self.assertEqual(len(self.compressor.cache), 2)
+        self._call("/private")
+        self.assertEqual(len(self.compressor.cache), 2)
+        
+    def test_lru_cache_weight(self):
+        """Test the total weight of a cache is bounded"""
+        cache = LRUCache(10, weight=len)
+        cache.set("a", b"12345")
+        cache.set("b", b"12345")
+        cache.set("c", b"123")
+        self.assertFalse("a" in cache)
+        self.assertEqual(cache.weight, 8)
+        cache.set("d", b"12345678901")
+        self.assertFalse("d" in cache)
+        
+        
+def run():
+    suite = unittest.TestLoader().loadTestsFromTestCase(CompressionTest)
+    return unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+if __name__ == "__main__":
+    run()
@@ -14,9 +14,11 @@
 # limitations under the License.
 
 import os
+import gzip
 import time
 import stat
 import logging
+from io import BytesIO
 
 from tests import test
 from .test import BaseTest
@@ -30,9 +32,20 @@ SETTINGS = \
 from levitas.middleware.fileMiddleware import FileMiddleware
 
 urls = [
+(r"^/gz/(.*)$", FileMiddleware,
+            {"path": "/home/tobi/Workspaces/Public/levitas/src/tests/files",
+             "precompressed": True}),
+(r"^/fp/(.*)$", FileMiddleware,
+            {"path": "/home/tobi/Workspaces/Public/levitas/src/tests/files",
+             "fingerprints": True}),
+(r"^/current/(.*)$", FileMiddleware,
+            "/home/tobi/Workspaces/Public/levitas/src/tests/current"),
 (r"^/(.*)$", FileMiddleware,
             "/home/tobi/Workspaces/Public/levitas/src/tests/files")
 ]
+
+static_cache_size = 1024 * 1024
+static_cache_interval = 0
 """
     
 
@@ -42,7 +55,7 @@ class FileMiddlewareTest(BaseTest):
         """Test request binary file"""
         obj = self._request("testfile.png")
         headers = obj.headers
-        f = "testfile.png"
+        f = os.path.join(self.cwd, "files/testfile.png")
         s = os.stat(f)[stat.ST_SIZE]
         self.assertTrue(headers["Content-type"] == "image/png", str(obj))
         self.assertTrue(headers["Content-Length"] == str(s), str(obj))
@@ -99,6 +112,361 @@ class FileMiddlewareTest(BaseTest):
                          "Server did not return 200")
         os.remove(fn)
         
+    def test_etag(self):
+        """Test If-None-Match is answered with 304"""
+        obj = self._request("testfile.png")
+        etag = obj.info()["ETag"]
+        self.assertTrue(etag.startswith('"'), etag)
+        
+        self.headers["If-None-Match"] = '"other", W/%s' % etag
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 304)
+        
+        # ETag of a gzip compressed response
+        self.headers["If-None-Match"] = '%s-gzip"' % etag[:-1]
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 304)
+        
+        # If-None-Match is used instead of If-Modified-Since
+        self.headers["If-None-Match"] = '"other"'
+        self.headers["If-Modified-Since"] = obj.info()["Last-Modified"]
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 200)
+        
+    def test_not_modified_unopened(self):
+        """Test 304 is answered without opening the file"""
+        from levitas.middleware.fileMiddleware import FileMiddleware
+        
+        fn = os.path.join(self.cwd, "files/large.bin")
+        # Larger than the files of the memory cache
+        with open(fn, "wb") as f:
+            f.write(b"0" * 300000)
+        opened = []
+        get_file = FileMiddleware.getFile
+        
+        def getFile(middleware, path):
+            opened.append(path)
+            return get_file(middleware, path)
+        
+        try:
+            obj = self._request("large.bin")
+            etag = obj.info()["ETag"]
+            FileMiddleware.getFile = getFile
+            self.headers["If-None-Match"] = etag
+            obj = self._request("large.bin")
+            self.assertEqual(obj.code, 304)
+            self.assertEqual(opened, [])
+        finally:
+            FileMiddleware.getFile = get_file
+            os.remove(fn)
+        
+    def test_range(self):
+        """Test single and multiple byte ranges"""
+        f = open(os.path.join(self.cwd, "files/testfile.png"), "rb")
+        content = f.read()
+        f.close()
+        
+        self.headers["Range"] = "bytes=10-19"
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 206)
+        self.assertEqual(obj.info()["Content-Range"],
+                         "bytes 10-19/%d" % len(content))
+        self.assertEqual(obj.read(), content[10:20])
+        
+        self.headers["Range"] = "bytes=-5"
+        self.assertEqual(self._request("testfile.png").read(), content[-5:])
+        
+        self.headers["Range"] = "bytes=0-1,100-101"
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 206)
+        ctype = obj.info()["Content-Type"]
+        self.assertTrue(ctype.startswith("multipart/byteranges"), ctype)
+        data = obj.read()
+        self.assertEqual(obj.info()["Content-Length"], str(len(data)))
+        self.assertTrue(b"Content-Range: bytes 100-101/" in data)
+        self.assertTrue(content[100:102] in data)
+        
+        self.headers["Range"] = "bytes=%d-" % len(content)
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 416)
+        
+        # The whole file is sent, if If-Range does not match
+        self.headers["Range"] = "bytes=10-19"
+        self.headers["If-Range"] = '"other"'
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 200)
+        self.assertEqual(obj.read(), content)
+        
+        etag = obj.info()["ETag"]
+        self.headers["If-Range"] = etag
+        self.assertEqual(self._request("testfile.png").code, 206)
+        # Ranges of a compressed response are not sent
+        self.headers["If-Range"] = '%s-gzip"' % etag[:-1]
+        obj = self._request("testfile.png")
+        self.assertEqual(obj.code, 200)
+        self.assertEqual(obj.read(), content)
+        
+    def test_memory_cache(self):
+        """Test cached files are checked after the interval"""
+        from levitas.lib.filecache import FileCache
+        
+        fn = os.path.join(self.cwd, "files/memcache.txt")
+        f = open(fn, "wb")
+        f.write(b"1234")
+        f.close()
+        try:
+            cache = FileCache(1536, max_file_size=100, interval=60)
+            entry = cache.get(fn)
+            self.assertEqual(entry.data, b"1234")
+            self.assertTrue(cache.get(fn) is entry)
+            
+            f = open(fn, "wb")
+            f.write(b"12345")
+            f.close()
+            self.assertEqual(cache.get(fn).data, b"1234")
+            entry.checked = 0
+            self.assertEqual(cache.get(fn).data, b"12345")
+            
+            # Missing files are cached separately
+            self.assertTrue(cache.get(fn + ".gz").stat is None)
+            self.assertTrue(fn + ".gz" not in cache.cache)
+            # The least recently used file is removed
+            cache.get(os.path.join(self.cwd, "files/test.html"))
+            cache.get(os.path.join(self.cwd, "files/test.css"))
+            self.assertTrue(fn not in cache.cache)
+        finally:
+            os.remove(fn)
+            
+    def test_memory_cache_missing(self):
+        """Test missing files do not remove cached files and a file
+        requested concurrently is loaded once"""
+        import threading
+        from levitas.lib import filecache
+        
+        fn = os.path.join(self.cwd, "files/test.html")
+        cache = filecache.FileCache(2048, interval=0, missing_size=2)
+        entry = cache.get(fn)
+        for i in range(100):
+            self.assertTrue(cache.get(fn + str(i)).stat is None)
+        self.assertTrue(cache.get(fn) is entry)
+        self.assertEqual(len(cache.missing), 2)
+        
+        loaded = []
+        cached_file = filecache.CachedFile
+        
+        class SlowFile(cached_file):
+            
+            def __init__(self, *args):
+                loaded.append(args[0])
+                time.sleep(0.2)
+                cached_file.__init__(self, *args)
+                
+        filecache.CachedFile = SlowFile
+        try:
+            cache.clear()
+            entries = []
+            threads = [threading.Thread(target=lambda: entries.append(cache.get(fn)))
+                       for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            filecache.CachedFile = cached_file
+        self.assertEqual(loaded, [fn])
+        self.assertEqual(len(entries), 4)
+        self.assertTrue(all(e is entries[0] for e in entries))
+        
+    def test_precompressed(self):
+        """Test gzip sidecars are sent to clients accepting gzip"""
+        from levitas.lib.assets import precompress
+        
+        fn = os.path.join(self.cwd, "files/precompressed.js")
+        content = b"var a = 1;\n" * 100
+        f = open(fn, "wb")
+        f.write(content)
+        f.close()
+        try:
+            self.assertEqual(precompress(os.path.dirname(fn), processes=1),
+                             [fn + ".gz"])
+            self.assertEqual(precompress(os.path.dirname(fn)), [])
+            
+            self.headers["Accept-Encoding"] = "gzip"
+            obj = self._request("gz/precompressed.js")
+            info = obj.info()
+            data = obj.read()
+            self.assertEqual(info["Content-Encoding"], "gzip")
+            self.assertEqual(info["Vary"], "Accept-Encoding")
+            self.assertEqual(info["Content-Length"], str(len(data)))
+            self.assertEqual(gzip.GzipFile(fileobj=BytesIO(data)).read(),
+                             content)
+            
+            del self.headers["Accept-Encoding"]
+            obj = self._request("gz/precompressed.js")
+            self.assertTrue(obj.info()["Content-Encoding"] is None)
+            self.assertEqual(obj.read(), content)
+            
+            # A stale sidecar is not sent
+            self.headers["Accept-Encoding"] = "gzip"
+            mtime = os.path.getmtime(fn + ".gz")
+            os.utime(fn, (mtime + 10, mtime + 10))
+            obj = self._request("gz/precompressed.js")
+            self.assertTrue(obj.info()["Content-Encoding"] is None)
+            self.assertEqual(obj.read(), content)
+        finally:
+            os.remove(fn)
+            if os.path.exists(fn + ".gz"):
+                os.remove(fn + ".gz")
+        
+    def test_static_index(self):
+        """Test the index is updated, when a directory changes"""
+        import shutil
+        from levitas.lib.staticindex import StaticIndex
+        
+        root = os.path.join(self.cwd, "files/indexed")
+        os.makedirs(os.path.join(root, "sub"))
+        try:
+            f = open(os.path.join(root, "sub", "index.htm"), "wb")
+            f.write(b"<html></html>")
+            f.close()
+            index = StaticIndex(root, interval=60)
+            entry = index.lookup(os.path.join(root, "sub/"))
+            self.assertEqual(entry.index, os.path.join(root, "sub", "index.htm"))
+            entry = index.lookup(entry.index)
+            self.assertEqual(entry.stat.st_size, 13)
+            self.assertEqual(entry.memo["ctype"], "text/html")
+            self.assertTrue(index.lookup(os.path.join(root, "a.css")) is None)
+            
+            f = open(os.path.join(root, "a.css"), "wb")
+            f.write(b"a {}")
+            f.close()
+            shutil.rmtree(os.path.join(root, "sub"))
+            # Unchanged until the next check
+            self.assertTrue(index.lookup(os.path.join(root, "a.css")) is None)
+            index.interval = 0
+            # The mtime resolution of some filesystems is one second
+            os.utime(root, (time.time() + 5, time.time() + 5))
+            time.sleep(0.01)
+            entry = index.lookup(os.path.join(root, "a.css"))
+            self.assertEqual(entry.memo["ctype"], "text/css")
+            self.assertTrue(index.lookup(os.path.join(root, "sub")) is None)
+            self.assertTrue(index.lookup(os.path.join(root, "sub/index.htm"))
+                            is None)
+        finally:
+            shutil.rmtree(root)
+    
+    def test_symlinks(self):
+        """Test symbolic links are only followed below the path"""
+        import tempfile
+        
+        outside = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+        outside.write(b"secret")
+        outside.close()
+        escape = os.path.join(self.cwd, "files/escape.txt")
+        link = os.path.join(self.cwd, "files/link.png")
+        lib = os.path.join(self.cwd, "files/lib")
+        vendor = os.path.join(self.cwd, "files/vendor")
+        escape_dir = os.path.join(self.cwd, "files/escape")
+        os.symlink(outside.name, escape)
+        os.symlink("testfile.png", link)
+        # Larger than the files of the memory cache
+        content = b"var app;\n" * 30000
+        os.mkdir(lib)
+        with open(os.path.join(lib, "app.js"), "wb") as f:
+            f.write(content)
+        os.symlink("lib", vendor)
+        os.symlink(os.path.dirname(outside.name), escape_dir)
+        try:
+            obj = self._request("escape.txt")
+            self.assertEqual(obj.code, 404)
+            obj = self._request("link.png")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.info()["Content-Type"], "image/png")
+            obj = self._request("vendor/app.js")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.read(), content)
+            obj = self._request("escape/" + os.path.basename(outside.name))
+            self.assertEqual(obj.code, 404)
+        finally:
+            os.remove(escape)
+            os.remove(link)
+            os.remove(vendor)
+            os.remove(escape_dir)
+            os.remove(os.path.join(lib, "app.js"))
+            os.rmdir(lib)
+            os.remove(outside.name)
+    
+    def test_replaced_symlink(self):
+        """Test a replaced symbolic link of the path is followed"""
+        import shutil
+        import tempfile
+        
+        versions = tempfile.mkdtemp()
+        current = os.path.join(self.cwd, "current")
+        # Larger than the files of the memory cache
+        contents = (b"1" * 300000, b"2" * 400000)
+        try:
+            for i, content in enumerate(contents):
+                os.mkdir(os.path.join(versions, str(i)))
+                with open(os.path.join(versions, str(i), "file.txt"), "wb") as f:
+                    f.write(content)
+            os.symlink(os.path.join(versions, "0"), current)
+            obj = self._request("current/file.txt")
+            self.assertEqual(obj.read(), contents[0])
+            
+            tmp = current + ".tmp"
+            os.symlink(os.path.join(versions, "1"), tmp)
+            os.rename(tmp, current)
+            obj = self._request("current/file.txt")
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.info()["Content-Length"], str(len(contents[1])))
+            self.assertEqual(obj.read(), contents[1])
+        finally:
+            if os.path.lexists(current):
+                os.remove(current)
+            shutil.rmtree(versions)
+        
+    def test_fingerprints(self):
+        """Test fingerprinted names are sent immutable"""
+        from levitas.lib.assets import fingerprint, ASSET_MANIFEST
+        
+        root = os.path.join(self.cwd, "files")
+        fn = os.path.join(root, "fingerprinted.js")
+        f = open(fn, "wb")
+        f.write(b"var a = 1;")
+        f.close()
+        try:
+            files = fingerprint(root, processes=1)
+            entry = files["fingerprinted.js"]
+            self.assertEqual(entry["path"],
+                             "fingerprinted.%s.js" % entry["hash"][:8])
+            # Unchanged files keep their hash
+            os.utime(fn, (entry["mtime"], entry["mtime"]))
+            self.assertEqual(fingerprint(root)["fingerprinted.js"], entry)
+            
+            obj = self._request("fp/" + entry["path"])
+            self.assertEqual(obj.code, 200)
+            self.assertEqual(obj.info()["Cache-Control"],
+                             "max-age=31536000, immutable")
+            self.assertEqual(obj.read(), b"var a = 1;")
+            obj = self._request("fp/fingerprinted.js")
+            self.assertEqual(obj.code, 200)
+            self.assertTrue("immutable" not in obj.info()["Cache-Control"])
+            
+            # The manifest is not sent
+            self.assertEqual(self._request("fp/" + ASSET_MANIFEST).code, 404)
+            self.assertEqual(self._request(ASSET_MANIFEST).code, 404)
+            
+            # The fingerprint does not match a modified file
+            f = open(fn, "wb")
+            f.write(b"var a = 2;;")
+            f.close()
+            obj = self._request("fp/" + entry["path"])
+            self.assertEqual(obj.code, 404)
+        finally:
+            os.remove(fn)
+            os.remove(os.path.join(root, ASSET_MANIFEST))
+    
     
 def run():
     return test.run(SETTINGS, FileMiddlewareTest)
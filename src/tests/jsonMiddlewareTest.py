@@ -26,9 +26,10 @@ log = logging.getLogger("levitas.tests.jsonrpc_test")
 SETTINGS = \
 """
 from levitas.middleware.jsonMiddleware import JSONMiddleware
-from tests.jsonMiddlewareTest import TestService
+from tests.jsonMiddlewareTest import TestService, SmallService
 urls = [
-(r"^/json/runtest$", JSONMiddleware, TestService)
+(r"^/json/runtest$", JSONMiddleware, TestService),
+(r"^/json/small$", JSONMiddleware, SmallService)
 ]
 """
    
@@ -46,6 +47,17 @@ class TestService:
     
     def utf8(self, text):
         return text
+    
+    def failing(self):
+        return len(None)
+    
+    def _private(self):
+        return "private"
+
+
+class SmallService(TestService):
+    
+    max_body_size = 100
 
 
 class JsonMiddlewareTest(BaseTest):
@@ -70,12 +82,19 @@ class JsonMiddlewareTest(BaseTest):
         self.assertEqual(obj["result"], "OK")
     
     def test_missing_id(self):
-        """Test no id given error code"""
-        data = '{"jsonrpc":"2.0", "method":"get"}'
+        """Test a notification without id is not answered"""
+        self.headers["Content-type"] = "application/json-rpc"
+        data = '{"jsonrpc":"2.0", "method":"getArg"}'
+        response = self._request("json/runtest", data.encode("utf-8"))
+        self.assertEqual(response.code, 204)
+        self.assertEqual(response.read(), b"")
+        
+        # Notifications are left out of batch responses
+        data = '[{"jsonrpc":"2.0","method":"getArg"},' \
+               ' {"jsonrpc":"2.0","id":"ID01","method":"getArg"}]'
         obj = self._request_json(data)
-        #print(obj)
-        self.assertTrue("error" in obj, str(obj))
-        self.assertEqual(obj["error"]["code"], -32600)
+        self.assertEqual(len(obj), 1, str(obj))
+        self.assertEqual(obj[0]["id"], "ID01")
         
     def test_unknown_method(self):
         """Test unknown method error code"""
@@ -150,6 +169,235 @@ class JsonMiddlewareTest(BaseTest):
         self.assertTrue("result" in obj, str(obj))
         self.assertEqual(obj["result"], UTF8_CHARS)
         
+    def test_batch(self):
+        """Test the responses of a batch are in the order of the calls"""
+        data = '[{"jsonrpc":"2.0","id":1,"method":"setArgs","params":["a","b","c"]},' \
+               ' {"jsonrpc":"2.0","id":2,"method":"setArgs","params":["a"]},' \
+               ' 1,' \
+               ' {"jsonrpc":"2.0","id":3,"method":"getArg"}]'
+        obj = self._request_json(data)
+        self.assertEqual(len(obj), 4, str(obj))
+        self.assertEqual(obj[0]["result"], "Args: a, b, c")
+        self.assertEqual(obj[1]["error"]["code"], -32602)
+        self.assertEqual(obj[2]["error"]["code"], -32600)
+        self.assertEqual(obj[3]["id"], 3)
+        self.assertEqual(obj[3]["result"], "OK")
+        
+        obj = self._request_json("[]")
+        self.assertEqual(obj["error"]["code"], -32600)
+        
+        call = '{"jsonrpc":"2.0","id":1,"method":"getArg"}'
+        obj = self._request_json("[%s]" % ", ".join([call] * 33))
+        self.assertEqual(obj["error"]["code"], -32600)
+        
+    def test_notification_queue(self):
+        """Test the overflow policies of the notification queue"""
+        from threading import Event
+        from levitas.lib.workqueue import WorkQueue
+        
+        started = Event()
+        release = Event()
+        done = []
+        
+        def block():
+            started.set()
+            release.wait(5)
+            
+        queue = WorkQueue(threads=1, maxsize=1, overflow="drop")
+        self.assertTrue(queue.submit(block))
+        started.wait(5)
+        self.assertTrue(queue.submit(done.append, 1))
+        self.assertFalse(queue.submit(done.append, 2))
+        release.set()
+        queue.join()
+        self.assertEqual(done, [1])
+        stats = queue.stats()
+        self.assertEqual(stats["completed"], 2)
+        self.assertEqual(stats["dropped"], 1)
+        self.assertEqual(stats["queued"], 0)
+        
+        started.clear()
+        release.clear()
+        queue = WorkQueue(threads=1, maxsize=1, overflow="caller")
+        queue.submit(block)
+        started.wait(5)
+        queue.submit(done.append, 3)
+        queue.submit(done.append, 4)
+        # Executed in the calling thread
+        self.assertEqual(done, [1, 4])
+        release.set()
+        queue.join()
+        self.assertEqual(queue.stats()["caller"], 1)
+        
+    def test_inline_notifications(self):
+        """Test notifications of a batch without queue use their own service"""
+        import time
+        from threading import Lock
+        from multiprocessing.pool import ThreadPool
+        from levitas.middleware.jsonMiddleware import ServiceHandler
+        
+        lock = Lock()
+        services = []
+        overlapping = []
+        
+        class Service(object):
+            
+            def __init__(self):
+                self.calls = 0
+                with lock:
+                    services.append(self)
+                    
+            def call(self):
+                self.calls += 1
+                if self.calls > 1:
+                    overlapping.append(self)
+                time.sleep(0.05)
+                self.calls -= 1
+                
+        pool = ThreadPool(4)
+        try:
+            handler = ServiceHandler(Service(), service_factory=Service,
+                                     pool=pool, notifications=None)
+            data = '[%s]' % ",".join(['{"jsonrpc":"2.0","method":"call"}'] * 4)
+            self.assertEqual(handler.handleData(data), None)
+        finally:
+            pool.close()
+        self.assertEqual(overlapping, [])
+        self.assertEqual(len(services), 5)
+        self.assertEqual(services[0].calls, 0)
+        
+    def test_queued_notifications(self):
+        """Test queued notifications have no middleware"""
+        from levitas.lib.workqueue import WorkQueue
+        from levitas.middleware.jsonMiddleware import ServiceHandler
+        
+        middlewares = []
+        
+        class Service(object):
+            
+            def __init__(self):
+                self.middleware = "request"
+                
+            def call(self):
+                middlewares.append(self.middleware)
+                
+        data = '{"jsonrpc":"2.0","method":"call"}'
+        handler = ServiceHandler(Service(), service_factory=Service,
+                                 notifications=None)
+        handler.handleData(data)
+        queue = WorkQueue(threads=1, maxsize=10, overflow="block")
+        handler = ServiceHandler(Service(), service_factory=Service,
+                                 notifications=queue)
+        handler.handleData(data)
+        queue.join()
+        self.assertEqual(middlewares, ["request", None])
+        
+    def test_codecs(self):
+        """Test the codecs encode UTF-8 bytes and fall back to json"""
+        from levitas.lib.jsoncodec import CODECS, get_codec
+        
+        self.assertTrue(get_codec("auto") is get_codec("auto"))
+        self.assertRaises(ValueError, get_codec, "unknown")
+        for name in CODECS:
+            if not CODECS[name][1]:
+                self.assertRaises(ImportError, get_codec, name)
+                continue
+            codec = get_codec(name)
+            data = codec.encode({"text": UTF8_CHARS, "big": 2 ** 70})
+            self.assertTrue(isinstance(data, bytes))
+            self.assertTrue(u"Grüße".encode("utf-8")
+                            in codec.encode([u"Grüße"]))
+            self.assertEqual(codec.decode(data),
+                             {"text": UTF8_CHARS, "big": 2 ** 70})
+            # Control characters in strings are accepted
+            self.assertEqual(codec.decode(b'["a\tb"]'), ["a\tb"])
+        
+    def test_request_body(self):
+        """Test percent signs are kept and large bodies are rejected"""
+        data = '{"jsonrpc":"2.0","id":"ID01","method":"utf8","params":["100%25 %"]}'
+        obj = self._request_json(data)
+        self.assertEqual(obj["result"], "100%25 %")
+        
+        self.headers["Content-type"] = "application/json-rpc"
+        data = '{"jsonrpc":"2.0","id":"ID01","method":"utf8","params":["%s"]}' \
+            % ("x" * 100)
+        response = self._request("json/small", data.encode("utf-8"))
+        self.assertEqual(response.code, 413)
+        
+        # Negative Content-Length
+        import socket
+        sock = socket.create_connection(("localhost", 8987))
+        try:
+            sock.sendall(b"POST /json/runtest HTTP/1.0\r\n"
+                         b"Content-Type: application/json-rpc\r\n"
+                         b"Content-Length: -5\r\n\r\n")
+            status = sock.recv(1024).split(b"\r\n")[0]
+        finally:
+            sock.close()
+        self.assertTrue(b" 400 " in status, status)
+        
+    def test_registry(self):
+        """Test private methods are hidden and errors of methods are internal"""
+        data = '{"jsonrpc":"2.0","id":"ID01","method":"_private"}'
+        obj = self._request_json(data)
+        self.assertEqual(obj["error"]["code"], -32601, str(obj))
+        
+        data = '{"jsonrpc":"2.0","id":"ID01","method":"failing"}'
+        obj = self._request_json(data)
+        self.assertEqual(obj["error"]["code"], -32603, str(obj))
+        self.assertEqual(obj["error"]["data"]["exception"], "TypeError")
+        
+        data = '{"jsonrpc":"2.0","id":"ID01","method":"setNamedArgs","params":{"arg2":"b"}}' # @IgnorePep8
+        obj = self._request_json(data)
+        self.assertEqual(obj["result"], "Args: arg1, b, arg3", str(obj))
+        
+    def test_registry_signatures(self):
+        """Test the arguments are checked against the signatures"""
+        from levitas.lib.serviceregistry import get_registry
+        
+        class Service(TestService):
+            
+            max_body_size = 100
+            
+            @staticmethod
+            def add(a, b=1):
+                return a + b
+            
+            @classmethod
+            def name(cls, *args):
+                return cls.__name__
+            
+            def options(self, a, **kwargs):
+                return kwargs
+            
+            def va(*args):
+                return len(args)
+            
+        registry = get_registry(Service)
+        self.assertTrue(registry is get_registry(Service))
+        self.assertFalse("_private" in registry)
+        self.assertFalse("max_body_size" in registry)
+        
+        add = registry.get("add")
+        self.assertEqual(add.check([1]), None)
+        self.assertTrue(add.check([]))
+        self.assertTrue(add.check([1, 2, 3]))
+        self.assertTrue(add.check({"b": 2}))
+        self.assertEqual(add.call(Service(), {"a": 1, "b": 2}), 3)
+        
+        name = registry.get("name")
+        self.assertEqual(name.check(list(range(10))), None)
+        self.assertEqual(name.call(Service(), []), "Service")
+        
+        va = registry.get("va")
+        self.assertEqual(va.check([1, 2]), None)
+        self.assertEqual(va.call(Service(), [1, 2]), 3)
+        
+        options = registry.get("options")
+        self.assertEqual(options.check({"a": 1, "b": 2}), None)
+        self.assertTrue(options.check({"b": 2}))
+        self.assertEqual(options.call(Service(), {"a": 1, "b": 2}), {"b": 2})
+        
         
 def run():
     return test.run(SETTINGS, JsonMiddlewareTest)
@@ -59,7 +59,9 @@ from tests.middlewareTest import (Test_none_result,
                                   Test_charset,
                                   Test_invalid_result,
                                   Test_addHeader,
+                                  Test_setHeader,
                                   Test_response_error,
+                                  Test_response_generator,
                                   Test_response_redirect,
                                   Test_redirected,
                                   Test_response_file,
@@ -71,7 +73,10 @@ from tests.middlewareTest import (Test_none_result,
                                   Test_get_signed_cookie,
                                   Test_get_args,
                                   Test_post_args,
-                                  Test_post_fileupload)
+                                  Test_post_fileupload,
+                                  Test_pooled,
+                                  function_handler,
+                                  function_handler_tuple)
 from levitas.lib.levitasFieldStorage import LevitasFieldStorage
                                    
 cookie_secret = "mysecret"
@@ -88,7 +93,9 @@ urls = [
 (r"^/charset", Test_charset),
 (r"^/invalid_result", Test_invalid_result),
 (r"^/addHeader", Test_addHeader),
+(r"^/setHeader", Test_setHeader),
 (r"^/responseError", Test_response_error),
+(r"^/response_generator", Test_response_generator),
 (r"^/redirect", Test_response_redirect),
 (r"^/redirected", Test_redirected),
 (r"^/response_file", Test_response_file),
@@ -101,6 +108,9 @@ urls = [
 (r"^/get_args", Test_get_args),
 (r"^/post_args", Test_post_args),
 (r"^/post_fileupload", Test_post_fileupload),
+(r"^/pooled", Test_pooled),
+(r"^/function$", function_handler),
+(r"^/function/(.*)", function_handler_tuple, {"text": "Hello"}),
 ]
 """
 
@@ -178,6 +188,23 @@ class Test_addHeader(Middleware):
         return
     
     
+class Test_setHeader(Middleware):
+    
+    def get(self):
+        self.set_content_type("text/html")
+        self.setHeader("content-type", "text/plain")
+        self.addHeader("Test-Header", "Value1")
+        self.addHeader("test-header", "Value2")
+        return
+    
+    
+class Test_response_generator(Middleware):
+    
+    def get(self):
+        for i in range(3):
+            yield "line %d\n" % i
+    
+    
 class Test_response_error(Middleware):
     
     def get(self):
@@ -295,6 +322,27 @@ class Test_post_fileupload(Middleware):
         return result
     
     
+class Test_pooled(Middleware):
+    
+    POOL_SIZE = 1
+    
+    def get(self):
+        if self.request_data and "cookie" in self.request_data:
+            self.set_cookie("testcookie", "testvalue")
+        return str(len(self.response_headers))
+    
+    
+def function_handler(request):
+    if request.getHeader("X-Echo"):
+        return request.getHeader("X-Echo")
+    return u"function"
+
+
+def function_handler_tuple(request, text):
+    return (201, {"Content-Type": "text/plain"},
+            "%s %s" % (text, request.url_groups()[0]))
+    
+    
 class MiddlewareTest(BaseTest):
     
     def test_handler_404(self):
@@ -357,6 +405,20 @@ class MiddlewareTest(BaseTest):
         headers = obj.headers
         self.assertTrue(headers["Test-Header"] == "Test-Value", str(obj))
         
+    def test_setHeader(self):
+        """Test headers are replaced case-insensitive"""
+        obj = self._request("setHeader")
+        headers = obj.headers
+        self.assertEqual(headers.get_all("Content-Type"), ["text/plain"])
+        self.assertEqual(headers.get_all("Test-Header"), ["Value1", "Value2"])
+        
+    def test_response_generator(self):
+        """Test a generator result is streamed without Content-Length"""
+        obj = self._request("response_generator")
+        self.assertTrue(obj.code == 200, str(obj))
+        self.assertTrue(obj.headers.get("Content-Length") is None)
+        self.assertEqual(obj.read(), b"line 0\nline 1\nline 2\n")
+        
     def test_response_error(self):
         """Test response error"""
         obj = self._request("responseError")
@@ -390,6 +452,13 @@ class MiddlewareTest(BaseTest):
         data = obj.read()
         self.assertTrue(data == b"testvalue", data)
     
+    def test_get_cookie_malformed(self):
+        """Test get a cookie from a malformed cookie header"""
+        self.headers["Cookie"] = 'a b=1; ; =x; testcookie=testvalue; c="d'
+        obj = self._request("get_cookie")
+        data = obj.read()
+        self.assertTrue(data == b"testvalue", data)
+        
     def test_set_cookie(self):
         """Test set a cookie"""
         obj = self._request("set_cookie")
@@ -532,7 +601,42 @@ class MiddlewareTest(BaseTest):
             data = type(obj)
         
         self.assertEqual(data, b"OK", data)
-   
+
+    def test_pooled(self):
+        """Test a pooled middleware does not keep request state"""
+        obj = self._request("pooled?cookie=1")
+        self.assertTrue(obj.info()["Set-Cookie"] is not None, str(obj))
+        obj = self._request("pooled")
+        self.assertTrue(obj.info()["Set-Cookie"] is None, str(obj))
+        self.assertEqual(obj.read(), b"0")
+        
+    def test_pooled_error(self):
+        """Test a pooled middleware raising an error is released"""
+        from levitas.factory import MiddlewareFactory
+        
+        class Failing(Test_pooled):
+            
+            def __call__(self, environ, start_response):
+                raise RuntimeError("failed")
+            
+        factory = MiddlewareFactory(r"^/failing", Failing)
+        self.assertRaises(RuntimeError, factory, {}, None,
+                          factory.match("/failing"))
+        self.assertEqual(len(factory._pool), 1)
+        
+    def test_function(self):
+        """Test a function handler"""
+        obj = self._request("function")
+        self.assertEqual(obj.read(), b"function")
+        self.headers["X-Echo"] = "echo"
+        obj = self._request("function")
+        self.assertEqual(obj.read(), b"echo")
+        del self.headers["X-Echo"]
+        obj = self._request("function/World")
+        self.assertEqual(obj.code, 201, str(obj))
+        self.assertEqual(obj.info()["Content-Type"], "text/plain")
+        self.assertEqual(obj.read(), b"Hello World")
+        
         
 def run():
     return test.run(SETTINGS, MiddlewareTest)
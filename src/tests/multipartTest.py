@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+from io import BytesIO
+
+from levitas.lib.multipart import (MultipartFormData,
+                                   MultipartError,
+                                   parse_header)
+
+
+log = logging.getLogger("levitas.tests.multipartTest")
+
+
+BOUNDARY = "----------ThIs_Is_tHe_bouNdaRY_$"
+
+
+def encode(fields, files, boundary=BOUNDARY):
+    lines = []
+    for name, value in fields:
+        lines.append(b"--" + boundary.encode())
+        lines.append(('Content-Disposition: form-data; name="%s"'
+                      % name).encode())
+        lines.append(b"")
+        lines.append(value)
+    for name, filename, content in files:
+        lines.append(b"--" + boundary.encode())
+        lines.append(('Content-Disposition: form-data; name="%s"; '
+                      'filename="%s"' % (name, filename)).encode())
+        lines.append(b"Content-Type: application/octet-stream")
+        lines.append(b"")
+        lines.append(content)
+    lines.append(b"--" + boundary.encode() + b"--")
+    lines.append(b"")
+    return b"\r\n".join(lines)
+
+
+def environ(body, boundary=BOUNDARY):
+    return {"wsgi.input": BytesIO(body),
+            "CONTENT_TYPE": 'multipart/form-data; boundary="%s"' % boundary,
+            "CONTENT_LENGTH": str(len(body))}
+
+
+class SmallBlocks(MultipartFormData):
+    
+    BLOCKSIZE = 7
+    MEMORY_LIMIT = 16
+    
+    
+class MultipartTest(unittest.TestCase):
+    
+    def test_parse_header(self):
+        """Test parameters with quotes and semicolons are parsed"""
+        key, params = parse_header('form-data; name="a;b"; filename="x\\"y"')
+        self.assertEqual(key, "form-data")
+        self.assertEqual(params, {"name": "a;b", "filename": 'x"y'})
+        
+    def test_fields_and_files(self):
+        """Test fields and files are parsed"""
+        content = os.urandom(1000) + b"\r\n--" + os.urandom(1000)
+        body = encode([("a", b"1"), ("b", u"ä".encode("utf-8")), ("a", b"2")],
+                      [("file", "test.bin", content)])
+        for cls in (MultipartFormData, SmallBlocks):
+            data = cls(environ=environ(body), keep_blank_values=True)
+            self.assertEqual(data.keys(), ["a", "b", "file"])
+            self.assertEqual(data.getvalue("a"), ["1", "2"])
+            self.assertEqual(data["b"].value, u"ä")
+            self.assertTrue(data["b"].filename is None)
+            f = data["file"]
+            self.assertEqual(f.filename, "test.bin")
+            self.assertEqual(f.type, "application/octet-stream")
+            self.assertEqual(f.file.read(), content)
+            
+    def test_large_field(self):
+        """Test a large field is moved to a temporary file"""
+        body = encode([("a", b"x" * 100)], [])
+        data = SmallBlocks(environ=environ(body))
+        self.assertFalse(isinstance(data["a"].file, BytesIO))
+        self.assertEqual(data["a"].value, "x" * 100)
+        
+    def test_blank_values(self):
+        """Test empty fields are skipped without keep_blank_values"""
+        body = encode([("a", b""), ("b", b"1")], [])
+        self.assertEqual(MultipartFormData(environ=environ(body)).keys(),
+                         ["b"])
+        data = MultipartFormData(environ=environ(body),
+                                 keep_blank_values=True)
+        self.assertEqual(data.getvalue("a"), "")
+        
+    def test_upload_path(self):
+        """Test files are written to upload_path without directories"""
+        upload_path = tempfile.mkdtemp()
+        try:
+            body = encode([], [("file", "../../evil.txt", b"data")])
+            MultipartFormData(environ=environ(body), upload_path=upload_path)
+            path = os.path.join(upload_path, "evil.txt")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"data")
+        finally:
+            shutil.rmtree(upload_path)
+            
+    def test_upload_without_name(self):
+        """Test files without a usable name are written to temporary files"""
+        upload_path = tempfile.mkdtemp()
+        try:
+            for filename, content in (("", b""), ("..", b"data"),
+                                      ("a/.", b"data")):
+                body = encode([], [("file", filename, content)])
+                data = MultipartFormData(environ=environ(body),
+                                         upload_path=upload_path)
+                self.assertEqual(data["file"].filename, filename)
+                self.assertEqual(data["file"].value, content)
+            self.assertEqual(os.listdir(upload_path), [])
+        finally:
+            shutil.rmtree(upload_path)
+            
+    def test_truncated(self):
+        """Test a truncated body raises an error with strict_parsing"""
+        body = encode([("a", b"1")], [])[:-4]
+        data = MultipartFormData(environ=environ(body))
+        self.assertEqual(data.getvalue("a"), "1")
+        self.assertRaises(MultipartError, MultipartFormData,
+                          environ=environ(body), strict_parsing=True)
+        
+    def test_no_boundary(self):
+        """Test a missing boundary raises an error"""
+        env = environ(b"")
+        env["CONTENT_TYPE"] = "multipart/form-data"
+        self.assertRaises(MultipartError, MultipartFormData, environ=env)
+        
+        
+def run():
+    suite = unittest.TestLoader().loadTestsFromTestCase(MultipartTest)
+    return unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+if __name__ == "__main__":
+    run()
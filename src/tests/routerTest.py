@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2010-2014 Tobias Weber <tobi-weber@gmx.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import logging
+
+from levitas.factory import (MiddlewareFactory,
+                             MiddlewareRouter,
+                             literal_prefix)
+from levitas.middleware import Middleware
+from levitas.lib.lrucache import LRUCache
+
+
+log = logging.getLogger("levitas.tests.routerTest")
+
+
+URLS = [
+(r"^/json/orders$", "orders"),
+(r"^/json/(.*)", "json"),
+(r"^/static/(.*)", "static"),
+(r"^/(a)/\1", "backref"),
+(r"(?!/json/.*)^/.*$", "app"),
+]
+
+
+class RouterTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.factories = []
+        for pattern, name in URLS:
+            factory = MiddlewareFactory(pattern, Middleware)
+            factory.name = name
+            self.factories.append(factory)
+        self.router = MiddlewareRouter(self.factories)
+        
+    def _linear(self, path):
+        for factory in self.factories:
+            m = factory.match(path)
+            if m is not None:
+                return factory, m
+        return None, None
+    
+    def test_first_match_wins(self):
+        """Test the router matches like a linear scan"""
+        for path in ("/json/orders", "/json/orders/1", "/static/app.js",
+                     "/a/a", "/a/b", "/index.html", "/"):
+            factory, m = self.router.match(path)
+            expected, em = self._linear(path)
+            self.assertTrue(factory is expected, path)
+            self.assertEqual(m.groups(), em.groups(), path)
+            
+    def test_groups(self):
+        """Test the match groups of the matching pattern"""
+        factory, m = self.router.match("/static/css/app.css")
+        self.assertEqual(factory.name, "static")
+        self.assertEqual(m.groups(), ("css/app.css",))
+        
+    def test_no_match(self):
+        """Test no factory is found"""
+        factory, m = self.router.match("json")
+        self.assertTrue(factory is None and m is None)
+        
+    def test_added_factory(self):
+        """Test factories added later are compiled"""
+        self.router.match("/")
+        factory = MiddlewareFactory(r"^json$", Middleware)
+        self.factories.append(factory)
+        self.assertTrue(self.router.match("json")[0] is factory)
+        
+    def test_literal_prefix(self):
+        """Test literal prefixes of url patterns"""
+        self.assertEqual(literal_prefix(r"^/json/orders$"), "/json/orders")
+        self.assertEqual(literal_prefix(r"^/static/(.*)$"), "/static/")
+        self.assertEqual(literal_prefix(r"^/app\.js$"), "/app.js")
+        self.assertEqual(literal_prefix(r"^/jsonx?$"), "/json")
+        self.assertEqual(literal_prefix(r"(?!/json/.*)^/.*$"), "")
+        self.assertEqual(literal_prefix(r"^/a|^/b$"), "")
+        
+    def test_many_routes(self):
+        """Test lookup in a large url table"""
+        factories = []
+        for i in range(2000):
+            factories.append(MiddlewareFactory(r"^/json/service%d$" % i,
+                                               Middleware))
+        router = MiddlewareRouter(factories)
+        for i in (0, 10, 100, 1999):
+            factory, m = router.match("/json/service%d" % i)
+            self.assertTrue(factory is factories[i], str(i))
+        self.assertTrue(router.match("/json/service2000")[0] is None)
+        
+    def test_route_cache(self):
+        """Test cached match results"""
+        router = MiddlewareRouter(self.factories, cache_size=2)
+        factory, m = router.resolve("/static/a/../app.js")
+        self.assertEqual(factory.name, "static")
+        self.assertEqual(m.groups(), ("app.js",))
+        self.assertTrue(router.resolve("/static/a/../app.js")[1] is m)
+        factory = MiddlewareFactory(r"^/static/app.js$", Middleware)
+        self.factories.insert(0, factory)
+        router.compile()
+        self.assertTrue(router.resolve("/static/a/../app.js")[0] is factory)
+        
+    def test_lru_cache(self):
+        """Test the least recently used entry is removed"""
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertTrue("a" in cache and "c" in cache)
+        self.assertFalse("b" in cache)
+        
+        
+def run():
+    suite = unittest.TestLoader().loadTestsFromTestCase(RouterTest)
+    return unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+if __name__ == "__main__":
+    run()
@@ -17,7 +17,7 @@ import sys
 import os
 import imp
 from threading import Thread
-from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from wsgiref.simple_server import make_server, WSGIServer
 try:
     from urllib import request  # python 3
 except ImportError:
@@ -25,6 +25,7 @@ except ImportError:
 
 from levitas.handler import WSGIHandler
 from levitas.lib.settings import Settings
+from levitas.server.testServer import SendfileRequestHandler
 
 
 def init_settings(SETTINGS):
@@ -41,7 +42,7 @@ class TestWSGIServer(WSGIServer):
         pass
     
     
-class TestWSGIRequestHandler(WSGIRequestHandler):
+class TestWSGIRequestHandler(SendfileRequestHandler):
     
     def log_message(self, format, *args):  # @ReservedAssignment
         pass
@@ -63,6 +64,7 @@ class WSGIServerThread(Thread):
         httpd.socket.settimeout(0)
         while self._running:
             httpd.handle_request()
+        httpd.server_close()
         
     def stop(self):
         opener = request.build_opener()
@@ -70,9 +72,11 @@ class WSGIServerThread(Thread):
         try:
             self._running = False
             req = request.Request(url)
-            opener.open(req)
+            # The server thread may already have left its loop
+            opener.open(req, timeout=1)
         except Exception as err:
             pass
+        self.join()
         
         
         